@@ -0,0 +1,255 @@
+# analytics.py - snapshot Parquet (theo tháng) của Trip/Payment/Cost cho phân tích tháng/năm, không đụng DB chính
+# Job đêm (`flask --app manage analytics-snapshot`) ghi các ngày đã đóng (< hôm nay) còn thiếu, chỉ thêm file mới:
+#   <ANALYTICS_DIR>/<bảng>/month=YYYY-MM/part-YYYYMMDD-YYYYMMDD.parquet
+#   <ANALYTICS_DIR>/_state.json     ngày cuối đã ghi của từng bảng (watermark)
+# Mỗi file ghi ra .tmp rồi rename, watermark cập nhật sau mỗi file; file sau watermark (job chết giữa chừng)
+# bị xóa ở lần chạy sau nên không trùng dòng.
+# Dữ liệu đến muộn (/driver/sync gửi ended_at/received_at theo giờ trên điện thoại lúc mất sóng):
+#   - ngày chỉ được coi là đóng sau ANALYTICS_CLOSE_DAYS ngày;
+#   - mỗi lần chạy, các tháng có ngày trong ANALYTICS_RECHECK_DAYS ngày trước watermark được đếm lại trong DB;
+#     lệch số dòng với Parquet -> ghi lại cả tháng đó (tới watermark).
+# Sửa dữ liệu cũ hơn cửa sổ này cần `analytics-snapshot --rebuild`.
+# Báo cáo: aggregate("trips", by=["driver", "month"], start, end) -> DataFrame, groupby vector hóa bằng pandas.
+# Cần pandas + pyarrow; chỉ import khi dùng (xem factory.py).
+import glob
+import json
+import os
+import shutil
+from datetime import date, datetime, timedelta
+
+from models import db
+import exports
+
+SNAPSHOT_DIR = os.getenv("ANALYTICS_DIR", "analytics")
+STATE_FILE = "_state.json"
+CLOSE_DAYS = int(os.getenv("ANALYTICS_CLOSE_DAYS", "2"))
+RECHECK_DAYS = int(os.getenv("ANALYTICS_RECHECK_DAYS", "35"))
+
+# bảng -> (cột ngày, kiểu cột cho pandas; id có thể NULL -> Int64)
+TABLES = {
+    "trips": ("ended_at", {
+        "id": "int64", "status": "string", "sales_id": "Int64", "driver_id": "Int64", "car_id": "Int64",
+        "started_at": "datetime64[ns]", "ended_at": "datetime64[ns]", "origin": "string", "destination": "string",
+        "distance_km": "float64", "fare_quote": "float64", "final_fare": "float64", "payment_method": "string",
+        "cash_collected": "float64",
+    }),
+    "payments": ("received_at", {
+        "id": "int64", "trip_id": "Int64", "method": "string", "amount": "float64",
+        "received_at": "datetime64[ns]", "reference_code": "string",
+    }),
+    "costs": ("occurred_at", {
+        "id": "int64", "occurred_at": "datetime64[ns]", "car_id": "Int64", "driver_id": "Int64",
+        "category": "string", "amount": "float64", "notes": "string",
+    }),
+}
+
+# chiều gộp -> cột; "month"/"year"/"day" tính từ cột ngày của bảng
+DIMENSIONS = {
+    "trips": {"driver": ["driver_id"], "car": ["car_id"], "sales": ["sales_id"], "route": ["origin", "destination"],
+              "method": ["payment_method"]},
+    "payments": {"method": ["method"]},
+    "costs": {"car": ["car_id"], "driver": ["driver_id"], "category": ["category"]},
+}
+PERIODS = {"day": "D", "month": "M", "year": "Y"}
+
+# số liệu -> (cột, hàm gộp); SORT_BY: cột sắp xếp giảm dần trong mỗi kỳ
+METRICS = {
+    "trips": {"trips": ("id", "size"), "revenue": ("final_fare", "sum"), "cash": ("cash_collected", "sum"),
+              "km": ("distance_km", "sum")},
+    "payments": {"payments": ("id", "size"), "amount": ("amount", "sum")},
+    "costs": {"costs": ("id", "size"), "amount": ("amount", "sum")},
+}
+SORT_BY = {"trips": "revenue", "payments": "amount", "costs": "amount"}
+
+
+# ==== SNAPSHOT ====
+def _read_state(root):
+    try:
+        with open(os.path.join(root, STATE_FILE), encoding="utf-8") as f:
+            return {k: date.fromisoformat(v) for k, v in json.load(f).items()}
+    except FileNotFoundError:
+        return {}
+
+
+def _write_state(root, state):
+    path = os.path.join(root, STATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({k: v.isoformat() for k, v in state.items()}, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def _part_range(path):
+    # part-YYYYMMDD-YYYYMMDD.parquet -> (ngày đầu, ngày cuối)
+    a, b = os.path.basename(path)[len("part-"):-len(".parquet")].split("-")
+    return datetime.strptime(a, "%Y%m%d").date(), datetime.strptime(b, "%Y%m%d").date()
+
+
+def _drop_uncommitted(root, table, watermark):
+    for path in glob.glob(os.path.join(root, table, "month=*", "part-*.parquet*")):
+        if path.endswith(".tmp") or watermark is None or _part_range(path)[0] > watermark:
+            os.remove(path)
+
+
+def _frame(table, rows):
+    import pandas as pd
+
+    dtypes = TABLES[table][1]
+    df = pd.DataFrame.from_records(rows, columns=list(dtypes))
+    return df.astype(dtypes)
+
+
+def _first_day(table):
+    first = db.session.execute(db.select(db.func.min(exports.columns(table)[0]))).scalar()
+    if first is None:
+        return None
+    return first.date() if isinstance(first, datetime) else datetime.fromisoformat(str(first)).date()
+
+
+def _month_end(d):
+    nxt = d.replace(year=d.year + 1, month=1, day=1) if d.month == 12 else d.replace(month=d.month + 1, day=1)
+    return nxt - timedelta(days=1)
+
+
+def _bounds(first, last):
+    return datetime.combine(first, datetime.min.time()), datetime.combine(last + timedelta(days=1), datetime.min.time())
+
+
+def _write_part(root, table, first, last, replace=()):
+    """Ghi part first..last (rỗng -> không tạo file); các file trong `replace` bị xóa sau khi part mới đã sẵn sàng."""
+    rows = list(exports.iter_rows(table, *_bounds(first, last)))
+    folder = os.path.join(root, table, f"month={first:%Y-%m}")
+    path = os.path.join(folder, f"part-{first:%Y%m%d}-{last:%Y%m%d}.parquet")
+    if rows:
+        os.makedirs(folder, exist_ok=True)
+        _frame(table, rows).to_parquet(path + ".tmp", engine="pyarrow", index=False)
+    for old in replace:
+        if old != path:
+            os.remove(old)
+    if rows:
+        os.replace(path + ".tmp", path)
+    elif path in replace:
+        os.remove(path)
+    return len(rows)
+
+
+def _recheck(root, table, watermark, echo=None):
+    """Ghi lại các tháng gần watermark có số dòng trong DB khác Parquet (dòng đến muộn). Trả về số dòng đã ghi lại."""
+    import pyarrow.parquet as pq
+
+    rewritten = 0
+    month = (watermark - timedelta(days=RECHECK_DAYS)).replace(day=1)
+    while month <= watermark:
+        last = min(_month_end(month), watermark)
+        date_col = exports.columns(table, *_bounds(month, last))[0]
+        in_db = db.session.execute(
+            db.select(db.func.count()).where(date_col >= _bounds(month, last)[0], date_col < _bounds(month, last)[1])
+        ).scalar()
+        parts = sorted(glob.glob(os.path.join(root, table, f"month={month:%Y-%m}", "part-*.parquet")))
+        in_parquet = sum(pq.ParquetFile(p).metadata.num_rows for p in parts)
+        if in_db != in_parquet:
+            rewritten += _write_part(root, table, month, last, replace=parts)
+            if echo:
+                echo(f"  {table} {month}..{last}: rewritten ({in_parquet} -> {in_db} rows)")
+        month = last + timedelta(days=1)
+    return rewritten
+
+
+def snapshot(root=SNAPSHOT_DIR, until=None, tables=None, echo=None):
+    """Ghi các ngày đã đóng (<= `until`, mặc định hôm nay - CLOSE_DAYS) còn thiếu của từng bảng.
+
+    Trả về {bảng: số dòng mới}, gồm cả dòng của các tháng được ghi lại vì dữ liệu đến muộn.
+    """
+    until = until or date.today() - timedelta(days=CLOSE_DAYS)
+    os.makedirs(root, exist_ok=True)
+    state = _read_state(root)
+    written = {}
+    for table in tables or TABLES:
+        watermark = state.get(table)
+        _drop_uncommitted(root, table, watermark)
+        written[table] = _recheck(root, table, watermark, echo) if watermark else 0
+        day = watermark + timedelta(days=1) if watermark else _first_day(table)
+        while day is not None and day <= until:
+            last = min(_month_end(day), until)
+            n = _write_part(root, table, day, last)
+            written[table] += n
+            if n and echo:
+                echo(f"  {table} {day}..{last}: {n} rows")
+            state[table] = last
+            _write_state(root, state)
+            day = last + timedelta(days=1)
+        db.session.rollback()  # chỉ đọc; trả connection về pool giữa các bảng
+    return written
+
+
+def reset(root=SNAPSHOT_DIR, tables=None):
+    """Xóa snapshot (để ghi lại từ đầu khi dữ liệu ngày cũ bị sửa)."""
+    state = _read_state(root)
+    for table in tables or TABLES:
+        shutil.rmtree(os.path.join(root, table), ignore_errors=True)
+        state.pop(table, None)
+    if os.path.isdir(root):
+        _write_state(root, state)
+
+
+# ==== ĐỌC / BÁO CÁO ====
+def _months(start, end):
+    d = start.replace(day=1)
+    while d < end:
+        yield f"{d:%Y-%m}"
+        d = _month_end(d) + timedelta(days=1)
+
+
+def load(table, start=None, end=None, columns=None, root=SNAPSHOT_DIR):
+    """DataFrame các dòng của snapshot có cột ngày trong [start, end) (date); chỉ đọc các tháng liên quan."""
+    import pandas as pd
+
+    date_col, dtypes = TABLES[table]
+    if start is not None and end is not None:
+        files = [f for m in _months(start, end)
+                 for f in sorted(glob.glob(os.path.join(root, table, f"month={m}", "part-*.parquet")))]
+    else:
+        files = sorted(glob.glob(os.path.join(root, table, "month=*", "part-*.parquet")))
+    cols = None if columns is None else list(dict.fromkeys([date_col, *columns]))
+    frames = [pd.read_parquet(f, engine="pyarrow", columns=cols) for f in files]
+    if not frames:
+        return pd.DataFrame({c: pd.Series(dtype=dtypes[c]) for c in (cols or dtypes)})
+    df = pd.concat(frames, ignore_index=True)
+    if start is not None:
+        df = df[df[date_col] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df[date_col] < pd.Timestamp(end)]
+    return df
+
+
+def aggregate(table, by=("month",), start=None, end=None, root=SNAPSHOT_DIR):
+    """Gộp `table` theo các chiều `by` (vd. ["driver", "month"]) trong [start, end); trả về DataFrame đã sort."""
+    import pandas as pd
+
+    if table not in TABLES:
+        raise ValueError(f"table phải là một trong {', '.join(TABLES)}")
+    date_col, dims, metrics = TABLES[table][0], DIMENSIONS[table], METRICS[table]
+    unknown = [b for b in by if b not in dims and b not in PERIODS]
+    if unknown:
+        raise ValueError(f"by không hợp lệ: {', '.join(unknown)} (chọn trong {', '.join([*dims, *PERIODS])})")
+    columns = [c for b in by if b in dims for c in dims[b]] + sorted({c for c, _ in metrics.values()})
+    if table == "trips":
+        columns.append("status")
+    df = load(table, start, end, columns, root)
+    if table == "trips":
+        df = df[df["status"] == "completed"]
+    if not by:
+        return pd.DataFrame([{name: len(df) if fn == "size" else df[col].sum() for name, (col, fn) in metrics.items()}])
+    keys, periods = [], []
+    for b in by:
+        if b in PERIODS:
+            df = df.assign(**{b: df[date_col].dt.to_period(PERIODS[b]).astype(str)})
+            keys.append(b); periods.append(b)
+        else:
+            keys.extend(dims[b])
+    out = df.groupby(keys, dropna=False).agg(**metrics).reset_index()
+    return out.sort_values(periods + [SORT_BY[table]], ascending=[True] * len(periods) + [False], ignore_index=True)
+
+
+def to_records(df):
+    """DataFrame -> list dict cho JSON (NaN/NA -> None)."""
+    return json.loads(df.to_json(orient="records", date_format="iso", force_ascii=False))
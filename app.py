@@ -1,31 +1,37 @@
 # app.py (FULL: dashboard + claims + reports + admin users)
-from flask import Flask, render_template, redirect, url_for, request, flash, send_file
-from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from flask import render_template, redirect, url_for, request, flash, Response, jsonify, stream_with_context, abort
+from flask_login import login_user, logout_user, login_required, current_user
 from datetime import datetime, date, time, timedelta
-import os, csv, io, secrets, unicodedata, re
-
-from models import db, User, Trip, Car, Driver, Cost, Payment, Settings, Maintenance
-
-app = Flask(__name__)
-from flask_wtf import CSRFProtect
-
-# ==== CONFIG ====
-app.config.update(
-    SECRET_KEY=os.getenv("FLASK_SECRET_KEY", "change-me-now"),
-    SQLALCHEMY_DATABASE_URI=os.getenv("DATABASE_URL", "sqlite:///sc.db"),
-    SQLALCHEMY_TRACK_MODIFICATIONS=False,
-    WTF_CSRF_ENABLED=True,
-)
-csrf = CSRFProtect(app)
-db.init_app(app)
-
-# ==== LOGIN ====
-login_manager = LoginManager(app)
-login_manager.login_view = "login"
-
-@login_manager.user_loader
-def load_user(user_id):
-    return db.session.get(User, int(user_id))
+import os, secrets, unicodedata, re
+
+from models import db, User, Trip, Car, Driver, Cost, Payment, Settings
+from reports import sales_commission_rows, driver_ops_rows
+import reports
+import archive
+import rollups
+import dispatch
+import events
+import fares
+import forecast
+import exports
+import principals
+import passwords
+import pagination
+import summaries
+import report_cache
+import metrics
+import sync
+import triplog
+from factory import create_app
+
+# config + extension (DB, CSRF, login, metrics) dựng trong factory.create_app(), dùng chung với manage.py
+app = create_app()
+# điều phối tự động chỉ chạy ở 1 process riêng (`flask --app manage run-dispatcher`), không trong web worker
+if os.getenv("DISPATCH_AUTO", "0").lower() in ("1", "true", "yes"):
+    app.logger.warning("DISPATCH_AUTO bị bỏ qua: chạy điều phối bằng `flask --app manage run-dispatcher`.")
+# nhật ký thay đổi chuyến (trip_events) ghi theo lô ở thread nền của từng worker (tạo ở lần commit đầu), xem triplog.py
+if triplog.ENABLED:
+    triplog.start(app)
 
 # ==== TIME HELPERS (LOCAL) ====
 def now_local():
@@ -120,7 +126,14 @@ def login():
         email = (request.form.get("email") or "").strip().lower()
         password = request.form.get("password") or ""
         user = User.query.filter_by(email=email).first()
-        if user and getattr(user, "active", True) and user.check_password(password):
+        try:
+            ok = bool(user and getattr(user, "active", True) and passwords.check(user, password))
+        except passwords.Busy:
+            flash("Hệ thống đang bận, vui lòng thử lại sau vài giây.", "warning")
+            return render_template("login.html"), 503, {"Retry-After": "2"}
+        if ok:
+            if db.session.is_modified(user):  # hash được nâng cấp theo cấu hình mới
+                db.session.commit()
             login_user(user)
             return redirect(url_for("index"))
         flash("Sai tài khoản/mật khẩu hoặc tài khoản bị khóa.", "danger")
@@ -143,29 +156,19 @@ def sales_dashboard():
     day_start, day_end = day_bounds(today)
     mon_start, mon_end = month_bounds(today)
 
-    trips_daily = Trip.query.filter(
-        Trip.sales_id == current_user.id,
-        Trip.ended_at >= day_start, Trip.ended_at < day_end
-    ).all()
-    trips_month = Trip.query.filter(
-        Trip.sales_id == current_user.id,
-        Trip.ended_at >= mon_start, Trip.ended_at < mon_end
-    ).all()
-
-    pending_trips = Trip.query.filter(
-        Trip.sales_id == current_user.id,
-        Trip.status.in_(["booked", "assigned"]),
-        Trip.driver_id.is_(None)
-    ).order_by(Trip.id.desc()).all()
+    _, daily_rev = rollups.sales_totals(current_user.id, day_start.date(), day_end.date())
+    month_trips, month_rev = rollups.sales_totals(current_user.id, mon_start.date(), mon_end.date())
+
+    # trang đầu; trang sau lấy qua /api/trips/<list>?cursor=...
+    pending_trips, pending_next = pagination.list_page("sales-pending", current_user.id, mon_start, mon_end)
+    trips_month, month_next = pagination.list_page("sales-month", current_user.id, mon_start, mon_end)
 
-    daily_rev = sum((t.final_fare or 0) for t in trips_daily)
-    month_rev = sum((t.final_fare or 0) for t in trips_month)
     rate = current_user.commission_rate or 0.05
 
     return render_template(
         "sales_dashboard.html",
-        trips_daily=trips_daily, trips_month=trips_month,
-        pending_trips=pending_trips,
+        pending_trips=pending_trips, pending_next=pending_next,
+        trips_month=trips_month, month_next=month_next, month_trips=month_trips,
         daily_rev=daily_rev, month_rev=month_rev,
         commission_rate=rate,
         est_commission_daily=daily_rev * rate,
@@ -187,6 +190,11 @@ def sales_trip_new():
     if not origin:
         flash("Vui lòng nhập điểm đón (origin).", "warning")
         return redirect(url_for("sales_dashboard"))
+    if not fare_raw:
+        # để trống báo giá: lấy theo bảng giá nếu tuyến có trong Fare
+        q = fares.quote(origin=origin, destination=destination)
+        if q:
+            fare_quote = float(q["price"])
     t = Trip(
         sales_id=current_user.id,
         origin=origin,
@@ -199,9 +207,32 @@ def sales_trip_new():
         driver_id=None,
     )
     db.session.add(t); db.session.commit()
+    events.publish("booked", events.trip_payload(t))
     flash(f"Đã tạo đơn #{t.id}.", "success")
     return redirect(url_for("sales_dashboard"))
 
+@app.route("/api/fare/quote")
+@login_required
+def api_fare_quote():
+    km_raw = request.args.get("km")
+    at_raw = request.args.get("at")
+    try:
+        km = float(km_raw) if km_raw else None
+        at = datetime.fromisoformat(at_raw) if at_raw else None
+    except ValueError:
+        return jsonify(error="km/at không hợp lệ"), 400
+    airport = request.args.get("airport")
+    q = fares.quote(
+        route_code=request.args.get("route_code"),
+        origin=request.args.get("origin"),
+        destination=request.args.get("destination"),
+        km=km, at=at,
+        airport=None if airport is None else airport.lower() in ("1", "true", "yes"),
+    )
+    if q is None:
+        return jsonify(error="Không tìm thấy tuyến trong bảng giá"), 404
+    return jsonify(q)
+
 # ============================ DRIVER ============================
 @app.route("/driver")
 @login_required
@@ -209,7 +240,7 @@ def driver_dashboard():
     if current_user.role != "driver":
         return redirect(url_for("index"))
 
-    driver = Driver.query.filter_by(user_id=current_user.id).first()
+    driver = principals.current_driver()
     if not driver:
         flash("Tài khoản chưa có hồ sơ Driver. Liên hệ admin.", "warning")
         return redirect(url_for("index"))
@@ -218,25 +249,12 @@ def driver_dashboard():
     day_start, day_end = day_bounds(today)
     mon_start, mon_end = month_bounds(today)
 
-    trips_daily = Trip.query.filter(
-        Trip.driver_id == driver.id,
-        Trip.ended_at >= day_start, Trip.ended_at < day_end
-    ).all()
-    trips_month = Trip.query.filter(
-        Trip.driver_id == driver.id,
-        Trip.ended_at >= mon_start, Trip.ended_at < mon_end
-    ).all()
-
-    daily_rev = sum((t.final_fare or 0) for t in trips_daily)
-    month_rev = sum((t.final_fare or 0) for t in trips_month)
-    cash_daily = sum((t.cash_collected or 0) for t in trips_daily)
-    cash_month = sum((t.cash_collected or 0) for t in trips_month)
+    _, daily_rev, cash_daily = rollups.driver_totals(driver.id, day_start.date(), day_end.date())
+    month_trips, month_rev, cash_month = rollups.driver_totals(driver.id, mon_start.date(), mon_end.date())
     rate = current_user.commission_rate or 0.40
 
-    open_trips = Trip.query.filter(
-        Trip.status.in_(["booked", "assigned"]),
-        Trip.driver_id.is_(None)
-    ).order_by(Trip.id.asc()).all()
+    open_trips, open_next = pagination.list_page("driver-open", driver.id, mon_start, mon_end)
+    trips_month, month_next = pagination.list_page("driver-month", driver.id, mon_start, mon_end)
 
     my_assigned = Trip.query.filter(
         Trip.driver_id == driver.id,
@@ -245,37 +263,83 @@ def driver_dashboard():
 
     return render_template(
         "driver_dashboard.html",
-        trips_daily=trips_daily, trips_month=trips_month,
         daily_rev=daily_rev, month_rev=month_rev,
         cash_daily=cash_daily, cash_month=cash_month,
         driver_commission_rate=rate,
         commission_daily=daily_rev * rate,
         commission_month=month_rev * rate,
-        open_trips=open_trips, my_assigned=my_assigned, driver=driver
+        open_trips=open_trips, open_next=open_next,
+        trips_month=trips_month, month_next=month_next, month_trips=month_trips,
+        my_assigned=my_assigned, driver=driver
     )
 
+@app.route("/api/trips/<name>")
+@login_required
+def api_trip_list(name):
+    # "Xem thêm": ?cursor=<next>&limit=; trả về {"items": [...], "next": cursor|null}
+    if name not in pagination.LISTS or pagination.LISTS[name][0] != current_user.role:
+        return jsonify(error="not found"), 404
+    if current_user.role == "driver":
+        driver = principals.current_driver()
+        if not driver:
+            return jsonify(error="no driver profile"), 404
+        owner_id = driver.id
+    else:
+        owner_id = current_user.id
+    mon_start, mon_end = month_bounds(date.today())
+    try:
+        items, nxt = pagination.list_page(name, owner_id, mon_start, mon_end,
+                                          cursor=request.args.get("cursor"),
+                                          limit=request.args.get("limit", pagination.PAGE_SIZE))
+    except ValueError:
+        return jsonify(error="cursor/limit không hợp lệ"), 400
+    return jsonify(items=[pagination.trip_json(t) for t in items], next=nxt)
+
+@app.route("/api/<name>/summary")
+@login_required
+def api_summary(name):
+    # cùng payload với /api/async/<name>/summary (summaries.PLANS), truy vấn chạy tuần tự
+    plan = summaries.PLANS.get(name)
+    if plan is None:
+        return jsonify(error="not found"), 404
+    if current_user.role not in plan[1]:
+        return jsonify(error="forbidden"), 403
+    driver = principals.current_driver() if current_user.role == "driver" else None
+    try:
+        return jsonify(summaries.run(db.session, name, current_user, driver, request.args))
+    except summaries.SummaryError as e:
+        return jsonify(error=str(e)), e.status
+
+@app.route("/driver/events")
+@login_required
+def driver_events():
+    # SSE: đẩy sự kiện booked/claimed/finished thay vì tải lại dashboard
+    # (cần worker gthread/gevent để 1 kết nối mở không giữ cả worker)
+    if current_user.role != "driver":
+        return Response(status=403)
+    return Response(events.sse_stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route("/driver/claim/<int:trip_id>", methods=["POST"])
 @login_required
 def driver_claim(trip_id):
     if current_user.role != "driver":
         return redirect(url_for("index"))
-    driver = Driver.query.filter_by(user_id=current_user.id).first()
+    driver = principals.current_driver()
     if not driver:
         flash("Tài khoản chưa gắn với Driver.", "danger")
         return redirect(url_for("driver_dashboard"))
-    trip = db.session.get(Trip, trip_id)
-    if not trip:
+    # UPDATE có điều kiện: chỉ 1 tài xế thắng, không cần khóa dòng
+    res = dispatch.claim_trip(trip_id, driver)
+    if res == dispatch.NOT_FOUND:
         flash("Đơn không tồn tại.", "danger")
         return redirect(url_for("driver_dashboard"))
-    if trip.status not in ("booked", "assigned") or trip.driver_id is not None:
+    if res == dispatch.TAKEN:
         flash("Đơn đã có tài xế khác nhận hoặc không còn ở trạng thái chờ.", "warning")
         return redirect(url_for("driver_dashboard"))
-    trip.driver_id = driver.id
-    if hasattr(driver, "car_id") and driver.car_id and hasattr(trip, "car_id"):
-        trip.car_id = driver.car_id
-    trip.status = "assigned"
     db.session.commit()
-    flash(f"Đã nhận đơn #{trip.id}.", "success")
+    events.publish("claimed", {"id": trip_id, "status": "assigned", "driver_id": driver.id})
+    flash(f"Đã nhận đơn #{trip_id}.", "success")
     return redirect(url_for("driver_dashboard"))
 
 @app.route("/trip/start/<int:trip_id>", methods=["POST"])
@@ -283,30 +347,24 @@ def driver_claim(trip_id):
 def trip_start_existing(trip_id):
     if current_user.role != "driver":
         return redirect(url_for("index"))
-    driver = Driver.query.filter_by(user_id=current_user.id).first()
+    driver = principals.current_driver()
     if not driver:
         flash("Tài khoản chưa gắn với Driver.", "danger")
         return redirect(url_for("driver_dashboard"))
-    trip = db.session.get(Trip, trip_id)
-    if not trip:
+    res = dispatch.claim_trip(trip_id, driver, start_at=now_local())
+    # TAKEN nhưng đơn đã bị xóa ngay sau khi claim thất bại -> như NOT_FOUND
+    trip = db.session.get(Trip, trip_id) if res == dispatch.TAKEN else None
+    if res == dispatch.NOT_FOUND or (res == dispatch.TAKEN and trip is None):
         flash("Đơn không tồn tại.", "danger")
-        return redirect(url_for("driver_dashboard"))
-
-    if trip.driver_id is None:
-        trip.driver_id = driver.id
-        if hasattr(driver, "car_id") and driver.car_id and hasattr(trip, "car_id"):
-            trip.car_id = driver.car_id
-    elif trip.driver_id != driver.id:
-        flash("Bạn không phải tài xế được gán cho đơn này.", "danger")
-        return redirect(url_for("driver_dashboard"))
-
-    if trip.status in ("booked", "assigned"):
-        trip.started_at = now_local()
-        trip.status = "ongoing"
-        db.session.commit()
-        flash(f"Đang chở đơn #{trip.id}.", "success")
+    elif res == dispatch.TAKEN:
+        if trip.driver_id not in (None, driver.id):
+            flash("Bạn không phải tài xế được gán cho đơn này.", "danger")
+        else:
+            flash("Đơn này đã bắt đầu trước đó hoặc đã hoàn tất.", "warning")
     else:
-        flash("Đơn này đã bắt đầu trước đó hoặc đã hoàn tất.", "warning")
+        db.session.commit()
+        events.publish("claimed", {"id": trip_id, "status": "ongoing", "driver_id": driver.id})
+        flash(f"Đang chở đơn #{trip_id}.", "success")
     return redirect(url_for("driver_dashboard"))
 
 @app.route("/trip/start", methods=["POST"])
@@ -314,7 +372,7 @@ def trip_start_existing(trip_id):
 def trip_start():
     if current_user.role != "driver":
         return redirect(url_for("index"))
-    driver = Driver.query.filter_by(user_id=current_user.id).first()
+    driver = principals.current_driver()
     trip = Trip(
         driver_id=driver.id,
         car_id=getattr(driver, "car_id", None),
@@ -326,6 +384,7 @@ def trip_start():
         sales_id=int(request.form.get("sales_id")) if request.form.get("sales_id") else None
     )
     db.session.add(trip); db.session.commit()
+    events.publish("started", events.trip_payload(trip))
     flash("Đã nhận khách.", "success")
     return redirect(url_for("driver_dashboard"))
 
@@ -339,9 +398,12 @@ def trip_finish(trip_id):
         flash("Trip không tồn tại.", "danger")
         return redirect(url_for("driver_dashboard"))
 
+    # hoàn tất lại chuyến đã xong: trừ số cũ khỏi rollup trước khi ghi đè
+    rollups.apply_trip(trip, -1)
     trip.ended_at = now_local()
     trip.destination = request.form.get("destination")
     trip.final_fare = float(request.form.get("final_fare") or trip.fare_quote or 0)
+    trip.distance_km = float(request.form.get("distance_km") or trip.distance_km or 0)
     trip.payment_method = request.form.get("payment_method")
     trip.cash_collected = float(request.form.get("cash_collected") or 0)
     trip.status = "completed"
@@ -354,25 +416,86 @@ def trip_finish(trip_id):
         reference_code=request.form.get("payment_ref") or None,
     )
     db.session.add(pay)
+    rollups.apply_trip(trip)
     db.session.commit()
+    events.publish("finished", events.trip_payload(trip))
     flash("Đã trả khách.", "success")
     return redirect(url_for("driver_dashboard"))
 
+@app.route("/driver/sync", methods=["POST"])
+@login_required
+def driver_sync():
+    # hàng đợi sự kiện ghi lúc mất sóng: 1 request, 1 commit cho cả lô (xem sync.py)
+    if current_user.role != "driver":
+        return jsonify(error="forbidden"), 403
+    driver = principals.current_driver()
+    if not driver:
+        return jsonify(error="no driver profile"), 404
+    batch = (request.get_json(silent=True) or {}).get("events")
+    if not isinstance(batch, list) or not batch:
+        return jsonify(error="events phải là mảng khác rỗng"), 400
+    if len(batch) > sync.MAX_BATCH:
+        return jsonify(error=f"tối đa {sync.MAX_BATCH} sự kiện mỗi lần"), 413
+    results, published = sync.run(driver, batch)
+    for kind, payload in published:
+        events.publish(kind, payload)
+    return jsonify(results=results)
+
 # ============================ ADMIN: DASHBOARD ============================
 @app.route("/admin")
 @login_required
 def admin_dashboard():
     if current_user.role not in ("admin", "manager", "accountant"):
         return redirect(url_for("index"))
-    total_trips = db.session.execute(db.select(db.func.count()).select_from(Trip)).scalar() or 0
-    total_revenue = db.session.execute(db.select(db.func.sum(Trip.final_fare))).scalar() or 0
-    total_cash = db.session.execute(db.select(db.func.sum(Trip.cash_collected))).scalar() or 0
-    total_costs = db.session.execute(db.select(db.func.sum(Cost.amount))).scalar() or 0
+    totals = rollups.global_totals()
+    total_trips = totals["trips"]
+    total_revenue = totals["revenue"]
+    total_cash = totals["cash"]
+    total_costs = totals["costs"]
     net_profit = (total_revenue or 0) - (total_costs or 0)
     return render_template("admin_dashboard.html",
                            total_trips=total_trips, total_revenue=total_revenue,
                            total_cash=total_cash, total_costs=total_costs, net_profit=net_profit)
 
+@app.route("/admin/cache/principals")
+@login_required
+def admin_principal_cache():
+    if current_user.role not in ("admin", "manager"):
+        return redirect(url_for("index"))
+    return jsonify(principals.cache.stats())
+
+@app.route("/admin/cache/reports")
+@login_required
+def admin_report_cache():
+    if current_user.role not in ("admin", "manager"):
+        return redirect(url_for("index"))
+    return jsonify(report_cache.cache.stats())
+
+# ============================ ADMIN: METRICS ============================
+def _cache_metrics():
+    p = principals.cache.stats()
+    r = report_cache.cache.stats()
+    return [
+        ("sc_principal_cache_events_total", "counter", "Principal cache lookups/evictions.",
+         [({"result": k}, p[k]) for k in ("hits", "misses", "evictions", "invalidations")]),
+        ("sc_principal_cache_size", "gauge", "Cached principals.", [({}, p["size"])]),
+        ("sc_report_cache_events_total", "counter", "Report cache lookups.",
+         [({"result": "hits"}, r["hits"]), ({"result": "misses"}, r["misses"])]),
+        ("sc_password_checks_total", "counter", "Password verifications by outcome.",
+         [({"result": k}, v) for k, v in passwords.stats.items()]),
+    ]
+
+metrics.registry.add_collector(_cache_metrics)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    # admin đăng nhập, hoặc Prometheus gửi "Authorization: Bearer $METRICS_TOKEN"
+    token = os.getenv("METRICS_TOKEN")
+    by_token = bool(token) and secrets.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+    if not by_token and not (current_user.is_authenticated and current_user.role in ("admin", "manager")):
+        return Response("forbidden\n", status=403, mimetype="text/plain")
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
 # ============================ ADMIN: USERS HOME ============================
 @app.route("/admin/users", methods=["GET"])
 @login_required
@@ -475,83 +598,130 @@ def parse_date_arg(name="date", default=None):
             pass
     return default or date.today()
 
+def parse_range_args(default=None, max_days=366):
+    # ?from=YYYY-MM-DD&to=YYYY-MM-DD (gồm cả ngày `to`); ?date= cũ = 1 ngày
+    day = parse_date_arg("date", default)
+    d_from = parse_date_arg("from", default=day)
+    d_to = parse_date_arg("to", default=d_from if request.args.get("from") else day)
+    if d_to < d_from:
+        d_from, d_to = d_to, d_from
+    if (d_to - d_from).days >= max_days:
+        d_from = d_to - timedelta(days=max_days - 1)
+    return d_from, d_to
+
 @app.route("/admin/reports/cashbook")
 @login_required
 def admin_cashbook():
     if current_user.role not in ("admin", "manager", "accountant"):
         return redirect(url_for("index"))
-    day = parse_date_arg(default=date.today())
-    day_start, day_end = day_bounds(day)
-    pays = Payment.query.filter(Payment.received_at >= day_start, Payment.received_at < day_end).all()
-    costs = Cost.query.filter(Cost.occurred_at >= day_start, Cost.occurred_at < day_end).all()
-    total_in = sum((p.amount or 0) for p in pays)
-    total_out = sum((c.amount or 0) for c in costs)
-    return render_template("admin_cashbook.html", day=day, pays=pays, costs=costs, total_in=total_in, total_out=total_out, balance=(total_in-total_out))
+    d_from, d_to = parse_range_args(default=date.today())
+
+    def build():
+        start, end = day_bounds(d_from)[0], day_bounds(d_to)[1]
+        opening, days = reports.cashbook_days(start, end)
+        pays = costs = None
+        if d_from == d_to:  # 1 ngày: kèm chi tiết từng khoản để đối chiếu
+            P = archive.payments(start, end)
+            pays = db.session.execute(
+                db.select(P).where(P.received_at >= start, P.received_at < end).order_by(P.received_at)).scalars().all()
+            costs = Cost.query.filter(Cost.occurred_at >= start, Cost.occurred_at < end).order_by(Cost.occurred_at).all()
+        total_in = sum(r["cash_in"] for r in days)
+        total_out = sum(r["cash_out"] for r in days)
+        return render_template("admin_cashbook.html", d_from=d_from, d_to=d_to, days=days, pays=pays, costs=costs,
+                               total_in=total_in, total_out=total_out, opening=opening,
+                               balance=opening + total_in - total_out)
+    return report_cache.render("cashbook", d_from, current_user.role, build, until=d_to)
 
 @app.route("/admin/reports/sales-commission")
 @login_required
 def admin_sales_commission():
     if current_user.role not in ("admin", "manager", "accountant"):
         return redirect(url_for("index"))
-    day = parse_date_arg(default=date.today())
-    day_start, day_end = day_bounds(day)
-    trips = Trip.query.filter(Trip.ended_at >= day_start, Trip.ended_at < day_end, Trip.sales_id != None).all()
-    per = {}
-    for t in trips:
-        s = db.session.get(User, t.sales_id)
-        if not s: continue
-        rate = s.commission_rate or 0.05
-        k = s.email
-        per.setdefault(k, {"sales": s, "revenue": 0.0, "commission": 0.0, "trips": 0})
-        per[k]["revenue"] += (t.final_fare or 0)
-        per[k]["commission"] += (t.final_fare or 0) * rate
-        per[k]["trips"] += 1
-    rows = list(per.values())
-    return render_template("admin_sales_commission.html", day=day, rows=rows)
+    d_from, d_to = parse_range_args(default=date.today())
+    start, end = day_bounds(d_from)[0], day_bounds(d_to)[1]
+    return report_cache.render("sales-commission", d_from, current_user.role, lambda: render_template(
+        "admin_sales_commission.html", d_from=d_from, d_to=d_to, rows=sales_commission_rows(start, end),
+        days=reports.sales_commission_days(start, end)), until=d_to)
 
 @app.route("/admin/reports/driver-ops")
 @login_required
 def admin_driver_ops():
     if current_user.role not in ("admin", "manager", "accountant"):
         return redirect(url_for("index"))
-    day = parse_date_arg(default=date.today())
-    day_start, day_end = day_bounds(day)
-    trips = Trip.query.filter(Trip.started_at >= day_start, Trip.started_at < day_end).all()
-    per = {}
-    for t in trips:
-        drv = db.session.get(Driver, t.driver_id) if t.driver_id else None
-        usr = db.session.get(User, drv.user_id) if drv else None
-        car = db.session.get(Car, t.car_id) if t.car_id else None
-        key = drv.id if drv else 0
-        per.setdefault(key, {"driver": usr, "car": car, "trips": 0, "revenue": 0.0, "cash": 0.0})
-        per[key]["trips"] += 1
-        per[key]["revenue"] += (t.final_fare or 0)
-        per[key]["cash"] += (t.cash_collected or 0)
-    rows = list(per.values())
-    return render_template("admin_driver_ops.html", day=day, rows=rows)
+    d_from, d_to = parse_range_args(default=date.today())
+    start, end = day_bounds(d_from)[0], day_bounds(d_to)[1]
+    return report_cache.render("driver-ops", d_from, current_user.role, lambda: render_template(
+        "admin_driver_ops.html", d_from=d_from, d_to=d_to, rows=driver_ops_rows(start, end),
+        days=reports.driver_ops_days(start, end)), until=d_to)
 
 @app.route("/admin/reports/maintenance")
 @login_required
 def admin_maintenance():
     if current_user.role not in ("admin", "manager", "accountant"):
         return redirect(url_for("index"))
-    upcoming = db.session.execute(db.select(Maintenance).where(Maintenance.scheduled_date >= date.today()).order_by(Maintenance.scheduled_date.asc())).scalars().all()
-    past = db.session.execute(db.select(Maintenance).where(Maintenance.scheduled_date < date.today()).order_by(Maintenance.scheduled_date.desc())).scalars().all()
-    maint_costs = db.session.execute(db.select(Cost).where(Cost.category=="maintenance").order_by(Cost.occurred_at.desc())).scalars().all()
-    return render_template("admin_maintenance.html", upcoming=upcoming, past=past, maint_costs=maint_costs)
+
+    # dự báo do cron refresh-maintenance-forecast tính mỗi ngày; trang chỉ đọc rollup_car_ledger (lịch sử đầy đủ: CSV)
+    def build():
+        due = forecast.due_soon()
+        return render_template("admin_maintenance.html", due=due, days=forecast.DUE_SOON_DAYS, today=date.today(),
+                               forecast_on=forecast.forecast_on())
+    return report_cache.render("maintenance", date.today(), current_user.role, build)
 
 @app.route("/admin/reports/maintenance.csv")
 @login_required
 def admin_maintenance_csv():
     if current_user.role not in ("admin", "manager", "accountant"):
         return redirect(url_for("index"))
-    rows = db.session.execute(db.select(Maintenance).order_by(Maintenance.scheduled_date.asc())).scalars().all()
-    si = io.StringIO(); w = csv.writer(si)
-    w.writerow(["id","car_id","scheduled_date","odometer_km","task","estimated_cost","actual_cost","notes"])
-    for m in rows:
-        w.writerow([m.id, m.car_id, m.scheduled_date, m.odometer_km, m.task, m.estimated_cost, m.actual_cost, m.notes])
-    mem = io.BytesIO(si.getvalue().encode("utf-8-sig")); mem.seek(0)
-    return send_file(mem, mimetype="text/csv", as_attachment=True, download_name="maintenance.csv")
+    return export_response("maintenance", "csv")
+
+# ============================ ADMIN: EXPORTS ============================
+EXPORT_MIMETYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+def export_response(kind, fmt, start=None, end=None, filename=None):
+    gen = exports.stream_csv if fmt == "csv" else exports.stream_xlsx
+    return Response(
+        stream_with_context(gen(kind, start, end)),
+        mimetype=EXPORT_MIMETYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename or kind}.{fmt}"'},
+    )
+
+@app.route("/admin/export/<kind>.<fmt>")
+@login_required
+def admin_export(kind, fmt):
+    # ?from=YYYY-MM-DD&to=YYYY-MM-DD (gồm cả ngày `to`); mặc định từ đầu tháng đến hôm nay
+    if current_user.role not in ("admin", "manager", "accountant"):
+        return redirect(url_for("index"))
+    if kind not in exports.EXPORTS or fmt not in EXPORT_MIMETYPES:
+        abort(404)
+    d_from = parse_date_arg("from", default=date.today().replace(day=1))
+    d_to = parse_date_arg("to", default=date.today())
+    start, end = day_bounds(d_from)[0], day_bounds(d_to)[1]
+    if kind == "maintenance":  # scheduled_date là cột Date
+        start, end = start.date(), end.date()
+    return export_response(kind, fmt, start, end, filename=f"{kind}_{d_from.isoformat()}_{d_to.isoformat()}")
+
+# ============================ ADMIN: ANALYTICS ============================
+@app.route("/admin/analytics/<table>.json")
+@login_required
+def admin_analytics(table):
+    # ?by=driver,month&from=YYYY-MM-DD&to=YYYY-MM-DD; đọc snapshot Parquet (analytics.py), không truy vấn DB
+    if current_user.role not in ("admin", "manager", "accountant"):
+        return jsonify(error="forbidden"), 403
+    import analytics
+    if table not in analytics.TABLES:
+        abort(404)
+    by = [b.strip() for b in request.args.get("by", "month").split(",") if b.strip()]
+    d_from = parse_date_arg("from", default=date.today().replace(month=1, day=1))
+    d_to = parse_date_arg("to", default=date.today())
+    try:
+        df = analytics.aggregate(table, by, d_from, d_to + timedelta(days=1))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(table=table, by=by, **{"from": d_from.isoformat(), "to": d_to.isoformat()},
+                   rows=analytics.to_records(df))
 
 # ==== MAIN ====
 if __name__ == "__main__":
@@ -0,0 +1,165 @@
+# archive.py - chuyển chuyến đã hoàn tất cũ (kèm payments) sang bảng lưu trữ theo tháng, bảng nóng chỉ giữ dữ liệu gần đây
+#   trips_archive_YYYY_MM      chuyến completed, theo tháng ended_at
+#   payments_archive_YYYY_MM   payment của các chuyến đó, theo tháng received_at
+# `flask --app manage archive-trips --older-than 180`: mỗi lô BATCH chuyến là 1 transaction ngắn
+# (INSERT ... SELECT sang bảng tháng rồi DELETE khỏi bảng nóng) -> không khóa lâu bảng đang ghi, dừng giữa chừng không mất dòng.
+# Rollup (SalesDaily/DriverDaily/DaySummary/CarDaily/CarLedger) giữ nguyên: số liệu không đổi, chỉ đổi chỗ lưu.
+# Đọc: trips()/payments() trả về Trip/Payment nếu khoảng ngày không chạm tháng lưu trữ nào, ngược lại trả về alias của
+# model trên UNION ALL (bảng nóng + các tháng liên quan) -> báo cáo/export/rebuild_rollups dùng như model bình thường.
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from models import db, Trip, Payment, ArchiveMonth
+
+BATCH = int(os.getenv("ARCHIVE_BATCH", "1000"))
+MAX_TRIP_DAYS = 7  # lọc theo started_at: chuyến kết thúc muộn nhất bấy nhiêu ngày sau khi bắt đầu
+
+# loại -> (model, cột chia tháng, cột có index trong bảng lưu trữ)
+KINDS = {
+    "trips": (Trip, "ended_at", ("ended_at", "started_at")),
+    "payments": (Payment, "received_at", ("received_at", "trip_id")),
+}
+
+_meta = db.MetaData()
+_lock = threading.Lock()
+
+
+def table_name(kind, month):
+    return f"{kind}_archive_{month.replace('-', '_')}"
+
+
+def archive_table(kind, month):
+    """Table của tháng `month` (YYYY-MM): cùng cột với bảng nóng, không khóa ngoại."""
+    name = table_name(kind, month)
+    with _lock:
+        t = _meta.tables.get(name)
+        if t is None:
+            model, _, indexed = KINDS[kind]
+            cols = [db.Column(c.name, c.type, primary_key=c.primary_key, autoincrement=False)
+                    for c in model.__table__.columns]
+            t = db.Table(name, _meta, *cols, *[db.Index(f"ix_{name}_{c}", c) for c in indexed])
+        return t
+
+
+def _dt(v):
+    return v if isinstance(v, datetime) else datetime.combine(v, datetime.min.time())
+
+
+# ==== ĐỌC ====
+def months(kind, start=None, end=None):
+    """Các tháng đã lưu trữ của `kind` giao với [start, end)."""
+    stmt = db.select(ArchiveMonth.month).where(ArchiveMonth.kind == kind, ArchiveMonth.rows > 0)
+    if start is not None:
+        stmt = stmt.where(ArchiveMonth.month >= f"{start:%Y-%m}")
+    if end is not None:
+        stmt = stmt.where(ArchiveMonth.month <= f"{_dt(end) - timedelta(microseconds=1):%Y-%m}")
+    return db.session.execute(stmt.order_by(ArchiveMonth.month)).scalars().all()
+
+
+def source(kind, start=None, end=None, by=None):
+    """Model hoặc alias của nó trên UNION ALL bảng nóng + bảng lưu trữ; mỗi nhánh đã lọc `by` trong [start, end)."""
+    model, month_col, _ = KINDS[kind]
+    by = by or month_col
+    hi = end
+    if end is not None and by != month_col:
+        hi = _dt(end) + timedelta(days=MAX_TRIP_DAYS)
+    found = months(kind, start, hi)
+    if not found:
+        return model
+
+    def branch(t):
+        stmt = db.select(*[t.c[c.name] for c in model.__table__.columns])
+        if start is not None:
+            stmt = stmt.where(t.c[by] >= start)
+        if end is not None:
+            stmt = stmt.where(t.c[by] < end)
+        return stmt
+
+    union = db.union_all(branch(model.__table__), *[branch(archive_table(kind, m)) for m in found])
+    return db.aliased(model, union.subquery(f"{kind}_all"))
+
+
+def trips(start=None, end=None, by="ended_at"):
+    return source("trips", start, end, by)
+
+
+def payments(start=None, end=None):
+    return source("payments", start, end)
+
+
+# ==== LƯU TRỮ ====
+def _candidates(cutoff, limit):
+    # chừa lại chuyến có id lớn nhất và chuyến của payment có id lớn nhất: SQLite (không AUTOINCREMENT)
+    # cấp id mới = max(id) + 1, xóa dòng max sẽ tái dùng id đã nằm trong bảng lưu trữ
+    max_trip = db.select(db.func.max(Trip.id)).scalar_subquery()
+    last_pay_trip = db.select(Payment.trip_id).order_by(Payment.id.desc()).limit(1).scalar_subquery()
+    return (
+        db.select(Trip.id, Trip.ended_at)
+        .where(Trip.status == "completed", Trip.ended_at < cutoff, Trip.id < max_trip,
+               Trip.id != db.func.coalesce(last_pay_trip, 0))
+        .order_by(Trip.id).limit(limit)
+    )
+
+
+def _copy(kind, month, ids):
+    model = KINDS[kind][0]
+    t = archive_table(kind, month)
+    t.create(db.session.connection(), checkfirst=True)
+    cols = model.__table__.columns
+    db.session.execute(db.insert(t).from_select([c.name for c in cols], db.select(*cols).where(cols.id.in_(ids))))
+    row = db.session.get(ArchiveMonth, (kind, month))
+    if row is None:
+        row = ArchiveMonth(kind=kind, month=month, rows=0)
+        db.session.add(row)
+    row.rows += len(ids)
+    row.updated_at = datetime.utcnow()
+
+
+def archive(cutoff, batch=BATCH, pause=0.0, echo=None):
+    """Chuyển chuyến completed có ended_at < `cutoff` và payments của chúng sang bảng tháng.
+
+    Mỗi lô `batch` chuyến commit riêng; `pause` giây nghỉ giữa các lô. Trả về (số chuyến, số payment).
+    """
+    n_trips = n_pays = 0
+    while True:
+        rows = db.session.execute(_candidates(cutoff, batch)).all()
+        if not rows:
+            break
+        ids, by_month = [], {}
+        for tid, ended in rows:
+            ids.append(tid)
+            by_month.setdefault(f"{ended:%Y-%m}", []).append(tid)
+        ended_of = {tid: ended for tid, ended in rows}
+        pays, pay_month = [], {}
+        for pid, tid, received in db.session.execute(
+            db.select(Payment.id, Payment.trip_id, Payment.received_at).where(Payment.trip_id.in_(ids))
+        ):
+            pays.append(pid)
+            pay_month.setdefault(f"{received or ended_of[tid]:%Y-%m}", []).append(pid)
+        for month, pids in sorted(pay_month.items()):
+            _copy("payments", month, pids)
+        for month, tids in sorted(by_month.items()):
+            _copy("trips", month, tids)
+        if pays:
+            db.session.execute(db.delete(Payment).where(Payment.id.in_(pays))
+                               .execution_options(synchronize_session=False))
+        db.session.execute(db.delete(Trip).where(Trip.id.in_(ids)).execution_options(synchronize_session=False))
+        db.session.commit()
+        n_trips += len(ids)
+        n_pays += len(pays)
+        if echo:
+            echo(f"  trips #{ids[0]}..#{ids[-1]}: {len(ids)} trips, {len(pays)} payments -> {', '.join(sorted(by_month))}")
+        if len(rows) < batch:
+            break
+        if pause:
+            time.sleep(pause)
+    return n_trips, n_pays
+
+
+def drop_all(bind):
+    """Xóa mọi bảng lưu trữ (init-db: drop_all không biết các bảng này)."""
+    for name in db.inspect(bind).get_table_names():
+        if name.startswith(tuple(f"{k}_archive_" for k in KINDS)):
+            db.Table(name, db.MetaData()).drop(bind)
@@ -0,0 +1,163 @@
+# async_api.py - API JSON chỉ đọc cho dashboard tài xế / sales / admin, chạy trên ASGI + SQLAlchemy asyncio
+# Dùng chung models, payload (summaries.PLANS, giống route Flask /api/<tên>/summary) và cookie đăng nhập của Flask.
+# Các truy vấn độc lập của 1 dashboard chạy song song bằng asyncio.gather, mỗi truy vấn 1 connection từ pool.
+#   pip install uvicorn asyncpg aiosqlite greenlet
+#   gunicorn -k uvicorn.workers.UvicornWorker -w 2 async_api:app      (proxy chuyển /api/async/* sang đây)
+#   ASYNC_DATABASE_URL mặc định suy từ DATABASE_URL: postgresql -> postgresql+asyncpg, sqlite -> sqlite+aiosqlite
+#   GET /api/async/driver/summary   GET /api/async/sales/summary   GET /api/async/admin/summary
+import asyncio
+import json
+import os
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qsl
+
+from flask.sessions import SecureCookieSessionInterface
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from models import db, User, Driver
+import dbpool
+import summaries
+
+PREFIX = "/api/async"
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def async_url(url):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+def _engine(url):
+    url = async_url(url)
+    opts = {"pool_pre_ping": dbpool.PRE_PING}
+    if url.get_backend_name() != "sqlite" or url.database not in (None, "", ":memory:"):
+        opts.update(pool_size=dbpool.POOL_SIZE, max_overflow=dbpool.MAX_OVERFLOW,
+                    pool_timeout=dbpool.POOL_TIMEOUT, pool_recycle=dbpool.POOL_RECYCLE)
+    if url.get_backend_name() == "postgresql" and dbpool.STATEMENT_TIMEOUT_MS > 0:
+        opts["connect_args"] = {"server_settings": {"statement_timeout": str(dbpool.STATEMENT_TIMEOUT_MS)}}
+    engine = create_async_engine(url, **opts)
+    if url.get_backend_name() == "sqlite":
+        event.listen(engine.sync_engine, "connect", lambda conn, rec: dbpool.sqlite_pragmas(conn))
+    return engine
+
+
+# ==== COOKIE ĐĂNG NHẬP ====
+def _flask_app():
+    # chỉ để đọc config + serializer của session cookie; không import route
+    from factory import create_app
+    return create_app()
+
+
+class Auth:
+    def __init__(self, flask_app):
+        self.cookie_name = flask_app.config["SESSION_COOKIE_NAME"]
+        self.max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+        self.serializer = SecureCookieSessionInterface().get_signing_serializer(flask_app)
+
+    def user_id(self, headers):
+        """user id từ session cookie của Flask-Login, None nếu không có/không hợp lệ."""
+        raw = headers.get(b"cookie")
+        if not raw or self.serializer is None:
+            return None
+        morsel = SimpleCookie(raw.decode("latin-1")).get(self.cookie_name)
+        if morsel is None:
+            return None
+        try:
+            data = self.serializer.loads(morsel.value, max_age=self.max_age)
+        except Exception:
+            return None
+        uid = data.get("_user_id")
+        return int(uid) if uid and str(uid).isdigit() else None
+
+
+# ==== TRUY VẤN ====
+class Api:
+    def __init__(self, database_url, flask_app=None):
+        self.engine = _engine(database_url)
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.auth = Auth(flask_app or _flask_app())
+
+    async def _run(self, stmt, shape):
+        # mỗi truy vấn 1 session (1 connection) -> gather chạy song song được
+        async with self.sessions() as s:
+            return summaries.fetch(await s.execute(stmt), shape)
+
+    async def principal(self, headers):
+        uid = self.auth.user_id(headers)
+        if uid is None:
+            return None, None
+        rows = await self._run(
+            db.select(User, Driver).outerjoin(Driver, Driver.user_id == User.id).where(User.id == uid), "all")
+        if not rows or not getattr(rows[0][0], "active", True):
+            return None, None
+        return rows[0][0], rows[0][1]
+
+    async def summary(self, name, user, driver, params):
+        # các truy vấn của plan độc lập -> mỗi truy vấn 1 connection, chạy song song
+        queries, build = summaries.PLANS[name][0](user, driver, params)
+        return build(*await asyncio.gather(*(self._run(stmt, shape) for stmt, shape in queries)))
+
+
+# path -> tên plan trong summaries.PLANS (payload giống hệt route Flask /api/<tên>/summary)
+ROUTES = {f"{PREFIX}/{name}/summary": name for name in summaries.PLANS}
+
+
+# ==== ASGI ====
+async def _send_json(send, status, payload):
+    body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json; charset=utf-8"), (b"content-length", str(len(body)).encode()),
+        (b"cache-control", b"no-store")]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def create_asgi_app(database_url=None, flask_app=None):
+    api = None
+
+    def get_api():
+        nonlocal api
+        if api is None:
+            api = Api(database_url or os.getenv("ASYNC_DATABASE_URL") or os.getenv("DATABASE_URL", "sqlite:///sc.db"),
+                      flask_app)
+        return api
+
+    async def asgi(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                msg = await receive()
+                if msg["type"] == "lifespan.startup":
+                    get_api()
+                    await send({"type": "lifespan.startup.complete"})
+                elif msg["type"] == "lifespan.shutdown":
+                    if api is not None:
+                        await api.engine.dispose()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+        name = ROUTES.get(scope["path"].rstrip("/"))
+        if name is None:
+            return await _send_json(send, 404, {"error": "not found"})
+        if scope["method"] not in ("GET", "HEAD"):
+            return await _send_json(send, 405, {"error": "method not allowed"})
+        roles = summaries.PLANS[name][1]
+        a = get_api()
+        user, driver = await a.principal(dict(scope["headers"]))
+        if user is None:
+            return await _send_json(send, 401, {"error": "login required"})
+        if user.role not in roles:
+            return await _send_json(send, 403, {"error": "forbidden"})
+        params = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        try:
+            payload = await a.summary(name, user, driver, params)
+        except summaries.SummaryError as e:
+            return await _send_json(send, e.status, {"error": str(e)})
+        await _send_json(send, 200, payload)
+
+    asgi.get_api = get_api
+    return asgi
+
+
+app = create_asgi_app()
@@ -0,0 +1,655 @@
+# bench.py - benchmark: sinh dữ liệu đội xe giả lập (hàng triệu Trip/Payment) + chạy mọi route qua Flask test client
+# Dữ liệu bench tách riêng (email @bench.local, biển số BENCH-) nên purge() xóa sạch mà không đụng dữ liệu thật.
+# Chọn DB bằng DATABASE_URL, vd. sqlite:///bench.db hoặc postgresql+psycopg2://localhost/sc_bench:
+#   flask --app manage gen-bench-data --months 12 --trips-per-day 3000
+#   flask --app manage bench-routes --concurrency 8 --rounds 20 --out bench-sqlite.json
+#   flask --app manage bench-compare bench-old.json bench-new.json
+#   flask --app manage bench-startup --repeats 5
+#   flask --app manage bench-async --levels 8,32,128 --duration 5 --workers 4   (cần gunicorn, uvicorn, aiosqlite/asyncpg)
+# Báo cáo JSON (sort_keys) để diff giữa các bản phát hành.
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta, time as dtime
+
+from models import db, User, Car, Driver, Trip, Payment, Cost, Maintenance, DaySummary, SyncEvent, CarLedger, TripEvent
+import exports
+import rollups
+
+BENCH_DOMAIN = "bench.local"
+PLATE_PREFIX = "BENCH-"
+TMP_NAME = "Bench Tmp"  # user tạo qua /admin/users/create trong lúc bench
+PASSWORD = "Bench@123"
+BATCH_SIZE = 10000
+
+PLACES = [("SGN T1", "Q1 Center"), ("SGN T3", "Thu Duc"), ("SGN T3", "District 7"), ("SGN T3", "Phu Nhuan"),
+          ("Q1 Center", "SGN T1"), ("District 7", "SGN T3")]
+FARE_STEPS = [150000, 180000, 200000, 220000, 250000, 280000, 350000]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    xs = sorted(values)
+    k = min(len(xs) - 1, max(0, int(round(pct / 100.0 * (len(xs) - 1)))))
+    return xs[k]
+
+
+# ==== DỮ LIỆU GIẢ LẬP ====
+def _bench_users():
+    return db.select(User.id).where(db.or_(User.email.like(f"%@{BENCH_DOMAIN}"), User.full_name == TMP_NAME))
+
+
+def purge():
+    """Xóa toàn bộ dữ liệu bench (kể cả chuyến/thanh toán sinh ra khi chạy route). Caller rebuild rollup + commit."""
+    users = _bench_users()
+    cars = db.select(Car.id).where(Car.plate.like(f"{PLATE_PREFIX}%"))
+    drivers = db.select(Driver.id).where(db.or_(Driver.user_id.in_(users), Driver.car_id.in_(cars)))
+    trip_where = db.or_(Trip.sales_id.in_(users), Trip.driver_id.in_(drivers), Trip.car_id.in_(cars))
+    counts = {}
+    for name, stmt in (
+        ("payments", db.delete(Payment).where(Payment.trip_id.in_(db.select(Trip.id).where(trip_where)))),
+        ("trip_events", db.delete(TripEvent).where(TripEvent.trip_id.in_(db.select(Trip.id).where(trip_where)))),
+        ("trips", db.delete(Trip).where(trip_where)),
+        ("costs", db.delete(Cost).where(db.or_(Cost.car_id.in_(cars), Cost.driver_id.in_(drivers)))),
+        ("maintenance", db.delete(Maintenance).where(Maintenance.car_id.in_(cars))),
+        ("car_ledger", db.delete(CarLedger).where(CarLedger.car_id.in_(cars))),
+        ("sync_events", db.delete(SyncEvent).where(SyncEvent.driver_id.in_(drivers))),
+        ("drivers", db.delete(Driver).where(Driver.id.in_(drivers))),
+        ("users", db.delete(User).where(User.id.in_(users))),
+        ("cars", db.delete(Car).where(Car.id.in_(cars))),
+    ):
+        counts[name] = db.session.execute(stmt.execution_options(synchronize_session=False)).rowcount
+    return counts
+
+
+def _next_id(model):
+    return (db.session.execute(db.select(db.func.max(model.id))).scalar() or 0) + 1
+
+
+def _sync_sequences(*models):
+    # id do bench tự gán -> Postgres phải kéo sequence lên, nếu không INSERT sau sẽ trùng khóa
+    if db.engine.dialect.name != "postgresql":
+        return
+    for model in models:
+        t = model.__tablename__
+        db.session.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('{t}', 'id'), (SELECT COALESCE(MAX(id), 1) FROM {t}))"))
+
+
+def _insert(model, rows):
+    # Core insert (executemany) trên bảng: nhanh hơn nhiều so với bulk insert qua ORM
+    if rows:
+        db.session.execute(model.__table__.insert(), rows)
+        rows.clear()
+
+
+def generate(drivers=200, sales=50, months=12, trips_per_day=2000, seed=42, echo=print):
+    """Sinh tài khoản/xe + lịch sử chuyến hoàn tất trong `months` tháng tới hôm nay (mỗi ngày ~Poisson(trips_per_day)).
+    Insert theo lô BATCH_SIZE (id Trip/Payment tự gán), commit từng lô, cuối cùng dựng lại rollup."""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    t0 = time.perf_counter()
+    pw = User(); pw.set_password(PASSWORD)  # hash 1 lần cho mọi tài khoản bench
+
+    def users(rows):
+        return [uid for uid, _ in sorted(
+            db.session.execute(db.insert(User).returning(User.id, User.email), rows).all(), key=lambda r: r[1])]
+
+    users([{"email": f"bench_admin@{BENCH_DOMAIN}", "role": "admin", "full_name": "Bench Admin",
+            "active": True, "commission_rate": 0.0, "password_hash": pw.password_hash}])
+    sales_ids = users([{"email": f"bench_sale_{i:04d}@{BENCH_DOMAIN}", "role": "sales", "full_name": f"Bench Sale {i}",
+                        "active": True, "commission_rate": 0.05, "password_hash": pw.password_hash}
+                       for i in range(sales)])
+    driver_uids = users([{"email": f"bench_driver_{i:04d}@{BENCH_DOMAIN}", "role": "driver",
+                          "full_name": f"Bench Driver {i}", "active": True, "commission_rate": 0.40,
+                          "password_hash": pw.password_hash} for i in range(drivers)])
+    car_ids = [cid for cid, _ in sorted(db.session.execute(
+        db.insert(Car).returning(Car.id, Car.plate),
+        [{"plate": f"{PLATE_PREFIX}{i:05d}", "make": "Toyota", "model": "Innova"} for i in range(drivers)]).all(),
+        key=lambda r: r[1])]
+    by_user = {uid: did for did, uid in db.session.execute(
+        db.insert(Driver).returning(Driver.id, Driver.user_id),
+        [{"user_id": u, "car_id": c, "license_no": f"B{i:05d}"} for i, (u, c) in enumerate(zip(driver_uids, car_ids))])}
+    driver_ids = [by_user[u] for u in driver_uids]
+    today = date.today()
+    db.session.execute(db.insert(Maintenance), [
+        {"car_id": c, "scheduled_date": today + timedelta(days=int(rng.integers(-180, 60))),
+         "odometer_km": int(rng.integers(20000, 150000)), "task": "Oil change", "estimated_cost": 800000}
+        for c in car_ids])
+    db.session.commit()
+
+    first_day = today - timedelta(days=int(months * 30.4))
+    now_min = datetime.now().hour * 60 + datetime.now().minute
+    trip_id, pay_id = _next_id(Trip), _next_id(Payment)
+    trips, pays, costs = [], [], []
+    n_trips = n_costs = 0
+    for k in range((today - first_day).days + 1):
+        day = first_day + timedelta(days=k)
+        base = datetime.combine(day, dtime.min)
+        hi = min(23 * 60, now_min - 90) if day == today else 23 * 60
+        n = int(rng.poisson(trips_per_day)) if hi > 5 * 60 else 0
+        drv = rng.integers(0, drivers, n).tolist()
+        sal = np.where(rng.random(n) < 0.85, rng.integers(0, sales, n), -1).tolist()
+        start = rng.integers(5 * 60, max(hi, 5 * 60 + 1), n).tolist()
+        dur = rng.integers(20, 91, n).tolist()
+        place = rng.integers(0, len(PLACES), n).tolist()
+        fare = rng.choice(FARE_STEPS, n).tolist()
+        cash = (rng.random(n) < 0.5).tolist()
+        for j in range(n):
+            started = base + timedelta(minutes=start[j])
+            ended = started + timedelta(minutes=dur[j])
+            d = drv[j]
+            method = "cash" if cash[j] else "transfer"
+            trips.append({
+                "id": trip_id, "driver_id": driver_ids[d], "car_id": car_ids[d],
+                "sales_id": sales_ids[sal[j]] if sal[j] >= 0 else None,
+                "started_at": started, "ended_at": ended, "origin": PLACES[place[j]][0],
+                "destination": PLACES[place[j]][1], "distance_km": dur[j] * 0.4, "fare_quote": fare[j],
+                "final_fare": fare[j], "payment_method": method, "cash_collected": fare[j] if cash[j] else 0,
+                "status": "completed",
+            })
+            pays.append({"id": pay_id, "trip_id": trip_id, "method": method, "amount": fare[j],
+                         "received_at": ended, "reference_code": None})
+            trip_id += 1; pay_id += 1
+        # nhiên liệu: mỗi xe ~3 ngày đổ 1 lần
+        for c in rng.choice(drivers, max(1, drivers // 3), replace=False).tolist():
+            n_costs += 1
+            costs.append({"occurred_at": base + timedelta(hours=int(rng.integers(6, 22))), "car_id": car_ids[c],
+                          "driver_id": driver_ids[c], "category": "fuel",
+                          "amount": float(rng.integers(3, 7)) * 100000, "notes": "bench"})
+        n_trips += n
+        if len(trips) >= BATCH_SIZE:
+            _insert(Trip, trips); _insert(Payment, pays)
+            if len(costs) >= BATCH_SIZE:
+                _insert(Cost, costs)
+            db.session.commit()
+            if echo:
+                echo(f"  {day.isoformat()}: {n_trips} trips")
+    _insert(Trip, trips); _insert(Payment, pays); _insert(Cost, costs)
+    _sync_sequences(Trip, Payment)
+    rollups.rebuild_rollups()
+    db.session.commit()
+
+    secs = time.perf_counter() - t0
+    return {"dialect": db.engine.dialect.name, "seed": seed, "days": (today - first_day).days + 1,
+            "users": 1 + sales + drivers, "cars": drivers, "drivers": drivers,
+            "trips": n_trips, "payments": n_trips, "costs": n_costs, "seconds": round(secs, 1),
+            "rows_per_sec": round((2 * n_trips + n_costs) / secs) if secs else 0}
+
+
+# ==== CHẠY ROUTE ====
+# build(ctx) -> (method, url[, form[, json]]) hoặc None (bỏ qua lượt này); role chọn client đã đăng nhập
+Route = namedtuple("Route", "name endpoint role build stream", defaults=(False,))
+
+
+def _day(ctx):
+    # ngày ngẫu nhiên trong khoảng có dữ liệu -> báo cáo có cả cache HIT lẫn MISS
+    return ctx["rng"].choice(ctx["days"])
+
+
+def _pop(ctx, key, shared=False):
+    src = ctx["shared"][key] if shared else ctx[key]
+    try:
+        return src.pop()
+    except IndexError:
+        return None
+
+
+def _claim(ctx):
+    tid = _pop(ctx, "open_trips", shared=True)
+    if tid is None:
+        return None
+    ctx["claimed"].append(tid)
+    return "POST", f"/driver/claim/{tid}"
+
+
+def _start_existing(ctx):
+    tid = _pop(ctx, "claimed")
+    if tid is None:
+        return None
+    ctx["started"].append(tid)
+    return "POST", f"/trip/start/{tid}"
+
+
+def _finish(ctx):
+    tid = _pop(ctx, "started")
+    if tid is None:
+        return None
+    fare = str(ctx["rng"].choice(FARE_STEPS))
+    return "POST", f"/trip/finish/{tid}", {"destination": "Q1 Center", "final_fare": fare,
+                                            "payment_method": "cash", "cash_collected": fare}
+
+
+def _sync(ctx):
+    # khách vãng lai ghi offline: start + finish (trip_ref) trong 1 lô
+    n = ctx["sync_seq"] = ctx.get("sync_seq", 0) + 1
+    eid = f"bench-{ctx['run_id']}-{ctx['worker']}-{n}"
+    fare = ctx["rng"].choice(FARE_STEPS)
+    return "POST", "/driver/sync", None, {"events": [
+        {"id": f"{eid}-s", "type": "start", "origin": "SGN T3", "fare_quote": fare},
+        {"id": f"{eid}-f", "type": "finish", "trip_ref": f"{eid}-s", "final_fare": fare, "payment_method": "cash",
+         "cash_collected": fare},
+    ]}
+
+
+def _delete_user(ctx):
+    uid = _pop(ctx, "tmp_users", shared=True)
+    return None if uid is None else ("POST", f"/admin/users/delete/{uid}")
+
+
+def _report(path):
+    return lambda ctx: ("GET", f"{path}?date={_day(ctx).isoformat()}")
+
+
+def _export(kind, fmt):
+    def build(ctx):
+        d = _day(ctx)
+        return "GET", f"/admin/export/{kind}.{fmt}?from={(d - timedelta(days=6)).isoformat()}&to={d.isoformat()}"
+    return build
+
+
+ROUTES = [
+    Route("login_page", "login", "anon", lambda ctx: ("GET", "/login")),
+    Route("login", "login", "anon", lambda ctx: ("POST", "/login", {"email": ctx["sales_email"], "password": PASSWORD})),
+    Route("index", "index", "anon", lambda ctx: ("GET", "/")),
+    Route("logout", "logout", "anon", lambda ctx: ("GET", "/logout")),
+    Route("sales_dashboard", "sales_dashboard", "sales", lambda ctx: ("GET", "/sales")),
+    Route("sales_trip_new", "sales_trip_new", "sales",
+          lambda ctx: ("POST", "/sales/trip/new", {"origin": "SGN T3", "destination": "District 7", "fare_quote": ""})),
+    Route("api_fare_quote", "api_fare_quote", "sales",
+          lambda ctx: ("GET", "/api/fare/quote?origin=SGN%20T3&destination=Thu%20Duc&km=15")),
+    Route("api_trips_sales_pending", "api_trip_list", "sales", lambda ctx: ("GET", "/api/trips/sales-pending")),
+    Route("api_trips_sales_month", "api_trip_list", "sales", lambda ctx: ("GET", "/api/trips/sales-month")),
+    Route("api_summary_sales", "api_summary", "sales", lambda ctx: ("GET", "/api/sales/summary")),
+    Route("driver_dashboard", "driver_dashboard", "driver", lambda ctx: ("GET", "/driver")),
+    Route("api_trips_driver_open", "api_trip_list", "driver", lambda ctx: ("GET", "/api/trips/driver-open")),
+    Route("api_trips_driver_month", "api_trip_list", "driver", lambda ctx: ("GET", "/api/trips/driver-month")),
+    Route("api_summary_driver", "api_summary", "driver", lambda ctx: ("GET", "/api/driver/summary")),
+    Route("driver_events", "driver_events", "driver", lambda ctx: ("GET", "/driver/events"), stream=True),
+    Route("driver_claim", "driver_claim", "driver", _claim),
+    Route("trip_start_existing", "trip_start_existing", "driver", _start_existing),
+    Route("trip_finish", "trip_finish", "driver", _finish),
+    Route("trip_start", "trip_start", "driver",
+          lambda ctx: ("POST", "/trip/start", {"origin": "SGN T1", "fare_quote": "150000"})),
+    Route("driver_sync", "driver_sync", "driver", _sync),
+    Route("admin_dashboard", "admin_dashboard", "admin", lambda ctx: ("GET", "/admin")),
+    Route("api_summary_admin", "api_summary", "admin", lambda ctx: ("GET", "/api/admin/summary")),
+    Route("admin_principal_cache", "admin_principal_cache", "admin", lambda ctx: ("GET", "/admin/cache/principals")),
+    Route("admin_report_cache", "admin_report_cache", "admin", lambda ctx: ("GET", "/admin/cache/reports")),
+    Route("metrics", "metrics_endpoint", "admin", lambda ctx: ("GET", "/metrics")),
+    Route("admin_users", "admin_users", "admin", lambda ctx: ("GET", "/admin/users")),
+    Route("admin_users_create", "admin_users_create", "admin",
+          lambda ctx: ("POST", "/admin/users/create", {"role": "sales", "full_name": TMP_NAME})),
+    Route("admin_users_delete", "admin_users_delete", "admin", _delete_user),
+    Route("admin_cashbook", "admin_cashbook", "admin", _report("/admin/reports/cashbook")),
+    Route("admin_sales_commission", "admin_sales_commission", "admin", _report("/admin/reports/sales-commission")),
+    Route("admin_driver_ops", "admin_driver_ops", "admin", _report("/admin/reports/driver-ops")),
+    Route("admin_maintenance", "admin_maintenance", "admin", lambda ctx: ("GET", "/admin/reports/maintenance")),
+    Route("admin_maintenance_csv", "admin_maintenance_csv", "admin", lambda ctx: ("GET", "/admin/reports/maintenance.csv")),
+    Route("admin_analytics", "admin_analytics", "admin", lambda ctx: ("GET", "/admin/analytics/trips.json?by=driver,month")),
+] + [
+    Route(f"admin_export_{kind}_{fmt}", "admin_export", "admin", _export(kind, fmt))
+    for kind in exports.EXPORTS for fmt in ("csv", "xlsx")
+]
+
+
+def _call(client, route, req):
+    method, url, form, body = (req + (None, None))[:4]
+    if route.stream:
+        # SSE không bao giờ kết thúc: đo tới byte đầu tiên rồi đóng
+        resp = client.open(url, method=method, buffered=False)
+        next(iter(resp.response), None)
+        resp.close()
+    else:
+        resp = client.open(url, method=method, data=form, json=body, buffered=True)
+    return resp.status_code
+
+
+def _login(web_app, email):
+    client = web_app.test_client()
+    r = client.post("/login", data={"email": email, "password": PASSWORD})
+    if r.status_code != 302:
+        raise RuntimeError(f"bench login failed for {email}: HTTP {r.status_code}")
+    return client
+
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def _prepare(concurrency, rounds):
+    emails = dict(db.session.execute(db.select(User.email, User.role).where(User.email.like(f"%@{BENCH_DOMAIN}"))).all())
+    sales = sorted(e for e, r in emails.items() if r == "sales")
+    drivers = sorted(e for e, r in emails.items() if r == "driver")
+    admin = f"bench_admin@{BENCH_DOMAIN}"
+    if admin not in emails or not sales or len(drivers) < concurrency:
+        raise RuntimeError(f"Cần dữ liệu bench với >= {concurrency} tài xế; chạy gen-bench-data trước.")
+    n = concurrency * rounds
+    # hàng đợi đơn để claim và user để xóa: mỗi lượt lấy 1 cái, không tranh nhau
+    sale_id = db.session.execute(db.select(User.id).where(User.email == sales[0])).scalar()
+    open_trips = [tid for (tid,) in db.session.execute(db.insert(Trip).returning(Trip.id), [
+        {"sales_id": sale_id, "origin": "SGN T3", "destination": "Q1 Center", "fare_quote": 200000, "status": "booked"}
+        for _ in range(n)]).all()]
+    pw = db.session.execute(db.select(User.password_hash).where(User.email == admin)).scalar()
+    tmp_users = [uid for (uid,) in db.session.execute(db.insert(User).returning(User.id), [
+        {"email": f"bench_tmp_{i:06d}_{int(time.time())}@{BENCH_DOMAIN}", "role": "sales", "full_name": TMP_NAME,
+         "active": True, "password_hash": pw} for i in range(n)]).all()]
+    first = db.session.execute(db.select(db.func.min(DaySummary.day))).scalar() or date.today()
+    first = first if isinstance(first, date) else date.fromisoformat(str(first))
+    days = [first + timedelta(days=k) for k in range((date.today() - first).days + 1)]
+    counts = {name: db.session.execute(db.select(db.func.count()).select_from(m)).scalar()
+              for name, m in (("users", User), ("trips", Trip), ("payments", Payment), ("costs", Cost))}
+    db.session.commit()
+    return {"admin": admin, "sales": sales, "drivers": drivers, "open_trips": open_trips,
+            "tmp_users": tmp_users, "days": days, "rows": counts}
+
+
+def run_routes(web_app, concurrency=8, rounds=20, seed=1):
+    """Mỗi client (1 thread, tài xế riêng) chạy lần lượt ROUTES `rounds` vòng; trả về báo cáo dict."""
+    import dbpool
+    import metrics
+
+    web_app.config["WTF_CSRF_ENABLED"] = False
+    web_app.config["RATE_LIMIT_ENABLED"] = False  # bench dồn tải cố ý, không để 429 làm sai số đo
+    with web_app.app_context():
+        prep = _prepare(concurrency, rounds)
+        dialect = db.engine.dialect.name
+        server = ".".join(map(str, db.engine.dialect.server_version_info or ())) or None
+        db.session.remove()
+    covered = {r.endpoint for r in ROUTES}
+    uncovered = sorted(r.endpoint for r in web_app.url_map.iter_rules() if r.endpoint != "static"
+                       and r.endpoint not in covered)
+
+    shared = {"open_trips": prep["open_trips"], "tmp_users": prep["tmp_users"]}
+    workers = []
+    for i in range(concurrency):  # đăng nhập tuần tự để không dồn bcrypt vào lúc đo
+        sales_email = prep["sales"][i % len(prep["sales"])]
+        clients = {"anon": web_app.test_client(), "sales": _login(web_app, sales_email),
+                   "driver": _login(web_app, prep["drivers"][i]), "admin": _login(web_app, prep["admin"])}
+        ctx = {"rng": random.Random(seed * 1000 + i), "days": prep["days"], "shared": shared,
+               "worker": i, "run_id": int(time.time()),
+               "sales_email": sales_email, "claimed": [], "started": []}
+        workers.append((clients, ctx))
+
+    samples = {r.name: [] for r in ROUTES}
+    statuses = {r.name: {} for r in ROUTES}
+    skipped = {r.name: 0 for r in ROUTES}
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(concurrency + 1)
+    before = {ep: (h.count, metrics.registry.sql_queries.get(ep, 0), metrics.registry.sql_seconds.get(ep, 0.0))
+              for ep, h in metrics.registry.latency.items()}
+
+    def worker(clients, ctx):
+        barrier.wait()
+        for _ in range(rounds):
+            for route in ROUTES:
+                req = route.build(ctx)
+                if req is None:
+                    with lock:
+                        skipped[route.name] += 1
+                    continue
+                t0 = time.perf_counter()
+                try:
+                    status = _call(clients[route.role], route, req)
+                except Exception as e:
+                    status = "error"
+                    with lock:
+                        errors.append(f"{route.name}: {type(e).__name__}: {e}")
+                dt = time.perf_counter() - t0
+                with lock:
+                    samples[route.name].append(dt)
+                    statuses[route.name][str(status)] = statuses[route.name].get(str(status), 0) + 1
+
+    threads = [threading.Thread(target=worker, args=w) for w in workers]
+    for t in threads: t.start()
+    barrier.wait()
+    t0 = time.perf_counter()
+    for t in threads: t.join()
+    wall = time.perf_counter() - t0
+
+    routes = {}
+    for r in ROUTES:
+        xs = samples[r.name]
+        failed = sum(n for s, n in statuses[r.name].items() if s == "error" or int(s) >= 500)
+        routes[r.name] = {
+            "endpoint": r.endpoint, "count": len(xs), "errors": failed, "skipped": skipped[r.name],
+            "status": statuses[r.name],
+            "mean_ms": round(sum(xs) / len(xs) * 1000, 2) if xs else 0.0,
+            "p50_ms": round(percentile(xs, 50) * 1000, 2), "p90_ms": round(percentile(xs, 90) * 1000, 2),
+            "p99_ms": round(percentile(xs, 99) * 1000, 2), "max_ms": round(max(xs, default=0) * 1000, 2),
+        }
+    sql = {}
+    for ep, h in metrics.registry.latency.items():
+        n0, q0, s0 = before.get(ep, (0, 0, 0.0))
+        n = h.count - n0
+        if n:
+            sql[ep] = {"requests": n,
+                       "queries_per_request": round((metrics.registry.sql_queries.get(ep, 0) - q0) / n, 2),
+                       "sql_ms_per_request": round((metrics.registry.sql_seconds.get(ep, 0.0) - s0) / n * 1000, 3)}
+    total = sum(len(x) for x in samples.values())
+    return {
+        "meta": {"dialect": dialect, "server_version": server, "git": _git_rev(), "python": platform.python_version(),
+                 "started_at": datetime.now().isoformat(timespec="seconds"), "concurrency": concurrency,
+                 "rounds": rounds, "seed": seed, "rows": prep["rows"], "uncovered_endpoints": uncovered},
+        "summary": {"requests": total, "errors": sum(r["errors"] for r in routes.values()),
+                    "wall_s": round(wall, 2), "throughput_rps": round(total / wall, 1) if wall else 0.0},
+        "routes": routes,
+        "sql": sql,
+        "pool": dbpool.pool_stats(),
+        "error_samples": errors[:20],
+    }
+
+
+def compare(old, new, metric="p50_ms"):
+    """[(route, old, new, %thay đổi)] theo `metric`, route chậm đi nhiều nhất lên đầu."""
+    out = []
+    for name, cur in new["routes"].items():
+        prev = old["routes"].get(name)
+        if prev is None or not cur["count"]:
+            continue
+        a, b = prev[metric], cur[metric]
+        out.append((name, a, b, round((b - a) / a * 100, 1) if a else 0.0))
+    return sorted(out, key=lambda r: r[3], reverse=True)
+
+
+# ==== KHỞI ĐỘNG ====
+# chạy trong process mới: đo import factory / app (route), request đầu tiên (compile template...) và request thứ 2
+_STARTUP_PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import factory
+t1 = time.perf_counter()
+import app as web
+t2 = time.perf_counter()
+client = web.app.test_client()
+status = client.get("/login").status_code
+t3 = time.perf_counter()
+client.get("/login")
+t4 = time.perf_counter()
+print(json.dumps({
+    "import_factory_ms": (t1 - t0) * 1000, "import_app_ms": (t2 - t0) * 1000,
+    "first_request_ms": (t3 - t2) * 1000, "second_request_ms": (t4 - t3) * 1000, "status": status,
+    "heavy_modules": [m for m in ("pandas", "openpyxl", "numpy") if m in sys.modules],
+}))
+"""
+
+
+def _slowest_imports(stderr, top=10):
+    # dòng "-X importtime": "import time: self | cumulative | <thụt lề>tên"; lấy các module mà app.py import trực tiếp
+    out = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cum, name = line[len("import time:"):].split("|")
+        if name.startswith("   ") and not name.startswith("     "):
+            out.append((name.strip(), int(cum) / 1000))
+    return [{"module": m, "ms": round(ms, 1)} for m, ms in sorted(out, key=lambda r: -r[1])[:top]]
+
+
+def startup(repeats=5):
+    """Báo cáo thời gian khởi động (trung vị qua `repeats` process mới)."""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    runs, cli = [], []
+    for _ in range(repeats):
+        p = subprocess.run([sys.executable, "-c", _STARTUP_PROBE], cwd=cwd, capture_output=True, text=True, check=True)
+        runs.append(json.loads(p.stdout.strip().splitlines()[-1]))
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "flask", "--app", "manage", "--help"], cwd=cwd,
+                       capture_output=True, check=True)
+        cli.append((time.perf_counter() - t0) * 1000)
+    p = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=cwd, capture_output=True,
+                       text=True, check=True)
+    report = {k: round(percentile([r[k] for r in runs], 50), 1)
+              for k in ("import_factory_ms", "import_app_ms", "first_request_ms", "second_request_ms")}
+    report.update(
+        cli_help_ms=round(percentile(cli, 50), 1), repeats=repeats, python=platform.python_version(),
+        git=_git_rev(), status=runs[-1]["status"], heavy_modules_at_startup=runs[-1]["heavy_modules"],
+        slowest_imports=_slowest_imports(p.stderr),
+    )
+    return report
+
+
+# ==== SỨC CHỨA: FLASK (gunicorn sync) vs ASYNC_API (gunicorn + UvicornWorker) ====
+# cùng payload JSON (summaries.PLANS: /api/<tên>/summary vs /api/async/<tên>/summary), cùng cookie đăng nhập,
+# cùng số worker; mỗi bên là 1 server gunicorn thật ở subprocess, tải sinh qua HTTP (mỗi client 1 thread)
+DASHBOARDS = ("driver", "sales", "admin")
+SERVERS = (("sync", "app:app", "sync", "/api/{}/summary"),
+           ("async", "async_api:app", "uvicorn.workers.UvicornWorker", "/api/async/{}/summary"))
+
+
+def _level_report(samples, statuses, wall):
+    n = len(samples)
+    return {"requests": n, "errors": sum(v for k, v in statuses.items() if k == "error" or int(k) >= 400),
+            "status": statuses, "throughput_rps": round(n / wall, 1) if wall else 0.0,
+            "p50_ms": round(percentile(samples, 50) * 1000, 2), "p99_ms": round(percentile(samples, 99) * 1000, 2)}
+
+
+def _get(conn, url, headers):
+    conn.request("GET", url, headers=headers)
+    resp = conn.getresponse()
+    resp.read()  # đọc hết body: đo cả thời gian truyền payload, và để tái dùng connection
+    return resp.status
+
+
+def _http_level(port, path, headers, clients_n, duration):
+    import http.client
+    samples, statuses, lock = [], {}, threading.Lock()
+    barrier = threading.Barrier(clients_n + 1)
+
+    def worker(i):
+        role = DASHBOARDS[i % len(DASHBOARDS)]
+        url, hdr = path.format(role), headers[role][i % len(headers[role])]
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)  # worker sync đóng connection -> tự mở lại
+        barrier.wait()
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            t0 = time.perf_counter()
+            try:
+                status = str(_get(conn, url, hdr))
+            except Exception:
+                conn.close()
+                status = "error"
+            with lock:
+                samples.append(time.perf_counter() - t0)
+                statuses[status] = statuses.get(status, 0) + 1
+        conn.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients_n)]
+    for t in threads: t.start()
+    barrier.wait()
+    t0 = time.perf_counter()
+    for t in threads: t.join()
+    return _level_report(samples, statuses, time.perf_counter() - t0)
+
+
+def _free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve(target, worker_class, workers, env, path, headers):
+    """Chạy gunicorn ở subprocess, chờ tới khi cả 3 dashboard trả 200; trả về (process, port)."""
+    import http.client
+    import tempfile
+    port = _free_port()
+    log = tempfile.TemporaryFile()
+    proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "-w", str(workers), "-k", worker_class,
+                             "-b", f"127.0.0.1:{port}", "--log-level", "warning", target],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            stdout=subprocess.DEVNULL, stderr=log)
+    deadline, status = time.monotonic() + 60, None
+    while time.monotonic() < deadline and proc.poll() is None:
+        try:
+            status = [_get(http.client.HTTPConnection("127.0.0.1", port, timeout=30), path.format(role), headers[role][0])
+                      for role in DASHBOARDS]
+        except OSError:
+            time.sleep(0.2)
+            continue
+        if all(s == 200 for s in status):
+            return proc, port
+        break
+    proc.kill()
+    proc.wait()
+    log.seek(0)
+    raise RuntimeError(f"gunicorn {target} ({worker_class}) không sẵn sàng, status {status}:\n"
+                       f"{log.read().decode('utf-8', 'replace')[-2000:]}")
+
+
+def capacity(web_app, levels=(8, 32, 128), duration=5.0, workers=4):
+    """Throughput/p50/p99 của JSON dashboard qua Flask và async_api, cùng số worker, ở từng mức client đồng thời.
+
+    Cần gen-bench-data, gunicorn, uvicorn (+ aiosqlite/asyncpg, greenlet cho async_api).
+    """
+    import async_api
+    import dbpool
+
+    web_app.config["WTF_CSRF_ENABLED"] = False
+    web_app.config["RATE_LIMIT_ENABLED"] = False
+    with web_app.app_context():
+        emails = db.session.execute(db.select(User.email, User.role).where(
+            User.email.like(f"%@{BENCH_DOMAIN}"), User.role.in_(DASHBOARDS),
+            User.full_name != TMP_NAME)).all()
+        db.session.remove()
+    by_role = {}
+    for email, role in sorted(emails):
+        by_role.setdefault(role, []).append(email)
+    if any(not by_role.get(role) for role in DASHBOARDS):
+        raise RuntimeError("Cần dữ liệu bench (tài xế, sales, admin); chạy gen-bench-data trước.")
+    # cookie ký bằng SECRET_KEY của process này -> server con phải dùng cùng FLASK_SECRET_KEY
+    cookie_name = web_app.config["SESSION_COOKIE_NAME"]
+    headers = {role: [{"Cookie": f"{cookie_name}={_login(web_app, e).get_cookie(cookie_name).value}"}
+                      for e in by_role[role][:max(levels)]]
+               for role in DASHBOARDS}
+    db_url = web_app.config["SQLALCHEMY_DATABASE_URI"]
+    env = dict(os.environ, DATABASE_URL=db_url, FLASK_SECRET_KEY=web_app.config["SECRET_KEY"])
+    env.pop("ASYNC_DATABASE_URL", None)  # 2 bên cùng 1 database
+
+    report = {"meta": {"git": _git_rev(), "python": platform.python_version(), "duration_s": duration,
+                       "levels": list(levels), "workers": workers, "pool_size": dbpool.POOL_SIZE,
+                       "max_overflow": dbpool.MAX_OVERFLOW,
+                       "servers": {name: f"gunicorn -k {wc} {target}" for name, target, wc, _ in SERVERS},
+                       "database": async_api.async_url(db_url).render_as_string(hide_password=True),
+                       "started_at": datetime.now().isoformat(timespec="seconds")}}
+    for name, target, worker_class, path in SERVERS:
+        proc, port = _serve(target, worker_class, workers, env, path, headers)
+        try:
+            report[name] = {str(n): _http_level(port, path, headers, n, duration) for n in levels}
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+    return report
@@ -0,0 +1,128 @@
+# dbpool.py - cấu hình engine/pool từ biến môi trường + PRAGMA cho SQLite + đo thời gian chờ lấy connection
+#   DB_POOL_SIZE=5  DB_MAX_OVERFLOW=10  DB_POOL_TIMEOUT=30  DB_POOL_RECYCLE=1800  DB_POOL_PRE_PING=1
+#   DB_STATEMENT_TIMEOUT_MS=0 (Postgres, 0 = tắt)
+#   SQLITE_JOURNAL_MODE=WAL  SQLITE_SYNCHRONOUS=NORMAL  SQLITE_BUSY_TIMEOUT_MS=5000
+# Kích thước worker: mỗi worker gunicorn có pool riêng -> tổng connection = workers * (size + overflow).
+# sc_db_pool_checkout_seconds trên /metrics tăng dần -> pool quá nhỏ so với số thread của worker.
+import os
+import sqlite3
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool
+
+import metrics
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# < timeout idle của Postgres/pgbouncer/LB để không dùng lại connection đã bị cắt
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() not in ("0", "false", "no")
+STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+CHECKOUT_METRIC = "sc_db_pool_checkout_seconds"
+CHECKOUT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+stats = {"checkouts": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0, "timeouts": 0}
+_pools = []
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool đo thời gian chờ lấy connection (gồm cả mở connection mới khi pool chưa đầy)."""
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        _pools.append(self)
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with _lock:
+                stats["timeouts"] += 1
+            raise
+        finally:
+            dt = time.perf_counter() - t0
+            with _lock:
+                stats["checkouts"] += 1
+                stats["wait_seconds"] += dt
+                stats["max_wait_seconds"] = max(stats["max_wait_seconds"], dt)
+            metrics.registry.observe(CHECKOUT_METRIC, dt, "Time to check a connection out of the pool.",
+                                     CHECKOUT_BUCKETS)
+
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def engine_options(uri):
+    """SQLALCHEMY_ENGINE_OPTIONS cho uri."""
+    url = make_url(uri)
+    opts = {"pool_pre_ping": PRE_PING}
+    if _is_memory_sqlite(url):
+        return opts  # SingletonThreadPool/StaticPool: không có size/overflow
+    opts.update(poolclass=TimedQueuePool, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                pool_timeout=POOL_TIMEOUT, pool_recycle=POOL_RECYCLE)
+    if url.get_backend_name() == "postgresql" and STATEMENT_TIMEOUT_MS > 0:
+        opts["connect_args"] = {"options": f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"}
+    return opts
+
+
+def sqlite_pragmas(dbapi_connection):
+    """Đặt PRAGMA cho 1 connection SQLite (sqlite3 hoặc aiosqlite qua adapter của SQLAlchemy)."""
+    cur = dbapi_connection.cursor()
+    try:
+        # WAL: đọc không chặn ghi; NORMAL đủ an toàn với WAL; busy_timeout: chờ khóa thay vì "database is locked"
+        cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        if SQLITE_JOURNAL_MODE:
+            cur.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        if SQLITE_SYNCHRONOUS:
+            cur.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    finally:
+        cur.close()
+
+
+@event.listens_for(Engine, "connect")
+def _sqlite_connect(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        sqlite_pragmas(dbapi_connection)
+
+
+def pool_stats():
+    with _lock:
+        out = dict(stats)
+    out["mean_wait_ms"] = round(out["wait_seconds"] / out["checkouts"] * 1000, 3) if out["checkouts"] else 0.0
+    out["max_wait_ms"] = round(out.pop("max_wait_seconds") * 1000, 3)
+    out["wait_seconds"] = round(out["wait_seconds"], 6)
+    out["pools"] = [{"size": p.size(), "checked_out": p.checkedout(), "overflow": p.overflow()} for p in _pools]
+    return out
+
+
+def _collect():
+    s = pool_stats()
+    return [
+        ("sc_db_pool_checkout_timeouts_total", "counter", "Checkouts that hit DB_POOL_TIMEOUT.", [({}, s["timeouts"])]),
+        ("sc_db_pool_checked_out", "gauge", "Connections currently checked out.",
+         [({"pool": str(i)}, p["checked_out"]) for i, p in enumerate(s["pools"])]),
+        ("sc_db_pool_overflow", "gauge", "Connections open beyond pool_size.",
+         [({"pool": str(i)}, p["overflow"]) for i, p in enumerate(s["pools"])]),
+    ]
+
+
+metrics.registry.add_collector(_collect)
+
+
+def init_app(app):
+    """Gọi trước db.init_app(app)."""
+    opts = engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
+    opts.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = opts
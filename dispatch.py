@@ -0,0 +1,85 @@
+# dispatch.py - nhận đơn (claim) bằng 1 câu UPDATE có điều kiện, không khóa dòng
+# Điều phối tự động (dispatcher.py) gán đơn qua assign_trip(), cùng cơ chế.
+# UPDATE không qua ORM nên tự ghi nhật ký (triplog.record) khi thắng.
+from models import db, Trip, OPEN_TRIP_STATUSES
+import triplog
+
+# kết quả claim
+CLAIMED = "claimed"
+TAKEN = "taken"
+NOT_FOUND = "not_found"
+BUSY = "busy"  # tài xế đang có đơn assigned/ongoing
+
+BUSY_TRIP_STATUSES = ("assigned", "ongoing")
+
+
+def open_trips_query():
+    # khớp đúng điều kiện của partial index ix_trips_open để DB chỉ đọc hàng đợi
+    return db.select(Trip).where(
+        Trip.driver_id.is_(None), Trip.status.in_(OPEN_TRIP_STATUSES)
+    ).order_by(Trip.id.asc())
+
+
+def _miss_reason(trip_id):
+    exists = db.session.execute(db.select(Trip.id).where(Trip.id == trip_id)).scalar()
+    return TAKEN if exists else NOT_FOUND
+
+
+def claim_trip(trip_id, driver, start_at=None):
+    """Gán đơn đang chờ cho `driver` nếu chưa ai nhận.
+
+    UPDATE trips SET driver_id=... WHERE id=? AND driver_id IS NULL AND status IN (...):
+    chỉ đúng 1 tài xế có rowcount=1, những người còn lại nhận TAKEN ngay. Nếu có `start_at`
+    thì chuyển luôn sang `ongoing` (đơn đã gán cho chính tài xế này cũng được bắt đầu).
+    Caller commit.
+    """
+    values = {"driver_id": driver.id, "status": "assigned"}
+    if getattr(driver, "car_id", None):
+        values["car_id"] = driver.car_id
+    cond = [Trip.id == trip_id, Trip.status.in_(OPEN_TRIP_STATUSES)]
+    if start_at is None:
+        cond.append(Trip.driver_id.is_(None))
+    else:
+        values.update(status="ongoing", started_at=start_at)
+        cond.append(db.or_(Trip.driver_id.is_(None), Trip.driver_id == driver.id))
+        # đơn đã có tài xế giữ nguyên xe đã gán
+        values["car_id"] = db.case((Trip.driver_id.is_(None), values.get("car_id", Trip.car_id)), else_=Trip.car_id)
+
+    # RETURNING: car_id thực tế (CASE ở trên) cho nhật ký chuyến
+    row = db.session.execute(
+        db.update(Trip).where(*cond).values(values).returning(Trip.car_id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None:
+        return _miss_reason(trip_id)
+    triplog.record(trip_id, "started" if start_at is not None else "claimed",
+                   dict(values, car_id=row.car_id))
+    return CLAIMED
+
+
+def _driver_busy(driver_id):
+    # alias: không để subquery tự correlate với bảng trips của câu UPDATE; dùng ix_trips_status_driver
+    t = db.aliased(Trip)
+    return db.select(t.id).where(t.status.in_(BUSY_TRIP_STATUSES), t.driver_id == driver_id).exists()
+
+
+def assign_trip(trip_id, driver_id, car_id=None):
+    """Gán đơn đang chờ cho tài xế rảnh (điều phối tự động); như claim_trip nhưng trả BUSY nếu tài xế đã có đơn.
+
+    Caller commit.
+    """
+    values = {"driver_id": driver_id, "status": "assigned"}
+    if car_id:
+        values["car_id"] = car_id
+    res = db.session.execute(
+        db.update(Trip).where(
+            Trip.id == trip_id, Trip.driver_id.is_(None), Trip.status.in_(OPEN_TRIP_STATUSES),
+            ~_driver_busy(driver_id),
+        ).values(values).execution_options(synchronize_session=False)
+    )
+    if res.rowcount == 1:
+        triplog.record(trip_id, "assigned", values)
+        return CLAIMED
+    if db.session.execute(db.select(_driver_busy(driver_id))).scalar():
+        return BUSY
+    return _miss_reason(trip_id)
@@ -0,0 +1,423 @@
+# dispatcher.py - điều phối tự động: đơn mới (booked) được gán ngay cho tài xế rảnh phù hợp nhất
+# Tài xế rảnh (không có đơn assigned/ongoing) nằm trong heap xếp theo:
+#   1. xe đang không được tài xế khác dùng (nhiều tài xế chung 1 xe)
+#   2. ít chuyến nhất hôm nay (chia đều)
+#   3. rảnh lâu nhất (chuyến gần nhất kết thúc sớm nhất)
+# Gán 1 đơn = pop heap O(log n) + 1 UPDATE có điều kiện (dispatch.assign_trip), không quét bảng trips.
+# Không có ai rảnh -> đơn xếp hàng (FIFO), gán ngay khi có tài xế trả khách.
+# Trạng thái cập nhật theo luồng sự kiện events.py (booked/claimed/started/finished) và dựng lại từ DB
+# khi khởi động, mỗi DISPATCH_REBUILD_SECONDS và khi sang ngày (sự kiện bị rơi cũng tự khớp lại).
+# Chạy: chỉ 1 process riêng cho cả hệ thống `flask --app manage run-dispatcher` (cần EVENTS_REDIS_URL để nhận
+# sự kiện từ các worker); web worker không tự chạy điều phối (nhiều worker = nhiều heap gán trùng tài xế).
+# Mô phỏng 1 ngày: `flask --app manage dispatch-sim --date 2024-05-01` (xem simulate()).
+import heapq
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from datetime import date, datetime, time as dtime, timedelta
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+REBUILD_SECONDS = float(os.getenv("DISPATCH_REBUILD_SECONDS", "300"))
+ASSIGN_METRIC = "sc_dispatch_assign_seconds"
+ASSIGN_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 60.0, 300.0, 900.0)
+
+# kết quả của hàm assign (trùng giá trị với dispatch.*)
+CLAIMED, TAKEN, NOT_FOUND, BUSY = "claimed", "taken", "not_found", "busy"
+
+
+class IdlePool:
+    """Heap tài xế rảnh; đổi hạng/xóa = đánh dấu (lazy deletion), entry cũ bị bỏ qua khi pop."""
+
+    def __init__(self):
+        self._heap = []
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, driver_id):
+        return driver_id in self._keys
+
+    def push(self, driver_id, key):
+        self._keys[driver_id] = key
+        heapq.heappush(self._heap, (key, driver_id))
+        if len(self._heap) > 2 * len(self._keys) + 64:
+            self._heap = [(k, d) for d, k in self._keys.items()]
+            heapq.heapify(self._heap)
+
+    def remove(self, driver_id):
+        self._keys.pop(driver_id, None)
+
+    def pop(self):
+        while self._heap:
+            key, driver_id = heapq.heappop(self._heap)
+            if self._keys.get(driver_id) == key:
+                del self._keys[driver_id]
+                return driver_id
+        return None
+
+
+class _Driver:
+    __slots__ = ("car_id", "trips", "last_end", "busy")
+
+    def __init__(self, car_id, trips=0, last_end=0.0, busy=False):
+        self.car_id, self.trips, self.last_end, self.busy = car_id, trips, last_end, busy
+
+
+class Dispatcher:
+    """Trạng thái điều phối trong bộ nhớ; không tự đụng DB (ghi qua `assign(trip_id, driver_id, car_id)`)."""
+
+    def __init__(self, assign, clock=time.time, record_metrics=True):
+        self._assign = assign
+        self._clock = clock
+        self._record_metrics = record_metrics
+        self.lock = threading.RLock()
+        self.pool = IdlePool()
+        self.drivers = {}
+        self.by_car = {}
+        self.cars_in_use = {}
+        self.pending = deque()   # (trip_id, lúc vào hàng)
+        self.pending_ids = set()
+        self.stats = {"assigned": 0, "conflicts": 0, "errors": 0, "rebuilds": 0, "max_pending": 0}
+        self.day = None
+
+    # ---- heap ----
+    def _key(self, driver_id, d):
+        return (1 if self.cars_in_use.get(d.car_id) else 0, d.trips, d.last_end, driver_id)
+
+    def _push(self, driver_id):
+        d = self.drivers[driver_id]
+        if not d.busy:
+            self.pool.push(driver_id, self._key(driver_id, d))
+
+    def _car_changed(self, car_id):
+        # xe vừa bận/rảnh: xếp lại các tài xế rảnh dùng chung xe (thường 1-2 người)
+        for driver_id in self.by_car.get(car_id, ()):
+            if driver_id in self.pool:
+                self._push(driver_id)
+
+    def _set_busy(self, driver_id, count=True):
+        d = self.drivers.get(driver_id)
+        if d is None or d.busy:
+            return
+        d.busy = True
+        d.trips += 1 if count else 0
+        self.pool.remove(driver_id)
+        if d.car_id:
+            self.cars_in_use[d.car_id] = self.cars_in_use.get(d.car_id, 0) + 1
+            self._car_changed(d.car_id)
+
+    def _set_idle(self, driver_id, at):
+        d = self.drivers.get(driver_id)
+        if d is None:
+            return
+        if d.busy and d.car_id:
+            self.cars_in_use[d.car_id] = max(0, self.cars_in_use.get(d.car_id, 0) - 1)
+            self._car_changed(d.car_id)
+        d.busy = False
+        d.last_end = max(d.last_end, at)
+        self._push(driver_id)
+
+    # ---- trạng thái từ DB ----
+    def load(self, drivers, busy, trips_today, last_end, pending, day=None):
+        """drivers: {id: car_id}; busy: tập id; trips_today/last_end: {id: số chuyến / epoch giây}; pending: [trip_id]."""
+        with self.lock:
+            self.pool = IdlePool()
+            self.drivers = {i: _Driver(car, trips_today.get(i, 0), last_end.get(i, 0.0), i in busy)
+                            for i, car in drivers.items()}
+            self.by_car = {}
+            for i, car in drivers.items():
+                self.by_car.setdefault(car, []).append(i)
+            self.cars_in_use = {}
+            for d in self.drivers.values():
+                if d.busy and d.car_id:
+                    self.cars_in_use[d.car_id] = self.cars_in_use.get(d.car_id, 0) + 1
+            for i in self.drivers:
+                self._push(i)
+            queued = {t: at for t, at in self.pending}
+            now = self._clock()
+            self.pending = deque((t, queued.get(t, now)) for t in pending)
+            self.pending_ids = set(pending)
+            self.day = day
+            self.stats["rebuilds"] += 1
+            self._drain()
+
+    # ---- sự kiện ----
+    def booked(self, trip_id, at=None):
+        with self.lock:
+            if trip_id in self.pending_ids:
+                return
+            self.pending.append((trip_id, self._clock() if at is None else at))
+            self.pending_ids.add(trip_id)
+            self.stats["max_pending"] = max(self.stats["max_pending"], len(self.pending_ids))
+            self._drain()
+
+    def claimed(self, trip_id, driver_id):
+        """Tài xế tự nhận đơn (hoặc thông báo của chính dispatcher): bỏ đơn khỏi hàng, tài xế bận."""
+        with self.lock:
+            self.pending_ids.discard(trip_id)
+            self._set_busy(driver_id)
+
+    def started(self, driver_id):
+        with self.lock:
+            self._set_busy(driver_id)
+
+    def finished(self, driver_id, at=None):
+        with self.lock:
+            self._set_idle(driver_id, self._clock() if at is None else at)
+            self._drain()
+
+    def handle(self, ev):
+        """Sự kiện từ events.py."""
+        kind, trip_id, driver_id = ev.get("type"), ev.get("id"), ev.get("driver_id")
+        if kind == "booked" and trip_id is not None and driver_id is None:
+            self.booked(trip_id)
+        elif kind == "claimed" and driver_id is not None:
+            self.claimed(trip_id, driver_id)
+        elif kind == "started" and driver_id is not None:
+            self.started(driver_id)
+        elif kind == "finished" and driver_id is not None:
+            self.finished(driver_id)
+
+    def _drain(self):
+        while self.pending:
+            trip_id, queued_at = self.pending[0]
+            if trip_id not in self.pending_ids:
+                self.pending.popleft()
+                continue
+            driver_id = self.pool.pop()
+            if driver_id is None:
+                return
+            try:
+                res = self._assign(trip_id, driver_id, self.drivers[driver_id].car_id)
+            except Exception:
+                log.exception("dispatch: gán đơn %s thất bại", trip_id)
+                self.stats["errors"] += 1
+                self._push(driver_id)
+                return  # thử lại ở sự kiện sau / lần dựng lại
+            if res == CLAIMED:
+                self.pending.popleft()
+                self.pending_ids.discard(trip_id)
+                self._set_busy(driver_id)
+                self.stats["assigned"] += 1
+                if self._record_metrics:
+                    metrics.registry.observe(ASSIGN_METRIC, max(0.0, self._clock() - queued_at),
+                                             "Time from booking to automatic assignment.", ASSIGN_BUCKETS)
+            elif res == BUSY:  # trạng thái lệch DB: tài xế đã có đơn
+                self.stats["conflicts"] += 1
+                self._set_busy(driver_id, count=False)
+            else:  # đơn đã có người nhận / bị xóa
+                self.stats["conflicts"] += 1
+                self.pending.popleft()
+                self.pending_ids.discard(trip_id)
+                self._push(driver_id)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, pending=len(self.pending_ids), idle=len(self.pool),
+                        busy=sum(1 for d in self.drivers.values() if d.busy), drivers=len(self.drivers))
+
+
+# ==== DB ====
+def load_state(day=None):
+    """Tham số cho Dispatcher.load() từ DB (trong app context): tài xế đang hoạt động, ai đang bận,
+    số chuyến hôm nay (rollup), giờ kết thúc chuyến gần nhất hôm nay, hàng đợi đơn chưa có tài xế."""
+    from models import db, User, Driver, Trip, DriverDaily
+    import dispatch
+
+    day = day or date.today()
+    start = datetime.combine(day, dtime.min)
+    drivers = dict(db.session.execute(
+        db.select(Driver.id, Driver.car_id).join(User, User.id == Driver.user_id).where(User.active.is_not(False))
+    ).all())
+    busy = set(db.session.execute(
+        db.select(Trip.driver_id).where(Trip.status.in_(dispatch.BUSY_TRIP_STATUSES), Trip.driver_id.is_not(None))
+        .distinct()
+    ).scalars())
+    trips = {i: int(n) for i, n in db.session.execute(
+        db.select(DriverDaily.driver_id, db.func.sum(DriverDaily.trips)).where(DriverDaily.day == day)
+        .group_by(DriverDaily.driver_id)
+    )}
+    last_end = {i: t.timestamp() for i, t in db.session.execute(
+        db.select(Trip.driver_id, db.func.max(Trip.ended_at))
+        .where(Trip.ended_at >= start, Trip.ended_at < start + timedelta(days=1), Trip.driver_id.is_not(None))
+        .group_by(Trip.driver_id)
+    ) if t is not None}
+    pending = list(db.session.execute(dispatch.open_trips_query().with_only_columns(Trip.id)).scalars())
+    db.session.rollback()
+    return {"drivers": drivers, "busy": busy, "trips_today": trips, "last_end": last_end,
+            "pending": pending, "day": day}
+
+
+def db_assign(trip_id, driver_id, car_id):
+    """assign cho Dispatcher chạy thật: UPDATE có điều kiện + commit + phát sự kiện claimed (trong app context)."""
+    from models import db
+    import dispatch
+    import events
+
+    res = dispatch.assign_trip(trip_id, driver_id, car_id)
+    if res != CLAIMED:
+        db.session.rollback()
+        return res
+    db.session.commit()
+    events.publish("claimed", {"id": trip_id, "status": "assigned", "driver_id": driver_id, "auto": True})
+    return res
+
+
+class Worker(threading.Thread):
+    """Nghe luồng sự kiện và điều phối; dựng lại trạng thái định kỳ."""
+
+    def __init__(self, app, rebuild_seconds=REBUILD_SECONDS):
+        super().__init__(name="dispatcher", daemon=True)
+        self.app = app
+        self.rebuild_seconds = rebuild_seconds
+        self.dispatcher = Dispatcher(db_assign)
+        self.stop_event = threading.Event()
+
+    def rebuild(self):
+        with self.app.app_context():
+            self.dispatcher.load(**load_state())
+
+    def run(self):
+        import events
+        from models import db
+
+        sub = events.get_broker().subscribe()  # đăng ký trước khi dựng lại để không lỡ sự kiện ở giữa
+        next_rebuild = 0.0
+        try:
+            while not self.stop_event.is_set():
+                if time.monotonic() >= next_rebuild or self.dispatcher.day != date.today():
+                    try:
+                        self.rebuild()
+                    except Exception:
+                        log.exception("dispatch: dựng lại trạng thái thất bại")
+                    next_rebuild = time.monotonic() + self.rebuild_seconds
+                ev = sub.get(timeout=1.0)
+                if ev is None:
+                    continue
+                with self.app.app_context():
+                    try:
+                        self.dispatcher.handle(ev)
+                    finally:
+                        db.session.remove()
+        finally:
+            sub.close()
+
+    def stop(self):
+        self.stop_event.set()
+
+
+_worker = None
+
+
+def _collect():
+    if _worker is None:
+        return []
+    s = _worker.dispatcher.snapshot()
+    return [
+        ("sc_dispatch_pending", "gauge", "Bookings waiting for an idle driver.", [({}, s["pending"])]),
+        ("sc_dispatch_idle_drivers", "gauge", "Idle drivers in the dispatch heap.", [({}, s["idle"])]),
+        ("sc_dispatch_assigned_total", "counter", "Trips assigned automatically.", [({}, s["assigned"])]),
+        ("sc_dispatch_conflicts_total", "counter", "Assignments lost to a concurrent claim.", [({}, s["conflicts"])]),
+        ("sc_dispatch_errors_total", "counter", "Assignments that raised.", [({}, s["errors"])]),
+    ]
+
+
+metrics.registry.add_collector(_collect)
+
+
+def start(app):
+    """Chạy Worker trong process hiện tại (1 lần)."""
+    global _worker
+    if _worker is None:
+        _worker = Worker(app)
+        _worker.start()
+    return _worker
+
+
+# ==== MÔ PHỎNG ====
+def synthetic_day(bookings=2000, seed=1, open_hour=5, close_hour=23, minutes=(20, 90)):
+    """[(giây kể từ 0h, thời lượng giây)] đơn rải đều trong giờ hoạt động."""
+    rng = random.Random(seed)
+    out = [(rng.uniform(open_hour * 3600, close_hour * 3600), rng.uniform(*minutes) * 60) for _ in range(bookings)]
+    return sorted(out)
+
+
+def recorded_day(day):
+    """Đơn của 1 ngày trong DB: lúc bắt đầu chuyến coi là lúc đặt, thời lượng = ended_at - started_at."""
+    from models import db
+    import archive
+
+    start = datetime.combine(day, dtime.min)
+    end = start + timedelta(days=1)
+    T = archive.trips(start, end, by="started_at")
+    rows = db.session.execute(
+        db.select(T.started_at, T.ended_at)
+        .where(T.started_at >= start, T.started_at < end, T.ended_at.is_not(None))
+        .order_by(T.started_at)
+    ).all()
+    return [((s - start).total_seconds(), max(60.0, (e - s).total_seconds())) for s, e in rows]
+
+
+def simulate(bookings, drivers=50, cars=None, seed=1):
+    """Chạy Dispatcher với đồng hồ ảo trên danh sách (lúc đặt, thời lượng); trả về báo cáo dict.
+
+    Đơn được gán là chạy ngay; tài xế rảnh lại khi hết thời lượng. Đo thời gian chờ gán của đơn,
+    độ dài hàng đợi, độ đều số chuyến giữa các tài xế và chi phí CPU thật của mỗi thao tác.
+    """
+    from bench import percentile
+
+    rng = random.Random(seed)
+    cars = cars or drivers
+    clock = [0.0]
+    timeline = []  # (lúc, seq, loại, dữ liệu)
+    seq = [0]
+
+    def at(t, kind, data):
+        seq[0] += 1
+        heapq.heappush(timeline, (t, seq[0], kind, data))
+
+    duration, booked_at, waits = {}, {}, []
+
+    def assign(trip_id, driver_id, car_id):
+        waits.append(clock[0] - booked_at[trip_id])
+        at(clock[0] + duration[trip_id], "finish", driver_id)
+        return CLAIMED
+
+    d = Dispatcher(assign, clock=lambda: clock[0], record_metrics=False)
+    d.load({i: rng.randrange(cars) + 1 for i in range(1, drivers + 1)}, set(), {}, {}, [])
+    for trip_id, (t, dur) in enumerate(bookings, start=1):
+        duration[trip_id] = dur
+        at(t, "book", trip_id)
+
+    op_seconds, depth = [], 0
+    while timeline:
+        t, _, kind, data = heapq.heappop(timeline)
+        clock[0] = t
+        t0 = time.perf_counter()
+        if kind == "book":
+            booked_at[data] = t
+            d.booked(data)
+        else:
+            d.finished(data)
+        op_seconds.append(time.perf_counter() - t0)
+        depth = max(depth, len(d.pending_ids))
+    trips = [x.trips for x in d.drivers.values()]
+    return {
+        "bookings": len(bookings), "drivers": drivers, "cars": cars, "assigned": d.stats["assigned"],
+        "unassigned": len(d.pending_ids), "max_queue_depth": depth,
+        "wait_s": {"p50": round(percentile(waits, 50), 1), "p90": round(percentile(waits, 90), 1),
+                   "p99": round(percentile(waits, 99), 1), "max": round(max(waits, default=0), 1),
+                   "immediate_pct": round(sum(1 for w in waits if w == 0) / len(waits) * 100, 1) if waits else 0.0},
+        "trips_per_driver": {"min": min(trips, default=0), "max": max(trips, default=0),
+                             "mean": round(sum(trips) / len(trips), 2) if trips else 0.0},
+        "op_us": {"mean": round(sum(op_seconds) / len(op_seconds) * 1e6, 2) if op_seconds else 0.0,
+                  "p99": round(percentile(op_seconds, 99) * 1e6, 2),
+                  "max": round(max(op_seconds, default=0) * 1e6, 2)},
+    }
@@ -0,0 +1,135 @@
+# events.py - pub/sub trong process cho luồng sự kiện đơn (booked/claimed/started/finished) tới tài xế qua SSE + dispatcher.py
+# Backend mặc định là bộ nhớ của worker; đặt EVENTS_REDIS_URL để dùng Redis pub/sub chung cho nhiều worker.
+import json
+import os
+import queue
+import threading
+
+CHANNEL = "trips"
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+class Subscription:
+    def __init__(self, broker, q):
+        self._broker = broker
+        self._q = q
+
+    def get(self, timeout=None):
+        """Trả về dict sự kiện, hoặc None nếu hết timeout."""
+        try:
+            return self._q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._broker.unsubscribe(self._q)
+
+
+class MemoryBroker:
+    """Chỉ phát trong cùng process; đủ cho 1 worker hoặc dev server."""
+
+    def __init__(self):
+        self._subs = set()
+        self._lock = threading.Lock()
+
+    def publish(self, event: dict):
+        with self._lock:
+            subs = list(self._subs)
+        for q in subs:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                pass  # client chậm: bỏ sự kiện, trang sẽ đồng bộ lại khi tải lại
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subs.add(q)
+        return Subscription(self, q)
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subs.discard(q)
+
+
+class RedisBroker(MemoryBroker):
+    """Phát qua Redis pub/sub; 1 thread/worker nghe kênh rồi chia cho các subscriber local."""
+
+    def __init__(self, url):
+        super().__init__()
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("EVENTS_REDIS_URL được đặt nhưng chưa cài thư viện redis (pip install -r requirements.txt)")
+        self._redis = redis.Redis.from_url(url)
+        self._listener = None
+
+    def publish(self, event: dict):
+        self._redis.publish(CHANNEL, json.dumps(event))
+
+    def subscribe(self):
+        if self._listener is None:
+            with self._lock:
+                if self._listener is None:
+                    self._listener = threading.Thread(target=self._listen, daemon=True)
+                    self._listener.start()
+        return super().subscribe()
+
+    def _listen(self):
+        ps = self._redis.pubsub(ignore_subscribe_messages=True)
+        ps.subscribe(CHANNEL)
+        for msg in ps.listen():
+            try:
+                MemoryBroker.publish(self, json.loads(msg["data"]))
+            except (ValueError, TypeError):
+                continue
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        url = os.getenv("EVENTS_REDIS_URL")
+        _broker = RedisBroker(url) if url else MemoryBroker()
+    return _broker
+
+
+def set_broker(broker):
+    global _broker
+    _broker = broker
+
+
+def trip_payload(trip):
+    return {
+        "id": trip.id,
+        "status": trip.status,
+        "origin": trip.origin,
+        "destination": trip.destination,
+        "fare_quote": trip.fare_quote or 0,
+        "driver_id": trip.driver_id,
+    }
+
+
+def publish(kind: str, payload: dict):
+    """Gọi SAU commit. Lỗi broker không được làm hỏng request ghi."""
+    try:
+        get_broker().publish({"type": kind, **payload})
+    except Exception:
+        pass
+
+
+def sse_stream(heartbeat=15.0):
+    """Generator text/event-stream; gửi comment ping định kỳ để proxy không cắt kết nối."""
+    sub = get_broker().subscribe()
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            ev = sub.get(timeout=heartbeat)
+            if ev is None:
+                yield ": ping\n\n"
+                continue
+            yield f"event: {ev['type']}\ndata: {json.dumps(ev, ensure_ascii=False)}\n\n"
+    finally:
+        sub.close()
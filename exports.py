@@ -0,0 +1,96 @@
+# exports.py - xuất CSV/XLSX dạng stream: đọc theo lô (yield_per) và ghi từng dòng, bộ nhớ không đổi theo số dòng
+import csv
+import os
+import tempfile
+
+from models import db, Trip, Payment, Cost, Maintenance
+import archive
+
+FETCH_SIZE = 1000
+CSV_FLUSH_ROWS = 500
+FILE_CHUNK = 64 * 1024
+
+# tên export -> (cột lọc theo ngày, các cột xuất)
+EXPORTS = {
+    "trips": (Trip.ended_at, [
+        Trip.id, Trip.status, Trip.sales_id, Trip.driver_id, Trip.car_id, Trip.started_at, Trip.ended_at,
+        Trip.origin, Trip.destination, Trip.distance_km, Trip.fare_quote, Trip.final_fare,
+        Trip.payment_method, Trip.cash_collected,
+    ]),
+    "payments": (Payment.received_at, [
+        Payment.id, Payment.trip_id, Payment.method, Payment.amount, Payment.received_at, Payment.reference_code,
+    ]),
+    "costs": (Cost.occurred_at, [
+        Cost.id, Cost.occurred_at, Cost.car_id, Cost.driver_id, Cost.category, Cost.amount, Cost.notes,
+    ]),
+    "maintenance": (Maintenance.scheduled_date, [
+        Maintenance.id, Maintenance.car_id, Maintenance.scheduled_date, Maintenance.odometer_km, Maintenance.task,
+        Maintenance.estimated_cost, Maintenance.actual_cost, Maintenance.notes,
+    ]),
+}
+
+
+def header(kind):
+    return [c.key for c in EXPORTS[kind][1]]
+
+
+def columns(kind, start=None, end=None):
+    """(cột ngày, các cột) của export; trips/payments đọc cả bảng lưu trữ khi [start, end) chạm tới (archive.py)."""
+    date_col, cols = EXPORTS[kind]
+    if kind not in archive.KINDS:
+        return date_col, cols
+    src = archive.source(kind, start, end)
+    return getattr(src, date_col.key), [getattr(src, c.key) for c in cols]
+
+
+def iter_rows(kind, start=None, end=None):
+    """Các dòng (tuple) của export trong [start, end); psycopg2 dùng server-side cursor nhờ yield_per."""
+    date_col, cols = columns(kind, start, end)
+    stmt = db.select(*cols).order_by(date_col, cols[0])
+    if start is not None:
+        stmt = stmt.where(date_col >= start)
+    if end is not None:
+        stmt = stmt.where(date_col < end)
+    for row in db.session.execute(stmt.execution_options(yield_per=FETCH_SIZE)):
+        yield tuple(row)
+
+
+class _Echo:
+    # csv.writer ghi vào đây -> writerow() trả về chính chuỗi dòng
+    def write(self, s):
+        return s
+
+
+def stream_csv(kind, start=None, end=None):
+    w = csv.writer(_Echo())
+    buf = ["\ufeff" + w.writerow(header(kind))]  # BOM để Excel đọc đúng UTF-8
+    for row in iter_rows(kind, start, end):
+        buf.append(w.writerow(row))
+        if len(buf) >= CSV_FLUSH_ROWS:
+            yield "".join(buf)
+            buf = []
+    if buf:
+        yield "".join(buf)
+
+
+def stream_xlsx(kind, start=None, end=None):
+    """openpyxl write-only ghi ra file tạm (xlsx là zip, phải đóng mới đọc được) rồi stream file theo khối."""
+    from openpyxl import Workbook
+
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(kind)
+        ws.append(header(kind))
+        for row in iter_rows(kind, start, end):
+            ws.append(row)
+        wb.save(path)
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(FILE_CHUNK)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.unlink(path)
@@ -0,0 +1,43 @@
+# factory.py - create_app() dùng chung cho web (app.py), CLI (manage.py), prestart.py và các script seed
+# Chỉ dựng config + extension (DB/pool, CSRF, login, metrics, rate limit). Route nằm ở app.py và chỉ được import khi chạy web,
+# nên CLI/prestart không phải nạp toàn bộ app; pandas/openpyxl/numpy chỉ import khi thật sự dùng tới.
+import os
+
+from flask import Flask
+from flask_login import LoginManager
+from flask_wtf import CSRFProtect
+
+from models import db
+import dbpool
+import metrics
+import principals
+import ratelimit
+
+csrf = CSRFProtect()
+login_manager = LoginManager()
+login_manager.login_view = "login"
+
+
+@login_manager.user_loader
+def load_user(user_id):
+    # cache User + Driver/Car (LRU + TTL), tự xóa khi tài khoản/hồ sơ đổi
+    return principals.load_user(int(user_id))
+
+
+def create_app(**config):
+    """Flask app đã cấu hình; `config` ghi đè (vd. create_app(TESTING=True))."""
+    app = Flask(__name__)
+    app.config.update(
+        SECRET_KEY=os.getenv("FLASK_SECRET_KEY", "change-me-now"),
+        SQLALCHEMY_DATABASE_URI=os.getenv("DATABASE_URL", "sqlite:///sc.db"),
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        WTF_CSRF_ENABLED=True,
+    )
+    app.config.update(config)
+    dbpool.init_app(app)
+    db.init_app(app)
+    csrf.init_app(app)
+    login_manager.init_app(app)
+    metrics.init_app(app)
+    ratelimit.init_app(app)
+    return app
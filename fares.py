@@ -0,0 +1,155 @@
+# fares.py - tính giá cước từ bảng Fare, nạp 1 lần vào mảng NumPy
+# Giá = base_fare + max(0, km - base_km) * per_km [+ airport_surcharge] [* (1 + night_surcharge_pct/100)]
+import os
+import threading
+import time as _time
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import db, Fare
+
+NIGHT_START_HOUR = 22
+NIGHT_END_HOUR = 6
+AIRPORT_KEYWORDS = ("sgn", "airport", "sân bay", "san bay", "tân sơn nhất", "tan son nhat")
+# các worker khác không nhận được event ORM của nhau: TTL giới hạn độ trễ
+CACHE_TTL = float(os.getenv("FARE_CACHE_TTL", "300"))
+
+
+def _norm(s):
+    return " ".join((s or "").lower().split())
+
+
+def is_airport(*places):
+    return any(k in _norm(p) for p in places for k in AIRPORT_KEYWORDS)
+
+
+def is_night(at: datetime):
+    return at.hour >= NIGHT_START_HOUR or at.hour < NIGHT_END_HOUR
+
+
+class FareTable:
+    """Bảng giá dạng cột: mỗi tuyến 1 chỉ số, tra cứu qua route_code hoặc (origin, destination)."""
+
+    def __init__(self, fares):
+        import numpy as np  # chỉ nạp khi dựng bảng giá lần đầu, không làm chậm lúc khởi động
+
+        n = len(fares)
+        self.route_codes = [f.route_code for f in fares]
+        self.places = [(f.origin, f.destination) for f in fares]
+        self.base_km = np.fromiter((f.base_km or 0 for f in fares), dtype=np.float64, count=n)
+        self.base_fare = np.fromiter((f.base_fare or 0 for f in fares), dtype=np.float64, count=n)
+        self.per_km = np.fromiter((f.per_km or 0 for f in fares), dtype=np.float64, count=n)
+        self.airport = np.fromiter((f.airport_surcharge or 0 for f in fares), dtype=np.float64, count=n)
+        self.night_pct = np.fromiter((f.night_surcharge_pct or 0 for f in fares), dtype=np.float64, count=n)
+        self.by_code = {f.route_code: i for i, f in enumerate(fares) if f.route_code}
+        self.by_route = {}
+        for i, f in enumerate(fares):
+            self.by_route.setdefault((_norm(f.origin), _norm(f.destination)), i)
+
+    def __len__(self):
+        return len(self.route_codes)
+
+    def lookup(self, route_code=None, origin=None, destination=None):
+        """Chỉ số tuyến hoặc -1 nếu không có."""
+        if route_code and route_code in self.by_code:
+            return self.by_code[route_code]
+        return self.by_route.get((_norm(origin), _norm(destination)), -1)
+
+    def price(self, idx, km=None, airport=False, night=False):
+        km = self.base_km[idx] if km is None else km
+        p = self.base_fare[idx] + max(0.0, km - self.base_km[idx]) * self.per_km[idx]
+        if airport:
+            p += self.airport[idx]
+        if night:
+            p *= 1 + self.night_pct[idx] / 100.0
+        return float(p)
+
+    def price_many(self, idx, km, airport, night):
+        """Tính giá cho cả mảng; idx = -1 trả về NaN."""
+        import numpy as np
+
+        idx = np.asarray(idx, dtype=np.int64)
+        km = np.asarray(km, dtype=np.float64)
+        ok = idx >= 0
+        j = np.where(ok, idx, 0)
+        p = self.base_fare[j] + np.maximum(0.0, km - self.base_km[j]) * self.per_km[j]
+        p = p + np.where(airport, self.airport[j], 0.0)
+        p = p * np.where(night, 1 + self.night_pct[j] / 100.0, 1.0)
+        return np.where(ok, p, np.nan)
+
+
+_table = None
+_loaded_at = 0.0
+_lock = threading.Lock()
+
+
+def get_table() -> FareTable:
+    global _table, _loaded_at
+    t = _table
+    if t is not None and _time.monotonic() - _loaded_at < CACHE_TTL:
+        return t
+    with _lock:
+        if _table is None or _time.monotonic() - _loaded_at >= CACHE_TTL:
+            fares = db.session.execute(db.select(Fare).order_by(Fare.id)).scalars().all()
+            _table = FareTable(fares)
+            _loaded_at = _time.monotonic()
+        return _table
+
+
+def invalidate():
+    global _table
+    _table = None
+
+
+# Fare đổi -> đánh dấu session, xóa cache sau commit (không nạp lại dữ liệu chưa commit)
+def _mark_dirty(mapper, connection, target):
+    sess = object_session(target)
+    if sess is not None:
+        sess.info["fares_dirty"] = True
+
+
+def _after_commit(session):
+    if session.info.pop("fares_dirty", False):
+        invalidate()
+
+
+for _evt in ("after_insert", "after_update", "after_delete"):
+    event.listen(Fare, _evt, _mark_dirty)
+event.listen(Session, "after_commit", _after_commit)
+
+
+def quote(route_code=None, origin=None, destination=None, km=None, at=None, airport=None):
+    """Báo giá 1 chuyến; None nếu không tìm thấy tuyến."""
+    table = get_table()
+    idx = table.lookup(route_code, origin, destination)
+    if idx < 0:
+        return None
+    at = at or datetime.now()
+    if airport is None:
+        airport = is_airport(origin, destination, *table.places[idx])
+    return {
+        "route_code": table.route_codes[idx],
+        "km": float(table.base_km[idx] if km is None else km),
+        "airport": bool(airport),
+        "night": is_night(at),
+        "price": round(table.price(idx, km, airport, is_night(at))),
+    }
+
+
+def reprice(trips):
+    """Tính lại giá cho danh sách Trip (đối soát); trả về mảng giá, NaN khi không khớp tuyến."""
+    import numpy as np
+
+    table = get_table()
+    n = len(trips)
+    if not n or not len(table):
+        return np.full(n, np.nan)
+    idx = np.fromiter((table.lookup(None, t.origin, t.destination) for t in trips), dtype=np.int64, count=n)
+    km = np.fromiter((t.distance_km or 0 for t in trips), dtype=np.float64, count=n)
+    # thiếu km thì tính theo base_km của tuyến
+    km = np.where(km > 0, km, table.base_km[np.maximum(idx, 0)])
+    airport = np.fromiter((is_airport(t.origin, t.destination) for t in trips), dtype=bool, count=n)
+    night = np.fromiter((is_night(t.started_at or t.ended_at or datetime.now()) for t in trips), dtype=bool, count=n)
+    return table.price_many(idx, km, airport, night)
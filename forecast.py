@@ -0,0 +1,112 @@
+# forecast.py - dự báo lần bảo dưỡng kế tiếp của từng xe theo tốc độ chạy gần đây (km/ngày)
+# Odo: CarLedger.odometer_km (cộng dồn khi hoàn tất chuyến, xem rollups.apply_trip), hiệu chỉnh lại bằng
+# số odo ghi ở lần bảo dưỡng gần nhất + km các chuyến từ ngày đó (rollup_car_daily) trong 1 câu UPDATE: giá trị tính
+# ngay trong DB nên không ghi đè phần cộng dồn của chuyến vừa hoàn tất song song.
+# Mốc kế tiếp: lịch Maintenance sắp tới gần nhất; chưa có lịch -> lần trước + MAINT_INTERVAL_KM / MAINT_INTERVAL_DAYS.
+# Ngày dự kiến = sớm hơn giữa ngày hẹn và ngày chạy tới mốc km với km/ngày của MAINT_RATE_WINDOW_DAYS ngày gần nhất.
+# refresh() chạy mỗi ngày 1 lần bằng cron `flask --app manage refresh-maintenance-forecast`; trang bảo dưỡng chỉ đọc.
+import math
+import os
+from datetime import date, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Car, Maintenance, CarDaily, CarLedger
+
+RATE_WINDOW_DAYS = int(os.getenv("MAINT_RATE_WINDOW_DAYS", "28"))
+SERVICE_INTERVAL_KM = float(os.getenv("MAINT_INTERVAL_KM", "5000"))
+SERVICE_INTERVAL_DAYS = int(os.getenv("MAINT_INTERVAL_DAYS", "180"))
+DUE_SOON_DAYS = int(os.getenv("MAINT_DUE_SOON_DAYS", "14"))
+DEFAULT_TASK = "Bảo dưỡng định kỳ"
+MAX_HORIZON_DAYS = 3650  # xe gần như không chạy: không dự báo xa hơn 10 năm
+LAST_ORDER = (Maintenance.scheduled_date.desc(), Maintenance.id.desc())  # lần bảo dưỡng gần nhất (cùng ngày: id lớn)
+
+
+def predict_date(odometer_km, km_per_day, next_km, next_date, today):
+    """Ngày đến hạn: sớm hơn giữa `next_date` và ngày odo chạm `next_km` với tốc độ hiện tại."""
+    by_km = None
+    if next_km is not None:
+        left = next_km - odometer_km
+        if left <= 0:
+            by_km = today
+        elif km_per_day > 0:
+            by_km = today + timedelta(days=min(MAX_HORIZON_DAYS, math.ceil(left / km_per_day)))
+    found = [d for d in (by_km, next_date) if d is not None]
+    return min(found) if found else None
+
+
+def _nearest(where, order):
+    # mỗi xe 1 dòng Maintenance (row_number trên từng car_id)
+    rn = db.func.row_number().over(partition_by=Maintenance.car_id, order_by=order).label("rn")
+    return db.select(Maintenance.car_id, Maintenance.scheduled_date, Maintenance.odometer_km, Maintenance.task,
+                     rn).where(where).subquery()
+
+
+def refresh(today=None):
+    """Tính lại odo/km mỗi ngày/mốc bảo dưỡng cho mọi xe vào CarLedger. Caller commit; trả về số xe."""
+    today = today or date.today()
+    missing = db.session.execute(
+        db.select(Car.id).outerjoin(CarLedger, CarLedger.car_id == Car.id).where(CarLedger.car_id.is_(None))
+    ).scalars().all()
+    if missing:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.insert(CarLedger), [{"car_id": c} for c in missing])
+        except IntegrityError:
+            pass  # xe vừa có chuyến hoàn tất song song -> dòng đã được tạo
+
+    # odo = odo lần bảo dưỡng gần nhất + km từ ngày đó; SET bằng subquery -> không đọc rồi ghi lại giá trị tuyệt đối
+    def last_service(col):
+        return (db.select(col).where(Maintenance.car_id == CarLedger.car_id, Maintenance.scheduled_date < today)
+                .order_by(*LAST_ORDER).limit(1).correlate(CarLedger).scalar_subquery())
+    last_km = last_service(Maintenance.odometer_km)
+    since = (db.select(db.func.coalesce(db.func.sum(CarDaily.km), 0))
+             .where(CarDaily.car_id == CarLedger.car_id, CarDaily.day >= last_service(Maintenance.scheduled_date))
+             .scalar_subquery())
+    db.session.execute(db.update(CarLedger.__table__).where(last_km.isnot(None)).values(odometer_km=last_km + since))
+
+    last_sq = _nearest(Maintenance.scheduled_date < today, LAST_ORDER)
+    next_sq = _nearest(Maintenance.scheduled_date >= today, Maintenance.scheduled_date.asc())
+    last = {r.car_id: r for r in db.session.execute(db.select(last_sq).where(last_sq.c.rn == 1))}
+    upcoming = {r.car_id: r for r in db.session.execute(db.select(next_sq).where(next_sq.c.rn == 1))}
+    recent = dict(db.session.execute(
+        db.select(CarDaily.car_id, db.func.sum(CarDaily.km))
+        .where(CarDaily.day >= today - timedelta(days=RATE_WINDOW_DAYS), CarDaily.day < today)
+        .group_by(CarDaily.car_id)
+    ).all())
+
+    rows = db.session.execute(db.select(CarLedger)).scalars().all()
+    for row in rows:
+        prev, up = last.get(row.car_id), upcoming.get(row.car_id)
+        odo = row.odometer_km or 0
+        row.km_per_day = round((recent.get(row.car_id) or 0) / RATE_WINDOW_DAYS, 2)
+        row.last_service_date = prev.scheduled_date if prev is not None else None
+        row.last_service_km = prev.odometer_km if prev is not None else None
+        if up is not None:
+            task, next_km, next_date = up.task, up.odometer_km, up.scheduled_date
+        elif prev is not None:
+            task = prev.task
+            next_km = prev.odometer_km + SERVICE_INTERVAL_KM if prev.odometer_km is not None else None
+            next_date = prev.scheduled_date + timedelta(days=SERVICE_INTERVAL_DAYS)
+        else:  # chưa bảo dưỡng lần nào: mốc chẵn kế tiếp theo chu kỳ km
+            task, next_km, next_date = None, (math.floor(odo / SERVICE_INTERVAL_KM) + 1) * SERVICE_INTERVAL_KM, None
+        row.next_service_task = task or DEFAULT_TASK
+        row.next_service_km = next_km
+        row.next_service_date = predict_date(odo, row.km_per_day, next_km, next_date, today)
+        row.forecast_on = today
+    return len(rows)
+
+
+def forecast_on():
+    """Ngày của lần refresh() gần nhất, None nếu chưa chạy."""
+    return db.session.execute(db.select(db.func.max(CarLedger.forecast_on))).scalar()
+
+
+def due_soon(today=None, days=DUE_SOON_DAYS):
+    """[(CarLedger, biển số)] đến hạn trong `days` ngày tới (kể cả quá hạn), sớm nhất lên đầu."""
+    today = today or date.today()
+    return db.session.execute(
+        db.select(CarLedger, Car.plate).join(Car, Car.id == CarLedger.car_id)
+        .where(CarLedger.next_service_date <= today + timedelta(days=days))
+        .order_by(CarLedger.next_service_date.asc(), CarLedger.car_id.asc())
+    ).all()
@@ -0,0 +1,183 @@
+# import_named_users.py - nhập danh sách sales / tài xế / xe từ "data/DS sale, drivers, cars.xlsx"
+# Chạy lại bao nhiêu lần cũng được (prestart mỗi lần deploy): đọc trước toàn bộ email/biển số trong 1 query,
+# so với file rồi insert/update theo lô. Không đổi mật khẩu của tài khoản đã có.
+#   python import_named_users.py "data/DS sale, drivers, cars.xlsx"
+import re
+import sys
+from collections import Counter
+
+from models import db, User, Car, Driver
+
+BATCH_SIZE = 500
+DEFAULT_PASSWORDS = {"sales": "Sale@123", "driver": "Driver@123"}
+DEFAULT_RATES = {"sales": 0.05, "driver": 0.40}
+
+
+def _num(v):
+    m = re.search(r"(\d+)", str(v or ""))
+    return int(m.group(1)) if m else None
+
+
+def _clean(v):
+    s = " ".join(str(v if v is not None else "").split())
+    return "" if s.lower() == "nan" else s
+
+
+def _find_sheet(names, *keys):
+    for n in names:
+        if any(k in n.lower() for k in keys):
+            return n
+    return None
+
+
+def _find_col(df, *keys, default=0):
+    for c in df.columns:
+        if any(k in str(c).lower() for k in keys):
+            return c
+    return df.columns[default]
+
+
+def read_sheet(path):
+    """Đọc file -> (staff, cars). staff: [{role, no, full_name}], cars: [{no, plate}]."""
+    import pandas as pd
+
+    xls = pd.ExcelFile(path)
+    staff, cars = [], []
+    for role, keys in (("sales", ("sale",)), ("driver", ("driver", "tài xế", "tai xe"))):
+        sheet = _find_sheet(xls.sheet_names, *keys)
+        if sheet is None:
+            continue
+        df = pd.read_excel(xls, sheet_name=sheet)
+        name_col = _find_col(df, "họ", "ho ten", "name", default=0)
+        pos_col = _find_col(df, "chức vụ", "position", "bộ phận", default=1)
+        for _, row in df.iterrows():
+            name, no = _clean(row.get(name_col)), _num(row.get(pos_col))
+            if name and no:
+                staff.append({"role": role, "no": no, "full_name": name})
+
+    sheet = _find_sheet(xls.sheet_names, "xe", "car")
+    if sheet is not None:
+        df = pd.read_excel(xls, sheet_name=sheet)
+        plate_col = _find_col(df, "biển", "bien", "plate", default=1)
+        label_col = _find_col(df, "cars", "tên xe", "stt", default=0)
+        for i, row in df.iterrows():
+            plate = _clean(row.get(plate_col)).upper()
+            if plate:
+                cars.append({"no": _num(row.get(label_col)) or i + 1, "plate": plate})
+    return staff, cars
+
+
+def staff_email(role, no, domain="sc.local"):
+    # cùng quy ước với seed_users.py / seed_drivers.py: sale01@, driver_01@
+    return f"sale{no:02d}@{domain}" if role == "sales" else f"driver_{no:02d}@{domain}"
+
+
+def _chunks(rows):
+    for i in range(0, len(rows), BATCH_SIZE):
+        yield rows[i:i + BATCH_SIZE]
+
+
+def _insert_returning(model, rows, *cols):
+    out = []
+    for chunk in _chunks(rows):
+        out.extend(db.session.execute(db.insert(model).returning(*cols), chunk).all())
+    return out
+
+
+def _bulk_update(model, rows):
+    for chunk in _chunks(rows):
+        db.session.execute(db.update(model), chunk)
+
+
+def import_fleet(path):
+    """Đồng bộ users/cars/drivers với file Excel. Caller commit."""
+    staff, cars = read_sheet(path)
+    stats = {k: Counter(created=0, updated=0, skipped=0) for k in ("users", "cars", "drivers")}
+
+    # ---- cars
+    plates = {c["plate"] for c in cars}
+    car_ids = dict(db.session.execute(db.select(Car.plate, Car.id).where(Car.plate.in_(plates))).all()) if plates else {}
+    new_cars = [{"plate": p} for p in sorted(plates) if p not in car_ids]
+    stats["cars"]["skipped"] = len(plates) - len(new_cars)
+    stats["cars"]["created"] = len(new_cars)
+    if new_cars:
+        car_ids.update({plate: cid for cid, plate in _insert_returning(Car, new_cars, Car.id, Car.plate)})
+    car_by_no = {c["no"]: car_ids.get(c["plate"]) for c in cars}
+
+    # ---- users
+    wanted = {staff_email(s["role"], s["no"]): s for s in staff}
+    existing = {
+        r.email: r for r in db.session.execute(
+            db.select(User.id, User.email, User.full_name, User.role).where(User.email.in_(wanted))
+        )
+    } if wanted else {}
+    hashes = {}  # mỗi role hash mật khẩu mặc định đúng 1 lần
+    new_users, upd_users = [], []
+    for email, s in wanted.items():
+        cur = existing.get(email)
+        if cur is None:
+            if s["role"] not in hashes:
+                tmp = User(); tmp.set_password(DEFAULT_PASSWORDS[s["role"]]); hashes[s["role"]] = tmp.password_hash
+            new_users.append({"email": email, "role": s["role"], "full_name": s["full_name"], "active": True,
+                              "commission_rate": DEFAULT_RATES[s["role"]], "password_hash": hashes[s["role"]]})
+        elif cur.full_name != s["full_name"] or cur.role != s["role"]:
+            upd_users.append({"id": cur.id, "full_name": s["full_name"], "role": s["role"]})
+        else:
+            stats["users"]["skipped"] += 1
+    stats["users"]["created"], stats["users"]["updated"] = len(new_users), len(upd_users)
+    user_ids = {email: r.id for email, r in existing.items()}
+    if new_users:
+        user_ids.update({email: uid for uid, email in _insert_returning(User, new_users, User.id, User.email)})
+    _bulk_update(User, upd_users)
+
+    # ---- driver profiles (Driver.car_id bắt buộc: cặp Driver N <-> Xe N)
+    drv_users = {user_ids.get(staff_email("driver", s["no"])): s for s in staff if s["role"] == "driver"}
+    drv_users.pop(None, None)
+    have = {
+        r.user_id: r for r in db.session.execute(
+            db.select(Driver.user_id, Driver.id, Driver.car_id).where(Driver.user_id.in_(drv_users))
+        )
+    } if drv_users else {}
+    new_drivers, upd_drivers = [], []
+    for uid, s in drv_users.items():
+        car_id, cur = car_by_no.get(s["no"]), have.get(uid)
+        if car_id is None or (cur is not None and cur.car_id == car_id):
+            stats["drivers"]["skipped"] += 1
+        elif cur is None:
+            new_drivers.append({"user_id": uid, "car_id": car_id, "license_no": f"D{car_id:04d}"})
+        else:  # "Xe N" đổi biển số -> Driver N chuyển sang xe mới
+            upd_drivers.append({"id": cur.id, "car_id": car_id})
+    stats["drivers"]["created"], stats["drivers"]["updated"] = len(new_drivers), len(upd_drivers)
+    for chunk in _chunks(new_drivers):
+        db.session.execute(db.insert(Driver), chunk)
+    _bulk_update(Driver, upd_drivers)
+    return {k: dict(v) for k, v in stats.items()}
+
+
+def format_stats(stats):
+    return "; ".join(f"{k}: " + ", ".join(f"{n}={v[n]}" for n in ("created", "updated", "skipped"))
+                     for k, v in stats.items())
+
+
+def run(path):
+    stats = import_fleet(path)
+    db.session.commit()
+    return stats
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print("usage: python import_named_users.py <file.xlsx>")
+        return 2
+    from factory import create_app
+
+    with create_app().app_context():
+        db.create_all()
+        stats = run(argv[0])
+    print(format_stats(stats))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
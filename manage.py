@@ -1,23 +1,20 @@
 import click, random
 from datetime import datetime, timedelta, date
-from flask import Flask
-import os, pandas as pd
+import os
 
 from models import db, User, Car, Driver, Trip, Fare, Payment, Cost, Settings, Maintenance
-
-def create_app():
-    app = Flask(__name__)
-    app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL", "sqlite:///sc.db")
-    app.config["SECRET_KEY"] = os.getenv("FLASK_SECRET_KEY", "dev-secret")
-    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    db.init_app(app)
-    return app
+import rollups
+import forecast
+import archive
+from bench import percentile
+from factory import create_app
 
 app = create_app()
 
 @app.cli.command("init-db")
 def init_db():
     with app.app_context():
+        archive.drop_all(db.engine)
         db.drop_all()
         db.create_all()
         admin = User(email="admin@sc.local", role="admin", full_name="SC Admin", commission_rate=0.00)
@@ -40,60 +37,23 @@ def seed_sales(n=20):
             sales_users.append(u)
     return sales_users
 
-def guess_plate_and_driver(df):
-    plate_col = None
-    for c in df.columns:
-        s = str(c).lower()
-        if any(k in s for k in ["biển", "plate", "license", "xe", "bienso"]):
-            plate_col = c; break
-    if plate_col is None:
-        plate_col = df.columns[0]
-    driver_col = None
-    for c in df.columns:
-        s = str(c).lower()
-        if any(k in s for k in ["tài xế","taixe","nhân viên","nhanvien","driver","họ tên","hoten"]):
-            driver_col = c; break
-    return plate_col, driver_col
-
 def seed_cars_drivers_from_excel(excel_path=None):
-    created = 0
     if excel_path and os.path.exists(excel_path):
-        xls = pd.ExcelFile(excel_path)
-        target_sheet = None
-        for name in xls.sheet_names:
-            if "CHI TIẾT" in name.upper() or "XE" in name.upper() or "CAR" in name.upper():
-                target_sheet = name; break
-        if target_sheet is None:
-            target_sheet = xls.sheet_names[0]
-        df = pd.read_excel(excel_path, sheet_name=target_sheet)
-        plate_col, driver_col = guess_plate_and_driver(df)
-        for _, row in df.iterrows():
-            plate = str(row.get(plate_col,"")).strip()
-            if not plate or plate.lower()=="nan":
-                continue
-            car = Car.query.filter_by(plate=plate).first()
-            if not car:
-                car = Car(plate=plate)
-                db.session.add(car); db.session.flush()
-                email = f"driver_{car.id}@sc.local"
-                name = str(row.get(driver_col,"")).strip() if driver_col else ""
-                user = User(email=email, role="driver", full_name=(name or f"Driver {car.id}"), commission_rate=0.40)
-                user.set_password("Driver@123")
-                db.session.add(user); db.session.flush()
-                driver = Driver(user_id=user.id, car_id=car.id, license_no=f"D{car.id:04d}")
-                db.session.add(driver)
-                created += 1
-    else:
-        for i in range(1, 11):
-            plate = f"SC-{i:02d}-{1000+i}"
-            car = Car(plate=plate); db.session.add(car); db.session.flush()
-            email = f"driver_{car.id}@sc.local"
-            user = User(email=email, role="driver", full_name=f"Driver {car.id}", commission_rate=0.40)
-            user.set_password("Driver@123")
-            db.session.add(user); db.session.flush()
-            driver = Driver(user_id=user.id, car_id=car.id, license_no=f"D{car.id:04d}")
-            db.session.add(driver)
-            created += 1
+        import import_named_users
+        stats = import_named_users.import_fleet(excel_path)
+        return stats["drivers"]["created"]
+    created = 0
+    pw = User(); pw.set_password("Driver@123")  # hash 1 lần, dùng chung cho tài khoản demo
+    for i in range(1, 11):
+        plate = f"SC-{i:02d}-{1000+i}"
+        car = Car(plate=plate); db.session.add(car); db.session.flush()
+        email = f"driver_{car.id}@sc.local"
+        user = User(email=email, role="driver", full_name=f"Driver {car.id}", commission_rate=0.40,
+                    password_hash=pw.password_hash)
+        db.session.add(user); db.session.flush()
+        driver = Driver(user_id=user.id, car_id=car.id, license_no=f"D{car.id:04d}")
+        db.session.add(driver)
+        created += 1
     return created
 
 def seed_fares():
@@ -131,6 +91,7 @@ def seed_demo_trips(days_back=3):
                          cash_collected=cash, status="completed")
                 db.session.add(t); db.session.flush()
                 db.session.add(Payment(trip_id=t.id, method=t.payment_method, amount=t.final_fare, received_at=ended))
+                rollups.apply_trip(t)
                 count += 1
     return count
 
@@ -143,7 +104,9 @@ def seed_maintenance():
     for i, c in enumerate(cars[:10], start=1):
         db.session.add(Maintenance(car_id=c.id, scheduled_date=date.today() + timedelta(days=7*i), odometer_km=50000+i*2500, task="Oil change", estimated_cost=800000, notes="Định kỳ 5k km"))
         db.session.add(Maintenance(car_id=c.id, scheduled_date=date.today() - timedelta(days=30*i), odometer_km=45000+i*2000, task="Brake inspection", estimated_cost=600000, actual_cost=620000, notes="Đã thực hiện"))
-        db.session.add(Cost(car_id=c.id, category="maintenance", amount=620000.0, notes="Brake inspection"))
+        cost = Cost(car_id=c.id, category="maintenance", amount=620000.0, notes="Brake inspection")
+        db.session.add(cost)
+        rollups.apply_cost(cost)
         cnt += 2
     return cnt
 
@@ -159,6 +122,380 @@ def seed_all(excel):
         db.session.commit()
         click.echo(f"Seeded: sales={len(added_sales)}; drivers_from_excel={created}; demo_trips={trips}; maintenance={maint}.")
 
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups_cmd():
+    with app.app_context():
+        db.create_all()
+        counts = rollups.rebuild_rollups()
+        forecast.refresh()
+        db.session.commit()
+        click.echo(f"Rebuilt rollups: sales_rows={counts['sales']}; driver_rows={counts['drivers']}; days={counts['days']}; "
+                   f"cars={counts['cars']}.")
+
+@app.cli.command("refresh-maintenance-forecast")
+def refresh_maintenance_forecast():
+    """Tính lại odo, km/ngày và ngày bảo dưỡng dự kiến của mọi xe (chạy hằng ngày qua cron)."""
+    with app.app_context():
+        n = forecast.refresh()
+        db.session.commit()
+        due = forecast.due_soon()
+        click.echo(f"Forecast refreshed for {n} car(s); {len(due)} due within {forecast.DUE_SOON_DAYS} days.")
+
+@app.cli.command("stress-claim")
+@click.option("--drivers", default=50, show_default=True, help="Số tài xế giả lập cùng bấm nhận 1 đơn")
+@click.option("--rounds", default=5, show_default=True)
+def stress_claim(drivers, rounds):
+    """Bắn N tài xế song song vào cùng 1 đơn; mỗi vòng phải có đúng 1 người thắng."""
+    import threading
+    import dispatch
+
+    with app.app_context():
+        driver_rows = db.session.execute(db.select(Driver)).scalars().all()
+        if not driver_rows:
+            raise click.ClickException("Chưa có Driver nào; chạy seed-all trước.")
+        pool = [(d.id, d.car_id) for d in driver_rows]
+
+    failures = 0
+    for r in range(1, rounds + 1):
+        with app.app_context():
+            trip = Trip(origin="STRESS", status="booked", fare_quote=0)
+            db.session.add(trip); db.session.commit()
+            trip_id = trip.id
+
+        barrier = threading.Barrier(drivers)
+        results, errors = [], []
+        lock = threading.Lock()
+
+        def worker(i):
+            drv_id, car_id = pool[i % len(pool)]
+            drv = Driver(id=drv_id, car_id=car_id)  # transient, chỉ dùng id/car_id
+            with app.app_context():
+                try:
+                    barrier.wait()
+                    res = dispatch.claim_trip(trip_id, drv)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    with lock: errors.append(repr(e))
+                    return
+            with lock: results.append(res)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(drivers)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+
+        winners = results.count(dispatch.CLAIMED)
+        ok = winners == 1
+        failures += 0 if ok else 1
+        click.echo(f"round {r}: trip #{trip_id} winners={winners} taken={results.count(dispatch.TAKEN)} errors={len(errors)} -> {'OK' if ok else 'FAIL'}")
+        for e in errors[:3]:
+            click.echo(f"    {e}")
+
+        with app.app_context():
+            db.session.execute(db.delete(Trip).where(Trip.id == trip_id)); db.session.commit()
+
+    if failures:
+        raise click.ClickException(f"{failures}/{rounds} round(s) did not have exactly one winner")
+    click.echo("All rounds: exactly one winner.")
+
+@app.cli.command("reprice-trips")
+@click.option("--days", default=30, show_default=True, help="Đối soát các chuyến hoàn tất trong N ngày gần nhất")
+@click.option("--tolerance", default=0.0, show_default=True, help="Chênh lệch (VND) bỏ qua")
+def reprice_trips(days, tolerance):
+    """Tính lại giá theo bảng Fare và liệt kê chuyến có final_fare lệch."""
+    import numpy as np
+    import fares
+
+    with app.app_context():
+        since = datetime.combine(date.today() - timedelta(days=days), datetime.min.time())
+        trips = db.session.execute(
+            db.select(Trip).where(Trip.status == "completed", Trip.ended_at >= since).order_by(Trip.id)
+        ).scalars().all()
+        prices = fares.reprice(trips)
+        actual = np.fromiter((t.final_fare or 0 for t in trips), dtype=np.float64, count=len(trips))
+        matched = ~np.isnan(prices)
+        diff = np.where(matched, actual - prices, 0.0)
+        off = np.flatnonzero(matched & (np.abs(diff) > tolerance))
+        for i in off[:50]:
+            t = trips[i]
+            click.echo(f"#{t.id:>6} {t.origin} -> {t.destination}: final={actual[i]:,.0f} engine={prices[i]:,.0f} diff={diff[i]:+,.0f}")
+        click.echo(f"Trips={len(trips)}; matched_route={int(matched.sum())}; mismatched={len(off)}; total_diff={diff[off].sum():+,.0f}")
+
+@app.cli.command("import-fleet")
+@click.argument("excel_path", default="data/DS sale, drivers, cars.xlsx")
+def import_fleet_cmd(excel_path):
+    import import_named_users
+    with app.app_context():
+        db.create_all()
+        stats = import_named_users.run(excel_path)
+        click.echo(import_named_users.format_stats(stats))
+
+@app.cli.command("bench-login")
+@click.option("--logins", default=200, show_default=True)
+@click.option("--concurrency", default=8, show_default=True, help="Số client đăng nhập song song (1 worker)")
+@click.option("--users", default=50, show_default=True)
+def bench_login(logins, concurrency, users):
+    """Đo độ trễ p50/p99 và số đăng nhập/giây của 1 worker qua Flask test client."""
+    import threading, time, json
+    from app import app as web_app
+    import passwords
+
+    password = "Bench@123"
+    emails = [f"bench_login_{i:03d}@bench.local" for i in range(users)]
+    with app.app_context():
+        db.session.execute(db.delete(User).where(User.email.in_(emails)))
+        pw = User(); pw.set_password(password)
+        db.session.execute(db.insert(User), [
+            {"email": e, "role": "sales", "full_name": e, "active": True, "password_hash": pw.password_hash}
+            for e in emails
+        ])
+        db.session.commit()
+
+    web_app.config["WTF_CSRF_ENABLED"] = False
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    counter = iter(range(logins))
+
+    def worker():
+        client = web_app.test_client()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            t0 = time.perf_counter()
+            r = client.post("/login", data={"email": emails[i % users], "password": password})
+            dt = time.perf_counter() - t0
+            client.get("/logout")
+            with lock:
+                latencies.append(dt)
+                statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - t0
+
+    with app.app_context():
+        db.session.execute(db.delete(User).where(User.email.in_(emails))); db.session.commit()
+
+    report = {
+        "logins": logins, "concurrency": concurrency,
+        "password_workers": passwords.WORKERS, "queue_limit": passwords.QUEUE_LIMIT,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "logins_per_sec": round(logins / wall, 1) if wall else 0.0,
+        "status": statuses, "password_stats": dict(passwords.stats),
+    }
+    click.echo(json.dumps(report, indent=2))
+
+@app.cli.command("gen-bench-data")
+@click.option("--drivers", default=200, show_default=True)
+@click.option("--sales", default=50, show_default=True)
+@click.option("--months", default=12, show_default=True)
+@click.option("--trips-per-day", default=2000, show_default=True, help="Số chuyến/ngày của cả đội xe (12 tháng x 2000 ≈ 730k chuyến + 730k thanh toán)")
+@click.option("--seed", default=42, show_default=True)
+@click.option("--reset/--no-reset", default=True, show_default=True, help="Xóa dữ liệu bench cũ trước khi sinh")
+def gen_bench_data(drivers, sales, months, trips_per_day, seed, reset):
+    """Sinh dữ liệu đội xe giả lập bằng bulk insert (dùng DB theo DATABASE_URL)."""
+    import json
+    import bench
+    with app.app_context():
+        db.create_all()
+        if reset:
+            bench.purge()
+            db.session.commit()
+        stats = bench.generate(drivers, sales, months, trips_per_day, seed, echo=click.echo)
+    click.echo(json.dumps(stats, indent=2))
+
+@app.cli.command("bench-purge")
+def bench_purge():
+    import bench
+    with app.app_context():
+        counts = bench.purge()
+        rollups.rebuild_rollups()
+        db.session.commit()
+        click.echo("Deleted: " + "; ".join(f"{k}={v}" for k, v in counts.items()))
+
+@app.cli.command("bench-routes")
+@click.option("--concurrency", default=8, show_default=True, help="Số client song song (mỗi client 1 tài xế riêng)")
+@click.option("--rounds", default=20, show_default=True, help="Số vòng mỗi client chạy hết danh sách route")
+@click.option("--seed", default=1, show_default=True)
+@click.option("--out", default=None, type=click.Path(dir_okay=False), help="Ghi báo cáo JSON ra file thay vì stdout")
+def bench_routes(concurrency, rounds, seed, out):
+    """Chạy mọi route của app.py qua Flask test client, báo cáo p50/p90/p99, throughput, số query/request."""
+    import json
+    import bench
+    from app import app as web_app
+    try:
+        report = bench.run_routes(web_app, concurrency, rounds, seed)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    text = json.dumps(report, indent=2, sort_keys=True, ensure_ascii=False)
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        s = report["summary"]
+        click.echo(f"{s['requests']} requests, {s['errors']} errors, {s['throughput_rps']} req/s -> {out}")
+    else:
+        click.echo(text)
+    if report["meta"]["uncovered_endpoints"]:
+        click.echo(f"Chưa có trong bench.ROUTES: {', '.join(report['meta']['uncovered_endpoints'])}", err=True)
+
+@app.cli.command("bench-compare")
+@click.argument("old_path", type=click.Path(exists=True, dir_okay=False))
+@click.argument("new_path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--metric", default="p50_ms", show_default=True, type=click.Choice(["mean_ms", "p50_ms", "p90_ms", "p99_ms"]))
+@click.option("--max-regression", default=None, type=float, help="%% chậm hơn tối đa cho phép; vượt -> exit code 1")
+def bench_compare(old_path, new_path, metric, max_regression):
+    import json
+    import bench
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    rows = bench.compare(old, new, metric)
+    for name, a, b, pct in rows:
+        click.echo(f"{name:32} {a:>10.2f} -> {b:>10.2f} ms  {pct:+7.1f}%")
+    so, sn = old["summary"], new["summary"]
+    click.echo(f"{'throughput_rps':32} {so['throughput_rps']:>10.1f} -> {sn['throughput_rps']:>10.1f}")
+    worse = [r for r in rows if max_regression is not None and r[3] > max_regression]
+    if worse:
+        raise click.ClickException(f"{len(worse)} route(s) chậm hơn {max_regression}%: {', '.join(r[0] for r in worse)}")
+
+@app.cli.command("bench-startup")
+@click.option("--repeats", default=5, show_default=True)
+@click.option("--out", default=None, type=click.Path(dir_okay=False))
+def bench_startup(repeats, out):
+    """Thời gian import factory/app, request đầu tiên và `flask --app manage --help` (process mới mỗi lần)."""
+    import json
+    import bench
+    text = json.dumps(bench.startup(repeats), indent=2, sort_keys=True)
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    click.echo(text)
+
+@app.cli.command("bench-async")
+@click.option("--levels", default="8,32,128", show_default=True, help="Các mức client đồng thời, cách nhau bởi dấu phẩy")
+@click.option("--duration", default=5.0, show_default=True, help="Số giây đo mỗi mức")
+@click.option("--workers", default=4, show_default=True, help="Số worker gunicorn của mỗi server (2 bên như nhau)")
+@click.option("--out", default=None, type=click.Path(dir_okay=False))
+def bench_async(levels, duration, workers, out):
+    """So sức chứa JSON dashboard qua Flask (gunicorn sync) với async_api (UvicornWorker) ở nhiều mức đồng thời."""
+    import json
+    import bench
+    from app import app as web_app
+    try:
+        report = bench.capacity(web_app, tuple(int(x) for x in levels.split(",") if x.strip()), duration, workers)
+    except (RuntimeError, ImportError) as e:
+        raise click.ClickException(str(e))
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    for n in report["sync"]:
+        s, a = report["sync"][n], report["async"][n]
+        click.echo(f"{n:>5} clients  sync {s['throughput_rps']:>8.1f} req/s p99 {s['p99_ms']:>8.1f} ms"
+                   f"  |  async {a['throughput_rps']:>8.1f} req/s p99 {a['p99_ms']:>8.1f} ms")
+
+@app.cli.command("analytics-snapshot")
+@click.option("--dir", "root", default=None, help="Thư mục snapshot (mặc định ANALYTICS_DIR hoặc ./analytics)")
+@click.option("--rebuild", is_flag=True, help="Xóa snapshot cũ rồi ghi lại từ đầu (khi dữ liệu ngày cũ bị sửa)")
+def analytics_snapshot(root, rebuild):
+    """Ghi các ngày đã đóng còn thiếu của trips/payments/costs ra Parquet theo tháng (chạy hằng đêm)."""
+    import analytics
+    root = root or analytics.SNAPSHOT_DIR
+    if rebuild:
+        analytics.reset(root)
+    with app.app_context():
+        written = analytics.snapshot(root, echo=click.echo)
+    click.echo("Snapshot: " + "; ".join(f"{k}=+{v}" for k, v in written.items()) + f" -> {root}")
+
+@app.cli.command("analytics-report")
+@click.argument("table", type=click.Choice(["trips", "payments", "costs"]))
+@click.option("--by", default="month", show_default=True, help="Chiều gộp, cách nhau bởi dấu phẩy (vd. driver,month)")
+@click.option("--from", "d_from", default=None, help="YYYY-MM-DD")
+@click.option("--to", "d_to", default=None, help="YYYY-MM-DD (gồm cả ngày này)")
+@click.option("--dir", "root", default=None)
+@click.option("--csv", "as_csv", is_flag=True, help="In CSV thay vì bảng")
+def analytics_report(table, by, d_from, d_to, root, as_csv):
+    """Báo cáo gộp từ snapshot Parquet (không truy vấn DB)."""
+    import analytics
+    try:
+        start = date.fromisoformat(d_from) if d_from else None
+        end = date.fromisoformat(d_to) + timedelta(days=1) if d_to else None
+        df = analytics.aggregate(table, [b.strip() for b in by.split(",") if b.strip()], start, end,
+                                 root or analytics.SNAPSHOT_DIR)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(df.to_csv(index=False) if as_csv else df.to_string(index=False))
+
+@app.cli.command("run-dispatcher")
+def run_dispatcher():
+    """Process điều phối tự động riêng (1 process cho cả hệ thống); nhận sự kiện qua EVENTS_REDIS_URL."""
+    import time
+    import dispatcher
+    if not os.getenv("EVENTS_REDIS_URL"):
+        raise click.ClickException("Cần EVENTS_REDIS_URL để nhận sự kiện đặt đơn từ các web worker.")
+    worker = dispatcher.start(app)
+    try:
+        while worker.is_alive():
+            time.sleep(60)
+            click.echo(" ".join(f"{k}={v}" for k, v in sorted(worker.dispatcher.snapshot().items())))
+    except KeyboardInterrupt:
+        worker.stop()
+
+@app.cli.command("dispatch-sim")
+@click.option("--date", "day", default=None, help="Phát lại đơn của ngày YYYY-MM-DD trong DB; bỏ trống -> đơn giả lập")
+@click.option("--bookings", default=2000, show_default=True, help="Số đơn giả lập (khi không có --date)")
+@click.option("--drivers", default=None, type=int, help="Số tài xế (mặc định: số tài xế trong DB, hoặc 50)")
+@click.option("--cars", default=None, type=int, help="Số xe (mặc định = số tài xế)")
+@click.option("--seed", default=1, show_default=True)
+def dispatch_sim(day, bookings, drivers, cars, seed):
+    """Mô phỏng điều phối tự động trên 1 ngày đơn: thời gian chờ gán, độ dài hàng đợi, độ đều, chi phí mỗi thao tác."""
+    import json
+    import dispatcher
+    if day:
+        with app.app_context():
+            rows = dispatcher.recorded_day(date.fromisoformat(day))
+            drivers = drivers or db.session.execute(db.select(db.func.count()).select_from(Driver)).scalar() or 50
+    else:
+        rows = dispatcher.synthetic_day(bookings, seed)
+    report = dispatcher.simulate(rows, drivers or 50, cars, seed)
+    click.echo(json.dumps(report, indent=2, sort_keys=True))
+
+@app.cli.command("archive-trips")
+@click.option("--older-than", "older_than", default=180, show_default=True, help="Số ngày: chuyến completed kết thúc trước mốc này")
+@click.option("--batch", default=archive.BATCH, show_default=True, help="Số chuyến mỗi transaction")
+@click.option("--pause", default=0.0, show_default=True, help="Số giây nghỉ giữa các lô")
+def archive_trips(older_than, batch, pause):
+    """Chuyển chuyến đã hoàn tất cũ + payments sang bảng lưu trữ theo tháng; báo cáo vẫn đọc được."""
+    # tháng hiện tại luôn ở bảng nóng (dashboard tài xế/sales liệt kê chuyến trong tháng)
+    cutoff = min(date.today() - timedelta(days=older_than), date.today().replace(day=1))
+    click.echo(f"Archiving completed trips ended before {cutoff} ...")
+    with app.app_context():
+        n_trips, n_pays = archive.archive(datetime.combine(cutoff, datetime.min.time()), batch, pause, click.echo)
+    click.echo(f"Archived {n_trips} trips, {n_pays} payments.")
+
+@app.cli.command("trip-events")
+@click.argument("trip_id", type=int, required=False)
+@click.option("--until", default=None, help="YYYY-MM-DD[THH:MM]: trạng thái tại mốc này (mặc định: hiện tại)")
+def trip_events(trip_id, until):
+    """Lịch sử thay đổi 1 chuyến + trạng thái dựng lại từ trip_events; bỏ TRIP_ID -> JSON lines mọi chuyến."""
+    import json
+    import triplog
+    at = datetime.fromisoformat(until) if until else None
+    with app.app_context():
+        if trip_id is None:
+            for tid, state in triplog.replay_all(at):
+                click.echo(json.dumps(state, default=str, ensure_ascii=False))
+            return
+        for ev in triplog.history(trip_id, at):
+            click.echo(f"{ev.at:%Y-%m-%d %H:%M:%S} {ev.kind:10} actor={ev.actor_id} {ev.data}")
+        click.echo(json.dumps(triplog.replay(trip_id, at), default=str, ensure_ascii=False, indent=2))
+
 # Utilities
 @app.cli.command("list-users")
 def list_users():
@@ -177,3 +514,87 @@ def set_password(email, newpass):
             print("User not found"); return
         u.set_password(newpass); db.session.commit()
         print(f"Password reset for {email}")
+
+# ==== INDEXES ====
+# các truy vấn nóng của app.py, dùng cho báo cáo query plan trước/sau khi tạo index
+HOT_QUERIES = [
+    ("sales_dashboard: trips by sales/day",
+     "SELECT id FROM trips WHERE sales_id = :uid AND ended_at >= :start AND ended_at < :end"),
+    ("driver_dashboard: trips by driver/day",
+     "SELECT id FROM trips WHERE driver_id = :uid AND ended_at >= :start AND ended_at < :end"),
+    ("driver_dashboard: open trips",
+     "SELECT id FROM trips WHERE driver_id IS NULL AND status IN ('booked', 'assigned') ORDER BY id"),
+    ("driver_dashboard: my assigned",
+     "SELECT id FROM trips WHERE status IN ('assigned', 'ongoing') AND driver_id = :uid"),
+    ("driver profile lookup",
+     "SELECT id FROM drivers WHERE user_id = :uid"),
+    ("sales_commission: trips ended in day",
+     "SELECT sales_id FROM trips WHERE ended_at >= :start AND ended_at < :end"),
+    ("driver_ops: trips started in day",
+     "SELECT driver_id FROM trips WHERE started_at >= :start AND started_at < :end"),
+    ("cashbook: payments in day",
+     "SELECT id FROM payments WHERE received_at >= :start AND received_at < :end"),
+    ("cashbook: costs in day",
+     "SELECT id FROM costs WHERE occurred_at >= :start AND occurred_at < :end"),
+    ("maintenance: cars due soon",
+     "SELECT car_id FROM rollup_car_ledger WHERE next_service_date <= :today ORDER BY next_service_date"),
+    ("maintenance forecast: km per car since date",
+     "SELECT car_id, SUM(km) FROM rollup_car_daily WHERE car_id = :uid AND day >= :today GROUP BY car_id"),
+]
+
+def explain_hot_queries():
+    dialect = db.engine.dialect.name
+    prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+    start = datetime.combine(date.today(), datetime.min.time())
+    params = {"uid": 1, "start": start, "end": start + timedelta(days=1), "today": date.today()}
+    report = []
+    insp = db.inspect(db.session.connection())
+    for name, sql in HOT_QUERIES:
+        table = sql.split(" FROM ", 1)[1].split()[0]
+        if not insp.has_table(table):  # DB cũ chưa có bảng rollup mới: chạy prestart / create_all trước
+            report.append((name, [f"(skipped: no table {table})"]))
+            continue
+        rows = db.session.execute(db.text(prefix + sql), params).all()
+        # sqlite: (id, parent, notused, detail); postgres: (QUERY PLAN,)
+        report.append((name, [str(r[-1]) for r in rows]))
+    db.session.rollback()
+    return report
+
+def print_plan_report(title, report):
+    click.echo(f"== {title} ==")
+    for name, lines in report:
+        click.echo(f"- {name}")
+        for line in lines:
+            click.echo(f"    {line}")
+
+def ensure_indexes():
+    """Tạo các index khai báo trong models còn thiếu (CREATE INDEX IF NOT EXISTS), không đụng dữ liệu.
+
+    Trả về (index đã tạo, bảng chưa có trong DB -> bỏ qua, cần prestart / create_all).
+    """
+    created, missing = [], []
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not db.inspect(conn).has_table(table.name):
+                missing.append(table.name)
+                continue
+            existing = {ix["name"] for ix in db.inspect(conn).get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda ix: ix.name):
+                if index.name in existing:
+                    continue
+                index.create(bind=conn, checkfirst=True)
+                created.append(index.name)
+    return created, missing
+
+@app.cli.command("ensure-indexes")
+@click.option("--explain/--no-explain", default=False, help="In query plan của các truy vấn nóng trước và sau")
+def ensure_indexes_cmd(explain):
+    with app.app_context():
+        if explain:
+            print_plan_report("BEFORE", explain_hot_queries())
+        created, missing = ensure_indexes()
+        click.echo(f"Created {len(created)} index(es): {', '.join(created) or '-'}")
+        if missing:
+            click.echo(f"Skipped missing table(s) (run prestart.py or create_all first): {', '.join(missing)}")
+        if explain:
+            print_plan_report("AFTER", explain_hot_queries())
@@ -0,0 +1,220 @@
+# metrics.py - đo theo route: độ trễ (histogram), số query SQL, thời gian SQL, số dòng; xuất dạng Prometheus
+# WSGI middleware mở "phiên đo" cho mỗi request; listener before/after_cursor_execute cộng dồn vào phiên đó.
+# Mỗi worker gunicorn có số liệu riêng (scrape từng worker hoặc cộng ở phía Prometheus).
+# SLOW_REQUEST_MS=<ms>: ghi log request chậm kèm các câu SQL đã chạy.
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+SLOW_MS = float(os.getenv("SLOW_REQUEST_MS")) if os.getenv("SLOW_REQUEST_MS") else None
+SLOW_LOG_MAX_STATEMENTS = 50
+
+slow_log = logging.getLogger("sc.slow")
+_local = threading.local()
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v):
+        for i, b in enumerate(self.buckets):
+            if v <= b:
+                self.counts[i] += 1
+        self.sum += v
+        self.count += 1
+
+
+class _RequestStats:
+    __slots__ = ("queries", "sql_time", "rows", "statements")
+
+    def __init__(self, capture):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.rows = 0
+        self.statements = [] if capture else None
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}        # endpoint -> _Histogram (giây)
+        self.queries_hist = {}   # endpoint -> _Histogram (query/request)
+        self.requests = {}       # (endpoint, status) -> n
+        self.sql_queries = {}    # endpoint -> n
+        self.sql_seconds = {}    # endpoint -> giây
+        self.sql_rows = {}       # endpoint -> dòng (theo cursor.rowcount nếu driver báo)
+        self.histograms = {}     # name -> (help, _Histogram), không theo endpoint (vd. chờ pool)
+        self.collectors = []     # hàm trả về [(name, type, help, [(labels, value)])]
+
+    def record(self, endpoint, status, seconds, req: _RequestStats):
+        with self._lock:
+            self.latency.setdefault(endpoint, _Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.queries_hist.setdefault(endpoint, _Histogram(QUERY_BUCKETS)).observe(req.queries)
+            self.requests[(endpoint, status)] = self.requests.get((endpoint, status), 0) + 1
+            self.sql_queries[endpoint] = self.sql_queries.get(endpoint, 0) + req.queries
+            self.sql_seconds[endpoint] = self.sql_seconds.get(endpoint, 0.0) + req.sql_time
+            self.sql_rows[endpoint] = self.sql_rows.get(endpoint, 0) + req.rows
+
+    def observe(self, name, value, help_="", buckets=LATENCY_BUCKETS):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = (help_, _Histogram(buckets))
+            self.histograms[name][1].observe(value)
+
+    def add_collector(self, fn):
+        self.collectors.append(fn)
+
+    def render(self):
+        """Text exposition format của Prometheus."""
+        out = []
+
+        def head(name, kind, help_):
+            out.append(f"# HELP {name} {help_}")
+            out.append(f"# TYPE {name} {kind}")
+
+        def hist(name, help_, data):
+            head(name, "histogram", help_)
+            for ep, h in sorted(data.items()):
+                for b, c in zip(h.buckets, h.counts):
+                    out.append(f'{name}_bucket{{endpoint="{ep}",le="{b}"}} {c}')
+                out.append(f'{name}_bucket{{endpoint="{ep}",le="+Inf"}} {h.count}')
+                out.append(f'{name}_sum{{endpoint="{ep}"}} {h.sum:.6f}')
+                out.append(f'{name}_count{{endpoint="{ep}"}} {h.count}')
+
+        def counter(name, help_, data):
+            head(name, "counter", help_)
+            for ep, v in sorted(data.items()):
+                out.append(f'{name}{{endpoint="{ep}"}} {v:.6f}' if isinstance(v, float) else f'{name}{{endpoint="{ep}"}} {v}')
+
+        with self._lock:
+            hist("sc_http_request_duration_seconds", "Request latency by endpoint.", self.latency)
+            hist("sc_sql_queries_per_request", "SQL statements issued per request.", self.queries_hist)
+            head("sc_http_requests_total", "counter", "Requests by endpoint and status.")
+            for (ep, st), v in sorted(self.requests.items()):
+                out.append(f'sc_http_requests_total{{endpoint="{ep}",status="{st}"}} {v}')
+            counter("sc_sql_queries_total", "SQL statements by endpoint.", self.sql_queries)
+            counter("sc_sql_duration_seconds_total", "Time spent in SQL by endpoint.", self.sql_seconds)
+            counter("sc_sql_rows_total", "Rows reported by the DB driver by endpoint.", self.sql_rows)
+            for name, (help_, h) in sorted(self.histograms.items()):
+                head(name, "histogram", help_)
+                for b, c in zip(h.buckets, h.counts):
+                    out.append(f'{name}_bucket{{le="{b}"}} {c}')
+                out.append(f'{name}_bucket{{le="+Inf"}} {h.count}')
+                out.append(f"{name}_sum {h.sum:.6f}")
+                out.append(f"{name}_count {h.count}")
+        for fn in self.collectors:
+            for name, kind, help_, samples in fn():
+                head(name, kind, help_)
+                for labels, v in samples:
+                    lbl = ",".join(f'{k}="{val}"' for k, val in labels.items())
+                    out.append(f"{name}{{{lbl}}} {v}" if lbl else f"{name} {v}")
+        return "\n".join(out) + "\n"
+
+
+registry = Registry()
+
+
+# ==== SQL LISTENER ====
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, "req", None) is not None:
+        conn.info.setdefault("sc_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    req = getattr(_local, "req", None)
+    starts = conn.info.get("sc_query_start")
+    if req is None or not starts:
+        return
+    dt = time.perf_counter() - starts.pop()
+    req.queries += 1
+    req.sql_time += dt
+    rc = getattr(cursor, "rowcount", -1)
+    if rc and rc > 0:
+        req.rows += rc
+    if req.statements is not None and len(req.statements) < SLOW_LOG_MAX_STATEMENTS:
+        req.statements.append((dt, statement))
+
+
+# ==== WSGI MIDDLEWARE ====
+class _ClosingIterator:
+    # đo đến khi response (kể cả stream) được đóng
+    def __init__(self, iterable, on_close):
+        self._it = iterable
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._it)
+
+    def close(self):
+        try:
+            if hasattr(self._it, "close"):
+                self._it.close()
+        finally:
+            self._on_close()
+
+
+class ProfilingMiddleware:
+    """Bọc app.wsgi_app. Tên endpoint lấy từ environ["sc.endpoint"] (gán trong before_request)."""
+
+    def __init__(self, wsgi_app, registry=registry, slow_ms=SLOW_MS):
+        self.wsgi_app = wsgi_app
+        self.registry = registry
+        self.slow_ms = slow_ms
+
+    def __call__(self, environ, start_response):
+        req = _RequestStats(capture=self.slow_ms is not None)
+        _local.req = req
+        t0 = time.perf_counter()
+        status = ["500"]
+
+        def _start_response(st, headers, exc_info=None):
+            status[0] = st.split(" ", 1)[0]
+            return start_response(st, headers, exc_info)
+
+        done = []
+
+        def finish():
+            if done:
+                return
+            done.append(True)
+            _local.req = None
+            dt = time.perf_counter() - t0
+            endpoint = environ.get("sc.endpoint") or "unmatched"
+            self.registry.record(endpoint, status[0], dt, req)
+            if self.slow_ms is not None and dt * 1000 >= self.slow_ms:
+                lines = [f"{ms * 1000:8.1f} ms  {' '.join(sql.split())[:500]}" for ms, sql in req.statements]
+                slow_log.warning(
+                    "slow request %s %s endpoint=%s status=%s %.1f ms, %d queries, %.1f ms SQL\n%s",
+                    environ.get("REQUEST_METHOD"), environ.get("PATH_INFO"), endpoint, status[0],
+                    dt * 1000, req.queries, req.sql_time * 1000, "\n".join(lines),
+                )
+
+        try:
+            result = self.wsgi_app(environ, _start_response)
+        except Exception:
+            finish()
+            raise
+        return _ClosingIterator(result, finish)
+
+
+def init_app(app):
+    app.wsgi_app = ProfilingMiddleware(app.wsgi_app)
+
+    @app.before_request
+    def _tag_endpoint():
+        from flask import request
+        request.environ["sc.endpoint"] = request.endpoint or "unmatched"
@@ -1,10 +1,26 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from passlib.hash import bcrypt
+from passlib.context import CryptContext
 from datetime import datetime, date
+import os
 
 db = SQLAlchemy()
 
+# mật khẩu: bcrypt với cost PASSWORD_BCRYPT_ROUNDS, hoặc argon2 (cần argon2-cffi) khi PASSWORD_SCHEME=argon2.
+# Hash cũ/khác cost được hash lại khi đăng nhập (verify_and_update).
+BCRYPT_ROUNDS = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"] if os.getenv("PASSWORD_SCHEME") == "argon2" else ["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+# trạng thái đơn còn chờ tài xế nhận
+OPEN_TRIP_STATUSES = ("booked", "assigned")
+OPEN_TRIP_WHERE = "driver_id IS NULL AND status IN ('booked', 'assigned')"
+
 class Settings(db.Model):
     __tablename__ = "settings"
     key = db.Column(db.String(64), primary_key=True)
@@ -22,11 +38,11 @@ class User(UserMixin, db.Model):
     active = db.Column(db.Boolean, default=True)
 
     def set_password(self, password: str):
-        self.password_hash = bcrypt.hash(password)
+        self.password_hash = pwd_context.hash(password)
 
     def check_password(self, password: str) -> bool:
         try:
-            return bcrypt.verify(password, self.password_hash)
+            return pwd_context.verify(password, self.password_hash)
         except Exception:
             return False
 
@@ -45,6 +61,10 @@ class Driver(db.Model):
     car_id = db.Column(db.Integer, db.ForeignKey("cars.id"), nullable=False)
     license_no = db.Column(db.String(64))
 
+    __table_args__ = (
+        db.Index("ix_drivers_user_id", "user_id"),
+    )
+
 class Fare(db.Model):
     __tablename__ = "fares"
     id = db.Column(db.Integer, primary_key=True)
@@ -75,6 +95,19 @@ class Trip(db.Model):
     cash_collected = db.Column(db.Float, default=0)
     status = db.Column(db.String(16), default="planned")
 
+    # index cho các bộ lọc nóng của dashboard/báo cáo (xem `flask ensure-indexes`)
+    __table_args__ = (
+        db.Index("ix_trips_sales_ended", "sales_id", "ended_at"),
+        db.Index("ix_trips_driver_ended", "driver_id", "ended_at"),
+        db.Index("ix_trips_ended_at", "ended_at"),
+        db.Index("ix_trips_started_at", "started_at"),
+        db.Index("ix_trips_status_driver", "status", "driver_id"),
+        # hàng đợi đơn chưa có tài xế: partial index chỉ chứa vài dòng đang chờ
+        db.Index("ix_trips_open", "id",
+                 postgresql_where=db.text(OPEN_TRIP_WHERE),
+                 sqlite_where=db.text(OPEN_TRIP_WHERE)),
+    )
+
 class Payment(db.Model):
     __tablename__ = "payments"
     id = db.Column(db.Integer, primary_key=True)
@@ -84,6 +117,11 @@ class Payment(db.Model):
     received_at = db.Column(db.DateTime, default=datetime.utcnow)
     reference_code = db.Column(db.String(64))
 
+    __table_args__ = (
+        db.Index("ix_payments_received_at", "received_at"),
+        db.Index("ix_payments_trip_id", "trip_id"),
+    )
+
 class Cost(db.Model):
     __tablename__ = "costs"
     id = db.Column(db.Integer, primary_key=True)
@@ -94,6 +132,11 @@ class Cost(db.Model):
     amount = db.Column(db.Float, default=0)
     notes = db.Column(db.String(255))
 
+    __table_args__ = (
+        db.Index("ix_costs_occurred_at", "occurred_at"),
+        db.Index("ix_costs_category_occurred", "category", "occurred_at"),
+    )
+
 class Maintenance(db.Model):
     __tablename__ = "maintenance"
     id = db.Column(db.Integer, primary_key=True)
@@ -104,3 +147,114 @@ class Maintenance(db.Model):
     estimated_cost = db.Column(db.Float, default=0)
     actual_cost = db.Column(db.Float, default=0)
     notes = db.Column(db.String(255))
+
+    __table_args__ = (
+        db.Index("ix_maintenance_scheduled_date", "scheduled_date"),
+    )
+
+# sự kiện tài xế gửi lên khi mất sóng (POST /driver/sync): id do app trên điện thoại sinh ra,
+# lưu lại kết quả để gửi lại cùng id không áp dụng 2 lần
+class SyncEvent(db.Model):
+    __tablename__ = "sync_events"
+    driver_id = db.Column(db.Integer, db.ForeignKey("drivers.id"), primary_key=True)
+    event_id = db.Column(db.String(64), primary_key=True)
+    kind = db.Column(db.String(16), nullable=False)
+    trip_id = db.Column(db.Integer)
+    status = db.Column(db.String(16), nullable=False)
+    error = db.Column(db.String(255))
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# ==== ROLLUPS ====
+# số liệu tổng hợp theo ngày, cập nhật cùng transaction khi hoàn tất chuyến / ghi chi phí (xem rollups.py)
+# khóa 0 = không có sales/tài xế/xe
+class SalesDaily(db.Model):
+    __tablename__ = "rollup_sales_daily"
+    day = db.Column(db.Date, primary_key=True)
+    sales_id = db.Column(db.Integer, primary_key=True)
+    trips = db.Column(db.Integer, default=0, nullable=False)
+    revenue = db.Column(db.Float, default=0, nullable=False)
+    commission = db.Column(db.Float, default=0, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_rollup_sales_daily_sales_day", "sales_id", "day"),
+    )
+
+class DriverDaily(db.Model):
+    __tablename__ = "rollup_driver_daily"
+    day = db.Column(db.Date, primary_key=True)
+    driver_id = db.Column(db.Integer, primary_key=True)
+    car_id = db.Column(db.Integer, primary_key=True)
+    trips = db.Column(db.Integer, default=0, nullable=False)
+    revenue = db.Column(db.Float, default=0, nullable=False)
+    cash = db.Column(db.Float, default=0, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_rollup_driver_daily_driver_day", "driver_id", "day"),
+    )
+
+class DaySummary(db.Model):
+    __tablename__ = "rollup_day_summary"
+    day = db.Column(db.Date, primary_key=True)
+    trips = db.Column(db.Integer, default=0, nullable=False)
+    revenue = db.Column(db.Float, default=0, nullable=False)
+    cash = db.Column(db.Float, default=0, nullable=False)
+    costs = db.Column(db.Float, default=0, nullable=False)
+
+class CarDaily(db.Model):
+    __tablename__ = "rollup_car_daily"
+    day = db.Column(db.Date, primary_key=True)
+    car_id = db.Column(db.Integer, primary_key=True)
+    trips = db.Column(db.Integer, default=0, nullable=False)
+    km = db.Column(db.Float, default=0, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_rollup_car_daily_car_day", "car_id", "day"),
+    )
+
+# sổ theo xe (1 dòng/xe): odo + chi phí cộng dồn khi hoàn tất chuyến / ghi chi phí,
+# các cột next_service_* do forecast.refresh() ghi (trang bảo dưỡng chỉ đọc bảng này)
+class CarLedger(db.Model):
+    __tablename__ = "rollup_car_ledger"
+    car_id = db.Column(db.Integer, db.ForeignKey("cars.id"), primary_key=True)
+    odometer_km = db.Column(db.Float, default=0, nullable=False)
+    trips = db.Column(db.Integer, default=0, nullable=False)
+    costs = db.Column(db.Float, default=0, nullable=False)
+    maintenance_costs = db.Column(db.Float, default=0, nullable=False)
+    km_per_day = db.Column(db.Float, default=0, nullable=False)
+    last_service_date = db.Column(db.Date)
+    last_service_km = db.Column(db.Float)
+    next_service_task = db.Column(db.String(128))
+    next_service_km = db.Column(db.Float)
+    next_service_date = db.Column(db.Date)
+    forecast_on = db.Column(db.Date)
+
+    __table_args__ = (
+        db.Index("ix_rollup_car_ledger_next_service_date", "next_service_date"),
+    )
+
+# ==== ARCHIVE ====
+# các bảng lưu trữ theo tháng đã tạo (trips_archive_YYYY_MM, payments_archive_YYYY_MM; xem archive.py)
+class ArchiveMonth(db.Model):
+    __tablename__ = "archive_months"
+    kind = db.Column(db.String(16), primary_key=True)
+    month = db.Column(db.String(7), primary_key=True)
+    rows = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# ==== NHẬT KÝ CHUYẾN ====
+# chỉ ghi thêm, không sửa/xóa: mỗi dòng là 1 thay đổi của Trip (các cột mới, JSON), ghi theo lô bởi triplog.py
+# không khóa ngoại tới trips: chuyến cũ được chuyển sang bảng lưu trữ (archive.py) nhưng nhật ký giữ nguyên
+class TripEvent(db.Model):
+    __tablename__ = "trip_events"
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.String(32), nullable=False, unique=True)
+    trip_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(16), nullable=False)
+    actor_id = db.Column(db.Integer)
+    at = db.Column(db.DateTime, nullable=False)
+    data = db.Column(db.Text, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_trip_events_trip_at", "trip_id", "at"),
+        db.Index("ix_trip_events_at", "at"),
+    )
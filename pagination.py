@@ -0,0 +1,99 @@
+# pagination.py - phân trang keyset (cursor) cho danh sách chuyến trên dashboard
+# Không OFFSET: trang sau bắt đầu ngay sau khóa (id) hoặc (ended_at, id) cuối của trang trước -> dùng được index.
+from datetime import datetime
+
+from models import db, Trip, OPEN_TRIP_STATUSES
+import dispatch
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(trip, order):
+    if order == "ended_desc":
+        return f"{trip.ended_at.isoformat()}~{trip.id}"
+    return str(trip.id)
+
+
+def _after(stmt, order, cursor):
+    if not cursor:
+        return stmt
+    if order == "ended_desc":
+        ended, _, tid = cursor.rpartition("~")
+        return stmt.where(db.tuple_(Trip.ended_at, Trip.id) < (datetime.fromisoformat(ended), int(tid)))
+    if order == "id_desc":
+        return stmt.where(Trip.id < int(cursor))
+    return stmt.where(Trip.id > int(cursor))
+
+
+ORDER_BY = {
+    "id_asc": (Trip.id.asc(),),
+    "id_desc": (Trip.id.desc(),),
+    "ended_desc": (Trip.ended_at.desc(), Trip.id.desc()),
+}
+
+
+def page_query(stmt, order, cursor=None, limit=PAGE_SIZE):
+    """(stmt lấy limit+1 dòng sau cursor, limit đã chặn). Cursor sai định dạng -> ValueError."""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    return _after(stmt, order, cursor).order_by(None).order_by(*ORDER_BY[order]).limit(limit + 1), limit
+
+
+def split_page(rows, order, limit):
+    """(trips, next_cursor) từ kết quả của page_query; next_cursor=None khi đã hết."""
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, (encode_cursor(rows[-1], order) if more and rows else None)
+
+
+def keyset_page(stmt, order, cursor=None, limit=PAGE_SIZE):
+    """(trips, next_cursor); next_cursor=None khi đã hết. Cursor sai định dạng -> ValueError."""
+    stmt, limit = page_query(stmt, order, cursor, limit)
+    return split_page(db.session.execute(stmt).scalars().all(), order, limit)
+
+
+# ==== DANH SÁCH TRÊN DASHBOARD ====
+# tên -> (role được xem, hàm dựng (owner_id, mon_start, mon_end) -> (stmt, order))
+def _driver_open(driver_id, mon_start, mon_end):
+    return dispatch.open_trips_query(), "id_asc"
+
+
+def _driver_month(driver_id, mon_start, mon_end):
+    return db.select(Trip).where(
+        Trip.driver_id == driver_id, Trip.ended_at >= mon_start, Trip.ended_at < mon_end
+    ), "ended_desc"
+
+
+def _sales_pending(sales_id, mon_start, mon_end):
+    return db.select(Trip).where(
+        Trip.sales_id == sales_id, Trip.status.in_(OPEN_TRIP_STATUSES), Trip.driver_id.is_(None)
+    ), "id_desc"
+
+
+def _sales_month(sales_id, mon_start, mon_end):
+    return db.select(Trip).where(
+        Trip.sales_id == sales_id, Trip.ended_at >= mon_start, Trip.ended_at < mon_end
+    ), "ended_desc"
+
+
+LISTS = {
+    "driver-open": ("driver", _driver_open),
+    "driver-month": ("driver", _driver_month),
+    "sales-pending": ("sales", _sales_pending),
+    "sales-month": ("sales", _sales_month),
+}
+
+
+def list_page(name, owner_id, mon_start, mon_end, cursor=None, limit=PAGE_SIZE):
+    stmt, order = LISTS[name][1](owner_id, mon_start, mon_end)
+    return keyset_page(stmt, order, cursor, limit)
+
+
+def trip_json(t):
+    return {
+        "id": t.id, "status": t.status, "origin": t.origin, "destination": t.destination,
+        "fare_quote": t.fare_quote or 0, "final_fare": t.final_fare or 0, "cash_collected": t.cash_collected or 0,
+        "payment_method": t.payment_method,
+        "started_at": t.started_at.isoformat(sep=" ", timespec="seconds") if t.started_at else None,
+        "ended_at": t.ended_at.isoformat(sep=" ", timespec="seconds") if t.ended_at else None,
+    }
@@ -0,0 +1,61 @@
+# passwords.py - kiểm tra mật khẩu trong thread pool có giới hạn hàng đợi
+# bcrypt nhả GIL nên worker gthread xử lý nhiều đăng nhập song song; hàng đợi đầy -> Busy (backpressure)
+# thay vì dồn request đến khi worker timeout.
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from models import pwd_context
+
+WORKERS = int(os.getenv("PASSWORD_WORKERS", "4"))
+QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", "32"))
+TIMEOUT = float(os.getenv("PASSWORD_TIMEOUT", "10"))
+
+
+class Busy(Exception):
+    """Quá nhiều lượt kiểm tra mật khẩu đang chờ; client nên thử lại sau."""
+
+
+_pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="pwd")
+_slots = threading.BoundedSemaphore(WORKERS + QUEUE_LIMIT)
+stats = {"verified": 0, "rehashed": 0, "rejected_busy": 0, "timeouts": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key):
+    with _stats_lock:
+        stats[key] += 1
+
+
+def _verify(password, hash_):
+    try:
+        return pwd_context.verify_and_update(password, hash_)
+    except Exception:
+        return False, None
+
+
+def check(user, password: str) -> bool:
+    """Kiểm tra mật khẩu của `user`; nếu hash cần nâng cấp thì gán hash mới (caller commit).
+
+    Raise Busy khi pool + hàng đợi đã đầy hoặc quá PASSWORD_TIMEOUT.
+    """
+    if not _slots.acquire(blocking=False):
+        _count("rejected_busy")
+        raise Busy()
+    try:
+        fut = _pool.submit(_verify, password, user.password_hash)
+    except Exception:
+        _slots.release()
+        raise
+    # trả slot khi bcrypt thật sự chạy xong, kể cả khi request đã timeout
+    fut.add_done_callback(lambda _f: _slots.release())
+    try:
+        ok, new_hash = fut.result(timeout=TIMEOUT)
+    except FutureTimeout:
+        _count("timeouts")
+        raise Busy()
+    _count("verified")
+    if ok and new_hash:
+        user.password_hash = new_hash
+        _count("rehashed")
+    return ok
@@ -1,6 +1,9 @@
 # prestart.py
 import os
-from app import app, db
+from factory import create_app
+from models import db
+
+app = create_app()
 
 IMPORT_EXCEL = os.getenv("IMPORT_EXCEL_PATH")  # ví dụ: data/DS sale, drivers, cars.xlsx
 
@@ -23,10 +26,10 @@ def maybe_import_excel():
         return
     try:
         import import_named_users
-        import sys
-        sys.argv = ["import_named_users.py", IMPORT_EXCEL]
-        import_named_users.main()
+        stats = import_named_users.run(IMPORT_EXCEL)
+        print("Excel import:", import_named_users.format_stats(stats))
     except Exception as e:
+        db.session.rollback()
         print("Excel import failed:", e)
 
 with app.app_context():
@@ -0,0 +1,137 @@
+# principals.py - cache User + hồ sơ Driver/Car cho user_loader (LRU + TTL)
+# Bản sao detached được giữ trong cache; mỗi request merge(load=False) vào session -> không tốn query,
+# và db.session.get(User/Driver/Car) trong cùng request lấy từ identity map.
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+
+from models import db, User, Driver, Car
+
+MAX_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "1024"))
+# các worker khác không thấy invalidate của nhau: TTL giới hạn độ trễ
+TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+
+_MISSING = object()
+
+
+class PrincipalCache:
+    def __init__(self, max_size=MAX_SIZE, ttl=TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(user_id)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    del self._data[user_id]
+                self.misses += 1
+                return _MISSING
+            self._data.move_to_end(user_id)
+            self.hits += 1
+            return item[1]
+
+    def put(self, user_id, value):
+        with self._lock:
+            self._data[user_id] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            self.invalidations += 1
+            if user_id is None:
+                self._data.clear()
+            else:
+                self._data.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data), "max_size": self.max_size, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions, "invalidations": self.invalidations,
+            }
+
+
+cache = PrincipalCache()
+
+
+def _detached_copy(obj):
+    if obj is None:
+        return None
+    cls = type(obj)
+    clone = cls(**{c.key: getattr(obj, c.key) for c in cls.__mapper__.column_attrs})
+    make_transient_to_detached(clone)
+    return clone
+
+
+def _attach(obj):
+    return None if obj is None else db.session.merge(obj, load=False)
+
+
+def load_user(user_id: int):
+    """Dùng cho login_manager.user_loader; đồng thời nạp sẵn Driver/Car vào g cho current_driver()."""
+    hit = cache.get(user_id)
+    if hit is not _MISSING:
+        user, driver, car = (_attach(o) for o in hit)
+    else:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        driver = car = None
+        if user.role == "driver":
+            driver = Driver.query.filter_by(user_id=user.id).first()
+            if driver is not None and driver.car_id:
+                car = db.session.get(Car, driver.car_id)
+        cache.put(user_id, tuple(_detached_copy(o) for o in (user, driver, car)))
+    g.principal = (user, driver, car)
+    return user
+
+
+def current_driver():
+    """Hồ sơ Driver của current_user (đã nạp cùng user_loader), None nếu không có."""
+    principal = g.get("principal")
+    if principal is not None:
+        return principal[1]
+    from flask_login import current_user
+    return Driver.query.filter_by(user_id=current_user.id).first()
+
+
+# ==== INVALIDATION ====
+# User/Driver/Car đổi (tạo/xóa tài khoản, đổi mật khẩu, khóa...) -> xóa entry sau khi commit
+def _mark(mapper, connection, target):
+    sess = object_session(target)
+    if sess is None:
+        return
+    if isinstance(target, User):
+        key = target.id
+    elif isinstance(target, Driver):
+        key = target.user_id
+    else:
+        key = None  # Car: không biết user nào -> xóa hết (hiếm)
+    sess.info.setdefault("principals_dirty", set()).add(key)
+
+
+def _after_commit(session):
+    for key in session.info.pop("principals_dirty", ()):
+        cache.invalidate(key)
+
+
+for _model in (User, Driver, Car):
+    for _evt in ("after_insert", "after_update", "after_delete"):
+        event.listen(_model, _evt, _mark)
+event.listen(Session, "after_commit", _after_commit)
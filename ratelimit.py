@@ -0,0 +1,212 @@
+# ratelimit.py - giới hạn tần suất (token bucket) cho các route ghi: theo user và theo IP, mỗi route 1 cấu hình
+# Mỗi request POST của route trong RULES lấy 1 token ở từng bucket (route, scope, id); hết token -> 429 + Retry-After.
+# Bucket: (số token, lúc cập nhật), nạp lại liên tục `tokens` token mỗi `seconds` giây, tối đa `tokens` -> O(1)/request.
+# Store mặc định: dict LRU trong process (mỗi worker giới hạn riêng). RATE_LIMIT_REDIS_URL -> Redis dùng chung
+# (1 script Lua/lần kiểm tra). Test/dev thay store bằng set_store(MemoryStore()).
+#   RATE_LIMIT=0 tắt; RATE_LIMITS="login.ip=20/60,trip_finish.user=40/60" ghi đè luật (=0 bỏ luật đó)
+#   RATE_LIMIT_TRUST_PROXY=1: IP lấy từ X-Forwarded-For do proxy của mình thêm vào (phần tử cuối)
+# Đếm số lần kiểm tra / bị chặn theo route + scope ở /metrics để chỉnh ngưỡng.
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request, jsonify, render_template, flash, Response
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.getenv("RATE_LIMIT", "1") == "1"
+MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "0") == "1"
+
+# endpoint -> {scope: (tokens, seconds)}; "user" của /login là email đang thử đăng nhập
+# IP rộng hơn user: tài xế đi 4G thường chung IP NAT của nhà mạng
+RULES = {
+    "login": {"ip": (20, 60), "user": (5, 60)},
+    "driver_claim": {"user": (20, 60), "ip": (120, 60)},
+    "trip_start": {"user": (10, 60), "ip": (120, 60)},
+    "trip_start_existing": {"user": (20, 60), "ip": (120, 60)},
+    "trip_finish": {"user": (20, 60), "ip": (120, 60)},
+    "driver_sync": {"user": (30, 60), "ip": (120, 60)},
+}
+JSON_ENDPOINTS = {"driver_sync"}
+
+
+def parse_rules(spec, rules=None):
+    """'endpoint.scope=tokens/seconds,...' -> bản sao `rules` đã ghi đè."""
+    out = {ep: dict(scopes) for ep, scopes in (rules or RULES).items()}
+    for item in filter(None, (s.strip() for s in (spec or "").split(","))):
+        try:
+            name, value = item.split("=", 1)
+            endpoint, scope = name.strip().split(".", 1)
+            if value.strip() == "0":
+                out.get(endpoint, {}).pop(scope, None)
+                continue
+            tokens, seconds = value.split("/", 1)
+            out.setdefault(endpoint, {})[scope] = (int(tokens), float(seconds))
+        except ValueError:
+            raise ValueError(f"RATE_LIMITS không hợp lệ: {item!r} (dạng endpoint.scope=tokens/seconds)")
+    return out
+
+
+# ==== STORE ====
+class MemoryStore:
+    def __init__(self, max_keys=MAX_KEYS):
+        self.max_keys = max_keys
+        self._data = OrderedDict()  # key -> (tokens, monotonic)
+        self._lock = threading.Lock()
+
+    def take(self, key, tokens, seconds):
+        """Lấy 1 token; trả về 0 nếu được phép, ngược lại số giây tới khi có token."""
+        rate = tokens / seconds
+        now = time.monotonic()
+        with self._lock:
+            b = self._data.get(key)
+            left = tokens if b is None else min(tokens, b[0] + (now - b[1]) * rate)
+            wait = 0.0
+            if left >= 1:
+                left -= 1
+            else:
+                wait = (1 - left) / rate
+            self._data[key] = (left, now)
+            self._data.move_to_end(key)
+            if len(self._data) > self.max_keys:
+                self._data.popitem(last=False)  # bucket lâu không dùng nhất (đã đầy lại từ lâu)
+        return wait
+
+
+# KEYS[1]=bucket; ARGV: tokens, rate (token/giây), now (giây) -> {được phép 0/1, số token còn (chuỗi)}
+_LUA = """
+local b = redis.call('HMGET', KEYS[1], 't', 'ts')
+local cap, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local left = tonumber(b[1]) or cap
+local ts = tonumber(b[2]) or now
+left = math.min(cap, left + math.max(0, now - ts) * rate)
+local ok = 0
+if left >= 1 then left = left - 1; ok = 1 end
+redis.call('HSET', KEYS[1], 't', tostring(left), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(cap / rate * 1000) + 1000)
+return {ok, tostring(left)}
+"""
+
+
+class RedisStore:
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RATE_LIMIT_REDIS_URL được đặt nhưng chưa cài thư viện redis (pip install -r requirements.txt)")
+        self._r = redis.Redis.from_url(url)
+        self._take = self._r.register_script(_LUA)
+
+    def take(self, key, tokens, seconds):
+        rate = tokens / seconds
+        ok, left = self._take(keys=[f"rl:{key}"], args=[tokens, rate, time.time()])
+        return 0.0 if int(ok) else (1 - float(left)) / rate
+
+
+_url = os.getenv("RATE_LIMIT_REDIS_URL")
+store = RedisStore(_url) if _url else MemoryStore()
+
+
+def set_store(s):
+    global store
+    store = s
+
+
+# ==== KIỂM TRA ====
+_lock = threading.Lock()
+_stats = {}  # (endpoint, scope) -> [số lần kiểm tra, số lần chặn]
+_errors = 0
+
+
+def _count(endpoint, scope, rejected):
+    with _lock:
+        s = _stats.setdefault((endpoint, scope), [0, 0])
+        s[0] += 1
+        s[1] += rejected
+
+
+def _client_ip():
+    if TRUST_PROXY and request.access_route:
+        return request.access_route[-1]
+    return request.remote_addr or "-"
+
+
+def _ident(endpoint, scope):
+    if scope == "ip":
+        return _client_ip()
+    if endpoint == "login":
+        return (request.form.get("email") or "").strip().lower() or None
+    from flask_login import current_user
+    return current_user.id if current_user.is_authenticated else None
+
+
+def check(endpoint, rules):
+    """Số giây phải chờ nếu 1 bucket của `endpoint` đã hết token, ngược lại 0. Store lỗi -> cho qua."""
+    global _errors
+    wait = 0.0
+    for scope, (tokens, seconds) in rules.items():
+        ident = _ident(endpoint, scope)
+        if ident is None:
+            continue
+        try:
+            w = store.take(f"{endpoint}:{scope}:{ident}", tokens, seconds)
+        except Exception:
+            with _lock:
+                _errors += 1
+            log.exception("ratelimit: store lỗi, bỏ qua giới hạn")
+            return 0.0
+        _count(endpoint, scope, w > 0)
+        wait = max(wait, w)
+    return wait
+
+
+def _too_many(endpoint, wait):
+    retry = str(max(1, math.ceil(wait)))
+    msg = f"Thao tác quá nhanh, vui lòng thử lại sau {retry} giây."
+    if endpoint in JSON_ENDPOINTS or request.is_json:
+        resp = jsonify(error=msg, retry_after=int(retry))
+    elif endpoint == "login":
+        flash(msg, "warning")
+        resp = Response(render_template("login.html"))
+    else:
+        resp = Response(msg, mimetype="text/plain")
+    resp.status_code = 429
+    resp.headers["Retry-After"] = retry
+    return resp
+
+
+def _collect():
+    with _lock:
+        stats, errors = {k: list(v) for k, v in _stats.items()}, _errors
+    return [
+        ("sc_ratelimit_checks_total", "counter", "Rate-limit bucket checks by endpoint and scope.",
+         [({"endpoint": ep, "scope": sc}, v[0]) for (ep, sc), v in sorted(stats.items())]),
+        ("sc_ratelimit_rejected_total", "counter", "Requests rejected with 429 by endpoint and scope.",
+         [({"endpoint": ep, "scope": sc}, v[1]) for (ep, sc), v in sorted(stats.items())]),
+        ("sc_ratelimit_store_errors_total", "counter", "Rate-limit store failures (request let through).",
+         [({}, errors)]),
+    ]
+
+
+metrics.registry.add_collector(_collect)
+
+
+def init_app(app):
+    app.config.setdefault("RATE_LIMIT_ENABLED", ENABLED)
+    rules = parse_rules(os.getenv("RATE_LIMITS"))
+
+    @app.before_request
+    def _rate_limit():
+        if request.method != "POST" or not app.config["RATE_LIMIT_ENABLED"]:
+            return None
+        endpoint_rules = rules.get(request.endpoint)
+        if not endpoint_rules:
+            return None
+        wait = check(request.endpoint, endpoint_rules)
+        return _too_many(request.endpoint, wait) if wait > 0 else None
@@ -0,0 +1,209 @@
+# report_cache.py - cache HTML báo cáo admin theo (report, day, role)
+# Chỉ cache phần thân báo cáo; khung trang (base.html, flash của người xem) dựng lại mỗi request.
+# Ngày đã qua gần như không đổi -> giữ lâu; ghi Trip/Payment/Cost/Maintenance qua ORM sẽ xóa đúng ngày bị ảnh hưởng
+# (sau commit). Xóa bằng "generation": tăng bộ đếm của (report, day) nên key cũ tự hết hiệu lực, chạy được cả với Redis.
+# Backend mặc định: LRU trong process. REPORT_CACHE_REDIS_URL -> Redis dùng chung giữa các worker.
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from flask import make_response, render_template
+from markupsafe import Markup
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.orm import Session
+
+from models import db, User, Driver, Car, Trip, Payment, Cost, Maintenance
+
+MAX_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "512"))
+TTL = int(os.getenv("REPORT_CACHE_TTL", "3600"))
+# hôm nay thay đổi liên tục và có cả UPDATE không qua ORM (claim đơn) -> TTL ngắn
+TODAY_TTL = int(os.getenv("REPORT_CACHE_TODAY_TTL", "30"))
+
+ALL_DAYS = "*"
+# báo cáo mang số dư từ các ngày trước khoảng xem (sổ thu chi: số dư đầu kỳ): sửa 1 ngày đã qua làm mọi khoảng
+# của báo cáo đó hết hiệu lực qua generation chung PAST_DAYS; ghi của hôm nay không ảnh hưởng khoảng đã qua
+CARRY_REPORTS = ("cashbook",)
+PAST_DAYS = "<today"
+
+
+class MemoryBackend:
+    def __init__(self, max_size=MAX_SIZE):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        out = []
+        with self._lock:
+            for k in keys:
+                if k in self._counters:
+                    out.append(self._counters[k])
+                    continue
+                item = self._data.get(k)
+                if item is None or item[0] <= now:
+                    self._data.pop(k, None)
+                    out.append(None)
+                else:
+                    self._data.move_to_end(k)
+                    out.append(item[1])
+        return out
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisBackend:
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("REPORT_CACHE_REDIS_URL được đặt nhưng chưa cài thư viện redis (pip install -r requirements.txt)")
+        self._r = redis.Redis.from_url(url)
+
+    def get_many(self, keys):
+        vals = self._r.mget(keys)
+        return [v.decode("utf-8") if isinstance(v, bytes) else v for v in vals]
+
+    def set(self, key, value, ttl):
+        self._r.setex(key, ttl, value)
+
+    def incr(self, key):
+        return self._r.incr(key)
+
+
+class ReportCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+
+    def _key(self, report, day, role, days=None):
+        # khoảng nhiều ngày: key gồm generation của từng ngày -> sửa 1 ngày làm mọi khoảng chứa nó hết hiệu lực
+        days = days or [day]
+        shared = [ALL_DAYS, PAST_DAYS] if report in CARRY_REPORTS else [ALL_DAYS]
+        gens = self.backend.get_many([f"rc:gen:{report}:{d}" for d in shared] + [f"rc:gen:{report}:{d}" for d in days])
+        gen = ".".join(str(g or 0) for g in gens)
+        if len(days) > 1:
+            gen = hashlib.sha1(gen.encode()).hexdigest()[:16]
+        return f"rc:body:{report}:{day}:{role}:{gen}"  # "body": entry cũ (cả trang) không được dùng lại
+
+    def get_or_build(self, report, day, role, build, days=None):
+        """(html, hit). `build()` trả về chuỗi HTML; `days`: các ngày (iso) của báo cáo nhiều ngày."""
+        key = self._key(report, day, role, days)
+        html = self.backend.get_many([key])[0]
+        with self._lock:
+            if html is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if html is not None:
+            return html, True
+        html = build()
+        ttl = TODAY_TTL if max(days or [day]) >= date.today().isoformat() else TTL
+        self.backend.set(key, html, ttl)
+        return html, False
+
+    def invalidate(self, report, day=ALL_DAYS):
+        self.backend.incr(f"rc:gen:{report}:{day}")
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"backend": type(self.backend).__name__, "hits": self.hits, "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0}
+
+
+_url = os.getenv("REPORT_CACHE_REDIS_URL")
+cache = ReportCache(RedisBackend(_url) if _url else MemoryBackend())
+
+
+def set_backend(backend):
+    cache.backend = backend
+
+
+def render(report, day, role, build, until=None):
+    """Response HTML của báo cáo, header X-Cache: HIT|MISS.
+
+    `build()` trả về HTML phần thân (template không extends base.html); `until`: ngày cuối (gồm) của báo cáo nhiều ngày.
+    """
+    days = None
+    if isinstance(day, date) and until is not None and until != day:
+        days = [(day + timedelta(days=k)).isoformat() for k in range((until - day).days + 1)]
+        key_day = f"{day.isoformat()}..{until.isoformat()}"
+    else:
+        key_day = day.isoformat() if isinstance(day, date) else str(day)
+    html, hit = cache.get_or_build(report, key_day, role, build, days)
+    resp = make_response(render_template("report_page.html", body=Markup(html)))
+    resp.headers["X-Cache"] = "HIT" if hit else "MISS"
+    return resp
+
+
+# ==== INVALIDATION ====
+# báo cáo nào phụ thuộc vào cột ngày nào
+DAY_COLUMNS = {
+    Trip: (("sales-commission", "ended_at"), ("driver-ops", "started_at")),
+    Payment: (("cashbook", "received_at"),),
+    Cost: (("cashbook", "occurred_at"),),
+}
+# đổi các model này thì xóa toàn bộ báo cáo tương ứng (hiếm)
+WHOLE_REPORTS = {
+    User: ("sales-commission", "driver-ops"),
+    Driver: ("driver-ops",),
+    Car: ("driver-ops",),
+    Maintenance: ("maintenance",),
+}
+
+
+def _days(obj, attr):
+    # ngày hiện tại và ngày trước khi sửa (dời ngày -> cả 2 ngày đều đổi)
+    hist = sa_inspect(obj).attrs[attr].history
+    vals = list(hist.added or ()) + list(hist.deleted or ()) + list(hist.unchanged or ())
+    return {v.date().isoformat() for v in vals if v is not None}
+
+
+def _collect(session, flush_context):
+    marks = session.info.setdefault("report_cache_dirty", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        for model, rules in DAY_COLUMNS.items():
+            if isinstance(obj, model):
+                for report, attr in rules:
+                    marks.update((report, d) for d in _days(obj, attr))
+        if isinstance(obj, Cost) and obj.category == "maintenance":
+            marks.add(("maintenance", ALL_DAYS))
+        for model, reports in WHOLE_REPORTS.items():
+            if isinstance(obj, model):
+                marks.update((r, ALL_DAYS) for r in reports)
+
+
+def mark(report, day):
+    """Xóa (report, day) sau commit; dùng cho insert/update hàng loạt không đi qua flush của ORM."""
+    day = day.isoformat() if isinstance(day, date) else day
+    db.session.info.setdefault("report_cache_dirty", set()).add((report, day))
+
+
+def _after_commit(session):
+    marks = session.info.pop("report_cache_dirty", set())
+    today = date.today().isoformat()
+    marks |= {(r, PAST_DAYS) for r, d in marks if r in CARRY_REPORTS and d != ALL_DAYS and d < today}
+    for report, day in marks:
+        try:
+            cache.invalidate(report, day)
+        except Exception:
+            pass  # backend chung lỗi: entry sẽ hết hạn theo TTL
+
+
+event.listen(Session, "after_flush", _collect)
+event.listen(Session, "after_commit", _after_commit)
@@ -0,0 +1,175 @@
+# reports.py - tổng hợp báo cáo admin bằng 1 câu SQL GROUP BY (không lặp N+1 trong Python)
+# Trip/Payment lấy qua archive.trips()/payments(): khoảng ngày chạm tháng đã lưu trữ thì đọc cả bảng lưu trữ
+# *_days: 1 dòng/ngày trong khoảng from..to, lũy kế bằng window SUM(...) OVER (ORDER BY day) trong DB
+from datetime import date, timedelta
+
+from models import db, User, Car, Driver, Cost
+import archive
+
+DEFAULT_SALES_RATE = 0.05
+
+
+def commission_rate_expr(col, default):
+    # giống `user.commission_rate or default` bên Python: NULL và 0 đều về mặc định
+    return db.func.coalesce(db.func.nullif(col, 0), default)
+
+
+def sales_commission_rows(start, end):
+    """Mỗi sales 1 dòng: số chuyến, doanh thu, hoa hồng cho các chuyến kết thúc trong [start, end)."""
+    T = archive.trips(start, end)
+    fare = db.func.coalesce(T.final_fare, 0)
+    stmt = (
+        db.select(
+            User,
+            db.func.count(T.id).label("trips"),
+            db.func.coalesce(db.func.sum(fare), 0).label("revenue"),
+            db.func.coalesce(db.func.sum(fare * commission_rate_expr(User.commission_rate, DEFAULT_SALES_RATE)), 0).label("commission"),
+        )
+        .join(User, User.id == T.sales_id)
+        .where(T.ended_at >= start, T.ended_at < end)
+        .group_by(User.id)
+        .order_by(db.func.min(T.id))
+    )
+    return [
+        {"sales": u, "revenue": float(rev), "commission": float(com), "trips": n}
+        for u, n, rev, com in db.session.execute(stmt)
+    ]
+
+
+def driver_ops_rows(start, end):
+    """Mỗi tài xế 1 dòng cho các chuyến bắt đầu trong [start, end); chuyến chưa có tài xế gom vào dòng driver=None."""
+    T = archive.trips(start, end, by="started_at")
+    per_driver = (
+        db.select(
+            T.driver_id.label("driver_id"),
+            db.func.min(T.car_id).label("car_id"),
+            db.func.min(T.id).label("first_trip"),
+            db.func.count(T.id).label("trips"),
+            db.func.coalesce(db.func.sum(db.func.coalesce(T.final_fare, 0)), 0).label("revenue"),
+            db.func.coalesce(db.func.sum(db.func.coalesce(T.cash_collected, 0)), 0).label("cash"),
+        )
+        .where(T.started_at >= start, T.started_at < end)
+        .group_by(T.driver_id)
+        .subquery()
+    )
+    stmt = (
+        db.select(User, Car, per_driver.c.trips, per_driver.c.revenue, per_driver.c.cash)
+        .select_from(per_driver)
+        .outerjoin(Driver, Driver.id == per_driver.c.driver_id)
+        .outerjoin(User, User.id == Driver.user_id)
+        .outerjoin(Car, Car.id == per_driver.c.car_id)
+        .order_by(per_driver.c.first_trip)
+    )
+    return [
+        {"driver": usr, "car": car, "trips": n, "revenue": float(rev), "cash": float(cash)}
+        for usr, car, n, rev, cash in db.session.execute(stmt)
+    ]
+
+
+# ==== THEO NGÀY ====
+def _as_date(v):
+    return date.fromisoformat(v) if isinstance(v, str) else v
+
+
+def _fill_days(rows, first, last, sums, running, opening=0.0):
+    """Thêm dòng 0 cho ngày không phát sinh (giữ nguyên các cột lũy kế `running`, trước dòng đầu = `opening`)."""
+    by_day = {r["day"]: r for r in rows}
+    out, prev = [], {k: opening for k in running}
+    d = first
+    while d <= last:
+        r = by_day.get(d) or dict({k: 0 for k in sums}, day=d, **prev)
+        prev = {k: r[k] for k in running}
+        out.append(r)
+        d += timedelta(days=1)
+    return out
+
+
+def cash_balance_before(start):
+    """Số dư đầu kỳ: tổng thu (payments) - tổng chi (costs) trước `start`."""
+    P = archive.payments(None, start)
+    cash_in = db.select(db.func.coalesce(db.func.sum(P.amount), 0)).where(P.received_at < start).scalar_subquery()
+    cash_out = db.select(db.func.coalesce(db.func.sum(Cost.amount), 0)).where(Cost.occurred_at < start).scalar_subquery()
+    return float(db.session.execute(db.select(cash_in - cash_out)).scalar() or 0)
+
+
+def cashbook_days(start, end):
+    """Sổ thu chi theo ngày cho [start, end) (datetime): (số dư đầu kỳ, các dòng ngày).
+
+    Mỗi dòng: thu (tổng / tiền mặt), chi, ròng, số dư = đầu kỳ + SUM(ròng) OVER (ORDER BY day).
+    Payments và Costs gộp theo ngày rồi UNION ALL -> 1 câu SQL, 1 dòng/ngày có phát sinh.
+    """
+    opening = cash_balance_before(start)
+    P = archive.payments(start, end)
+    p_day, c_day = db.func.date(P.received_at), db.func.date(Cost.occurred_at)
+    amount = db.func.coalesce(P.amount, 0)
+    pays = (
+        db.select(p_day.label("day"), db.func.sum(amount).label("cash_in"),
+                  db.func.sum(db.case((P.method == "cash", amount), else_=0)).label("cash_in_cash"),
+                  db.literal(0.0).label("cash_out"), db.func.count(P.id).label("payments"),
+                  db.literal(0).label("costs"))
+        .where(P.received_at >= start, P.received_at < end).group_by(p_day)
+    )
+    costs = (
+        db.select(c_day.label("day"), db.literal(0.0).label("cash_in"), db.literal(0.0).label("cash_in_cash"),
+                  db.func.sum(db.func.coalesce(Cost.amount, 0)).label("cash_out"), db.literal(0).label("payments"),
+                  db.func.count(Cost.id).label("costs"))
+        .where(Cost.occurred_at >= start, Cost.occurred_at < end).group_by(c_day)
+    )
+    flows = db.union_all(pays, costs).subquery()
+    net = db.func.sum(flows.c.cash_in) - db.func.sum(flows.c.cash_out)
+    stmt = (
+        db.select(flows.c.day, db.func.sum(flows.c.cash_in), db.func.sum(flows.c.cash_in_cash),
+                  db.func.sum(flows.c.cash_out), db.func.sum(flows.c.payments), db.func.sum(flows.c.costs),
+                  net, db.literal(opening) + db.func.sum(net).over(order_by=flows.c.day))
+        .group_by(flows.c.day).order_by(flows.c.day)
+    )
+    rows = [
+        {"day": _as_date(d), "cash_in": float(i or 0), "cash_in_cash": float(ic or 0), "cash_out": float(o or 0),
+         "payments": int(np or 0), "costs": int(nc or 0), "net": float(n or 0), "balance": float(b or 0)}
+        for d, i, ic, o, np, nc, n, b in db.session.execute(stmt)
+    ]
+    return opening, _fill_days(rows, start.date(), (end - timedelta(days=1)).date(),
+                               ("cash_in", "cash_in_cash", "cash_out", "payments", "costs", "net"), ("balance",),
+                               opening)
+
+
+def sales_commission_days(start, end):
+    """Theo ngày kết thúc chuyến trong [start, end): số chuyến có sales, doanh thu, hoa hồng, hoa hồng lũy kế."""
+    T = archive.trips(start, end)
+    day = db.func.date(T.ended_at)
+    fare = db.func.coalesce(T.final_fare, 0)
+    commission = db.func.sum(fare * commission_rate_expr(User.commission_rate, DEFAULT_SALES_RATE))
+    stmt = (
+        db.select(day, db.func.count(T.id), db.func.sum(fare), commission,
+                  db.func.sum(commission).over(order_by=day))
+        .join(User, User.id == T.sales_id)
+        .where(T.ended_at >= start, T.ended_at < end)
+        .group_by(day).order_by(day)
+    )
+    rows = [
+        {"day": _as_date(d), "trips": n, "revenue": float(rev or 0), "commission": float(com or 0),
+         "commission_to_date": float(run or 0)}
+        for d, n, rev, com, run in db.session.execute(stmt)
+    ]
+    return _fill_days(rows, start.date(), (end - timedelta(days=1)).date(),
+                      ("trips", "revenue", "commission"), ("commission_to_date",))
+
+
+def driver_ops_days(start, end):
+    """Theo ngày bắt đầu chuyến trong [start, end): số chuyến, số tài xế, doanh thu, tiền mặt, doanh thu lũy kế."""
+    T = archive.trips(start, end, by="started_at")
+    day = db.func.date(T.started_at)
+    revenue = db.func.sum(db.func.coalesce(T.final_fare, 0))
+    stmt = (
+        db.select(day, db.func.count(T.id), db.func.count(db.distinct(T.driver_id)), revenue,
+                  db.func.sum(db.func.coalesce(T.cash_collected, 0)), db.func.sum(revenue).over(order_by=day))
+        .where(T.started_at >= start, T.started_at < end)
+        .group_by(day).order_by(day)
+    )
+    rows = [
+        {"day": _as_date(d), "trips": n, "drivers": nd, "revenue": float(rev or 0), "cash": float(cash or 0),
+         "revenue_to_date": float(run or 0)}
+        for d, n, nd, rev, cash, run in db.session.execute(stmt)
+    ]
+    return _fill_days(rows, start.date(), (end - timedelta(days=1)).date(),
+                      ("trips", "drivers", "revenue", "cash"), ("revenue_to_date",))
@@ -0,0 +1,183 @@
+# rollups.py - bảng tổng hợp theo ngày (doanh thu, tiền mặt, hoa hồng, chi phí)
+# Cập nhật tăng dần trong cùng transaction với thao tác ghi; `flask rebuild-rollups` để dựng lại từ đầu.
+from datetime import date, datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, User, Trip, Cost, SalesDaily, DriverDaily, DaySummary, CarDaily, CarLedger
+from reports import commission_rate_expr, DEFAULT_SALES_RATE
+import archive
+
+
+def _bump(model, keys: dict, deltas: dict):
+    # UPDATE ... SET col = col + delta; chưa có dòng thì INSERT (savepoint để chịu được insert song song)
+    where = [getattr(model, k) == v for k, v in keys.items()]
+    upd = (
+        db.update(model).where(*where)
+        .values({c: getattr(model, c) + v for c, v in deltas.items()})
+        .execution_options(synchronize_session=False)
+    )
+    if db.session.execute(upd).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.execute(db.insert(model).values(**keys, **deltas))
+    except IntegrityError:
+        db.session.execute(upd)
+
+
+def apply_trip(trip: Trip, sign: int = 1):
+    """Cộng (sign=1) hoặc trừ (sign=-1) một chuyến đã hoàn tất vào các bảng rollup."""
+    if trip.status != "completed" or trip.ended_at is None:
+        return
+    day = trip.ended_at.date()
+    fare = (trip.final_fare or 0) * sign
+    cash = (trip.cash_collected or 0) * sign
+
+    if trip.sales_id:
+        sales = db.session.get(User, trip.sales_id)
+        rate = (sales.commission_rate if sales else None) or DEFAULT_SALES_RATE
+        _bump(SalesDaily, {"day": day, "sales_id": trip.sales_id},
+              {"trips": sign, "revenue": fare, "commission": fare * rate})
+    _bump(DriverDaily, {"day": day, "driver_id": trip.driver_id or 0, "car_id": trip.car_id or 0},
+          {"trips": sign, "revenue": fare, "cash": cash})
+    _bump(DaySummary, {"day": day}, {"trips": sign, "revenue": fare, "cash": cash})
+    if trip.car_id:
+        km = (trip.distance_km or 0) * sign
+        _bump(CarDaily, {"day": day, "car_id": trip.car_id}, {"trips": sign, "km": km})
+        _bump(CarLedger, {"car_id": trip.car_id}, {"trips": sign, "odometer_km": km})
+
+
+def apply_cost(cost: Cost, sign: int = 1):
+    if cost.occurred_at is None:
+        cost.occurred_at = datetime.utcnow()
+    amount = (cost.amount or 0) * sign
+    _bump(DaySummary, {"day": cost.occurred_at.date()}, {"costs": amount})
+    if cost.car_id:
+        deltas = {"costs": amount}
+        if cost.category == "maintenance":
+            deltas["maintenance_costs"] = amount
+        _bump(CarLedger, {"car_id": cost.car_id}, deltas)
+
+
+# ==== READ ====
+def _as_date(v):
+    return date.fromisoformat(v) if isinstance(v, str) else v
+
+
+# *_query: câu SELECT dùng chung với API async (async_api.py)
+def sales_totals_query(sales_id: int, start: date, end: date):
+    return db.select(db.func.coalesce(db.func.sum(SalesDaily.trips), 0),
+                     db.func.coalesce(db.func.sum(SalesDaily.revenue), 0)) \
+        .where(SalesDaily.sales_id == sales_id, SalesDaily.day >= start, SalesDaily.day < end)
+
+
+def driver_totals_query(driver_id: int, start: date, end: date):
+    return db.select(db.func.coalesce(db.func.sum(DriverDaily.trips), 0),
+                     db.func.coalesce(db.func.sum(DriverDaily.revenue), 0),
+                     db.func.coalesce(db.func.sum(DriverDaily.cash), 0)) \
+        .where(DriverDaily.driver_id == driver_id, DriverDaily.day >= start, DriverDaily.day < end)
+
+
+def global_totals_query():
+    return db.select(db.func.coalesce(db.func.sum(DaySummary.trips), 0),
+                     db.func.coalesce(db.func.sum(DaySummary.revenue), 0),
+                     db.func.coalesce(db.func.sum(DaySummary.cash), 0),
+                     db.func.coalesce(db.func.sum(DaySummary.costs), 0))
+
+
+def totals_dict(row):
+    return {"trips": int(row[0]), "revenue": float(row[1]), "cash": float(row[2]), "costs": float(row[3])}
+
+
+def sales_totals(sales_id: int, start: date, end: date):
+    """(trips, revenue) của một sales cho các ngày trong [start, end)."""
+    row = db.session.execute(sales_totals_query(sales_id, start, end)).one()
+    return int(row[0]), float(row[1])
+
+
+def driver_totals(driver_id: int, start: date, end: date):
+    """(trips, revenue, cash) của một tài xế cho các ngày trong [start, end)."""
+    row = db.session.execute(driver_totals_query(driver_id, start, end)).one()
+    return int(row[0]), float(row[1]), float(row[2])
+
+
+def global_totals():
+    return totals_dict(db.session.execute(global_totals_query()).one())
+
+
+# ==== REBUILD ====
+def rebuild_rollups():
+    """Xóa và dựng lại toàn bộ rollup bằng GROUP BY trên trips/costs. Gọi trong app context; caller commit."""
+    for model in (SalesDaily, DriverDaily, DaySummary, CarDaily, CarLedger):
+        db.session.execute(db.delete(model))
+
+    T = archive.trips()  # gồm cả các tháng đã lưu trữ
+    day = db.func.date(T.ended_at)
+    fare = db.func.coalesce(T.final_fare, 0)
+    cash = db.func.coalesce(T.cash_collected, 0)
+    done = (T.status == "completed", T.ended_at.is_not(None))
+
+    sales_rows = db.session.execute(
+        db.select(day, T.sales_id, db.func.count(), db.func.sum(fare),
+                  db.func.sum(fare * commission_rate_expr(User.commission_rate, DEFAULT_SALES_RATE)))
+        .outerjoin(User, User.id == T.sales_id)
+        .where(*done, T.sales_id.is_not(None))
+        .group_by(day, T.sales_id)
+    ).all()
+    driver_rows = db.session.execute(
+        db.select(day, db.func.coalesce(T.driver_id, 0), db.func.coalesce(T.car_id, 0),
+                  db.func.count(), db.func.sum(fare), db.func.sum(cash))
+        .where(*done)
+        .group_by(day, db.func.coalesce(T.driver_id, 0), db.func.coalesce(T.car_id, 0))
+    ).all()
+
+    summary = {}
+    for d, drv, car, n, rev, c in driver_rows:
+        s = summary.setdefault(_as_date(d), {"trips": 0, "revenue": 0.0, "cash": 0.0, "costs": 0.0})
+        s["trips"] += n; s["revenue"] += rev or 0; s["cash"] += c or 0
+    cost_day = db.func.date(Cost.occurred_at)
+    for d, amount in db.session.execute(
+        db.select(cost_day, db.func.sum(db.func.coalesce(Cost.amount, 0)))
+        .where(Cost.occurred_at.is_not(None)).group_by(cost_day)
+    ):
+        summary.setdefault(_as_date(d), {"trips": 0, "revenue": 0.0, "cash": 0.0, "costs": 0.0})["costs"] += amount or 0
+
+    if sales_rows:
+        db.session.execute(db.insert(SalesDaily), [
+            {"day": _as_date(d), "sales_id": sid, "trips": n, "revenue": rev or 0, "commission": com or 0}
+            for d, sid, n, rev, com in sales_rows
+        ])
+    if driver_rows:
+        db.session.execute(db.insert(DriverDaily), [
+            {"day": _as_date(d), "driver_id": drv, "car_id": car, "trips": n, "revenue": rev or 0, "cash": c or 0}
+            for d, drv, car, n, rev, c in driver_rows
+        ])
+    if summary:
+        db.session.execute(db.insert(DaySummary), [{"day": d, **v} for d, v in summary.items()])
+
+    # odo = tổng km các chuyến; forecast.refresh() hiệu chỉnh theo số odo ghi lúc bảo dưỡng
+    car_rows = db.session.execute(
+        db.select(day, T.car_id, db.func.count(), db.func.sum(db.func.coalesce(T.distance_km, 0)))
+        .where(*done, T.car_id.is_not(None))
+        .group_by(day, T.car_id)
+    ).all()
+    ledger = {}
+    for d, car, n, km in car_rows:
+        e = ledger.setdefault(car, {"car_id": car, "trips": 0, "odometer_km": 0.0, "costs": 0.0, "maintenance_costs": 0.0})
+        e["trips"] += n; e["odometer_km"] += km or 0
+    for car, category, amount in db.session.execute(
+        db.select(Cost.car_id, Cost.category, db.func.sum(db.func.coalesce(Cost.amount, 0)))
+        .where(Cost.car_id.is_not(None)).group_by(Cost.car_id, Cost.category)
+    ):
+        e = ledger.setdefault(car, {"car_id": car, "trips": 0, "odometer_km": 0.0, "costs": 0.0, "maintenance_costs": 0.0})
+        e["costs"] += amount or 0
+        if category == "maintenance":
+            e["maintenance_costs"] += amount or 0
+    if car_rows:
+        db.session.execute(db.insert(CarDaily), [
+            {"day": _as_date(d), "car_id": car, "trips": n, "km": km or 0} for d, car, n, km in car_rows
+        ])
+    if ledger:
+        db.session.execute(db.insert(CarLedger), list(ledger.values()))
+    return {"sales": len(sales_rows), "drivers": len(driver_rows), "days": len(summary), "cars": len(ledger)}
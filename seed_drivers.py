@@ -1,7 +1,9 @@
 # seed_drivers.py - tạo 5 driver + 5 car và map quan hệ
-from app import app
+from factory import create_app
 from models import db, User, Driver, Car
 
+app = create_app()
+
 # Hash mật khẩu: ưu tiên passlib bcrypt, fallback về werkzeug
 try:
     from passlib.hash import bcrypt
@@ -1,7 +1,9 @@
 # seed_users.py - tạo admin + sale01..sale20
-from app import app
+from factory import create_app
 from models import db, User
 
+app = create_app()
+
 # Thử dùng passlib bcrypt (nếu có), fallback sang werkzeug
 try:
     from passlib.hash import bcrypt
@@ -0,0 +1,129 @@
+# summaries.py - JSON tóm tắt dashboard tài xế / sales / admin, dùng chung cho route Flask (/api/<tên>/summary)
+# và async_api (/api/async/<tên>/summary) -> cùng câu SQL, cùng payload; so sức chứa 2 bên mới công bằng (bench-async).
+# Mỗi "plan" trả về (danh sách (câu truy vấn, dạng kết quả) độc lập, hàm dựng payload từ các kết quả theo thứ tự):
+# Flask chạy lần lượt trên db.session, async_api chạy song song bằng asyncio.gather.
+from datetime import date, datetime, time, timedelta
+
+from models import db, Trip, DaySummary
+import dispatch
+import pagination
+import rollups
+
+ADMIN_ROLES = ("admin", "manager", "accountant")
+
+
+class SummaryError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _month(d):
+    start = d.replace(day=1)
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return datetime.combine(start, time.min), datetime.combine(end, time.min)
+
+
+def _page(name, owner_id, mon_start, mon_end):
+    stmt, order = pagination.LISTS[name][1](owner_id, mon_start, mon_end)
+    stmt, limit = pagination.page_query(stmt, order)
+    return stmt, ("page", order, limit)
+
+
+def fetch(result, shape):
+    """Kết quả của 1 truy vấn trong plan: "one" | "all" | "scalars" | ("page", order, limit)."""
+    if shape == "one":
+        return result.one()
+    if shape == "all":
+        return result.all()
+    rows = result.scalars().all()
+    if shape == "scalars":
+        return rows
+    _, order, limit = shape
+    items, nxt = pagination.split_page(rows, order, limit)
+    return {"items": [pagination.trip_json(t) for t in items], "next": nxt}
+
+
+def driver_plan(user, driver, params):
+    if driver is None:
+        raise SummaryError(404, "no driver profile")
+    today, (mon_start, mon_end) = date.today(), _month(date.today())
+    queries = [
+        (rollups.driver_totals_query(driver.id, today, today + timedelta(days=1)), "one"),
+        (rollups.driver_totals_query(driver.id, mon_start.date(), mon_end.date()), "one"),
+        _page("driver-open", driver.id, mon_start, mon_end),
+        _page("driver-month", driver.id, mon_start, mon_end),
+        (db.select(Trip).where(Trip.driver_id == driver.id, Trip.status.in_(["assigned", "ongoing"]))
+         .order_by(Trip.id.desc()), "scalars"),
+    ]
+
+    def build(day_t, mon_t, open_page, month_page, assigned):
+        rate = user.commission_rate or 0.40
+        return {
+            "driver_id": driver.id, "commission_rate": rate,
+            "today": {"trips": int(day_t[0]), "revenue": float(day_t[1]), "cash": float(day_t[2]),
+                      "commission": float(day_t[1]) * rate},
+            "month": {"trips": int(mon_t[0]), "revenue": float(mon_t[1]), "cash": float(mon_t[2]),
+                      "commission": float(mon_t[1]) * rate},
+            "open_trips": open_page, "month_trips": month_page,
+            "my_assigned": [pagination.trip_json(t) for t in assigned],
+        }
+    return queries, build
+
+
+def sales_plan(user, driver, params):
+    today, (mon_start, mon_end) = date.today(), _month(date.today())
+    queries = [
+        (rollups.sales_totals_query(user.id, today, today + timedelta(days=1)), "one"),
+        (rollups.sales_totals_query(user.id, mon_start.date(), mon_end.date()), "one"),
+        _page("sales-pending", user.id, mon_start, mon_end),
+        _page("sales-month", user.id, mon_start, mon_end),
+    ]
+
+    def build(day_t, mon_t, pending, month_page):
+        rate = user.commission_rate or 0.05
+        return {
+            "sales_id": user.id, "commission_rate": rate,
+            "today": {"trips": int(day_t[0]), "revenue": float(day_t[1]), "commission": float(day_t[1]) * rate},
+            "month": {"trips": int(mon_t[0]), "revenue": float(mon_t[1]), "commission": float(mon_t[1]) * rate},
+            "pending_trips": pending, "month_trips": month_page,
+        }
+    return queries, build
+
+
+def admin_plan(user, driver, params):
+    try:
+        day = date.fromisoformat(params["date"]) if params.get("date") else date.today()
+    except ValueError:
+        raise SummaryError(400, "date phải là YYYY-MM-DD")
+    queries = [
+        (rollups.global_totals_query(), "one"),
+        (db.select(DaySummary.trips, DaySummary.revenue, DaySummary.cash, DaySummary.costs)
+         .where(DaySummary.day == day), "all"),
+        (db.select(db.func.count()).select_from(dispatch.open_trips_query().order_by(None).subquery()), "one"),
+        (db.select(db.func.count()).select_from(Trip).where(Trip.status == "ongoing"), "one"),
+    ]
+
+    def build(totals, day_row, open_n, ongoing_n):
+        totals = rollups.totals_dict(totals)
+        day_t = rollups.totals_dict(day_row[0]) if day_row else rollups.totals_dict((0, 0, 0, 0))
+        return {
+            "totals": dict(totals, net_profit=totals["revenue"] - totals["costs"]),
+            "day": dict(day_t, date=day.isoformat(), net_profit=day_t["revenue"] - day_t["costs"]),
+            "open_trips": int(open_n[0]), "ongoing_trips": int(ongoing_n[0]),
+        }
+    return queries, build
+
+
+# tên -> (plan, role được gọi)
+PLANS = {
+    "driver": (driver_plan, ("driver",)),
+    "sales": (sales_plan, ("sales",)),
+    "admin": (admin_plan, ADMIN_ROLES),
+}
+
+
+def run(session, name, user, driver, params):
+    """Payload của dashboard `name`, chạy tuần tự trên session đồng bộ (route Flask)."""
+    queries, build = PLANS[name][0](user, driver, params)
+    return build(*[fetch(session.execute(stmt), shape) for stmt, shape in queries])
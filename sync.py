@@ -0,0 +1,202 @@
+# sync.py - áp dụng hàng đợi sự kiện start/finish/payment tài xế ghi lại lúc mất sóng (POST /driver/sync)
+# {"events": [{"id": "<uuid do app sinh>", "type": "start"|"finish"|"payment", "at": "2024-05-01T08:30:00", ...}]}
+#   start:   trip_id (đơn đang chờ/đã nhận) hoặc origin, fare_quote, sales_id (khách vãng lai -> tạo đơn mới)
+#   finish:  trip_id hoặc trip_ref (= id của sự kiện start đã tạo đơn), destination, distance_km, final_fare,
+#            payment_method, cash_collected, payment_ref
+#   payment: trip_id hoặc trip_ref, method, amount, reference
+# Cả lô 1 transaction, mỗi sự kiện 1 savepoint (sự kiện lỗi không kéo cả lô), Payment insert hàng loạt cuối lô.
+# Kết quả từng sự kiện được lưu (SyncEvent): gửi lại cùng id -> "duplicate" + kết quả cũ, không áp dụng lại.
+# Gọi từ JS nhớ gửi header X-CSRFToken.
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from models import db, Trip, Payment, SyncEvent
+import dispatch
+import events
+import report_cache
+import rollups
+
+MAX_BATCH = 200
+# SQLite: lô mở transaction bằng SAVEPOINT rồi đọc trước khi ghi -> có thể gặp "database is locked"
+# khi lô khác vừa commit; lô idempotent nên rollback và chạy lại cả lô
+COMMIT_RETRIES = 3
+# đồng hồ điện thoại chạy nhanh: mốc thời gian quá xa trong tương lai thì lấy giờ server
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+APPLIED = "applied"
+REJECTED = "rejected"
+INVALID = "invalid"
+DUPLICATE = "duplicate"
+
+
+class EventError(Exception):
+    """Sự kiện hợp lệ nhưng không áp dụng được (đơn của người khác, đã hoàn tất...); kết quả được lưu lại."""
+
+    def __init__(self, message, trip_id=None):
+        super().__init__(message)
+        self.trip_id = trip_id
+
+
+def _at(ev, now):
+    raw = ev.get("at")
+    if not raw:
+        return now
+    at = datetime.fromisoformat(str(raw))
+    if at.tzinfo is not None:
+        at = at.astimezone().replace(tzinfo=None)  # giờ local như phần còn lại của app
+    return now if at > now + MAX_CLOCK_SKEW else at
+
+
+def _money(v):
+    return float(str(v).replace(",", "").strip() or 0) if v is not None else 0.0
+
+
+def _trip_for(ctx, ev):
+    if ev.get("trip_ref"):
+        ref = ctx["seen"].get(str(ev["trip_ref"]))
+        if ref is None or ref.trip_id is None:
+            raise EventError("trip_ref chưa được áp dụng")
+        trip_id = ref.trip_id
+    elif ev.get("trip_id") is not None:
+        trip_id = int(ev["trip_id"])
+    else:
+        raise ValueError("thiếu trip_id hoặc trip_ref")
+    trip = db.session.get(Trip, trip_id)
+    if trip is None:
+        raise EventError("chuyến không tồn tại", trip_id)
+    if trip.driver_id != ctx["driver"].id:
+        raise EventError("không phải chuyến của tài xế này", trip_id)
+    return trip
+
+
+# handler -> (trip_id, [(kind, payload) để publish], [dòng Payment])
+def _start(ctx, ev):
+    driver, at = ctx["driver"], _at(ev, ctx["now"])
+    if ev.get("trip_id") is None:  # khách vãng lai, chưa có đơn trên server
+        trip = Trip(driver_id=driver.id, car_id=driver.car_id, started_at=at, origin=ev.get("origin"),
+                    status="ongoing", fare_quote=_money(ev.get("fare_quote")),
+                    sales_id=int(ev["sales_id"]) if ev.get("sales_id") else None)
+        db.session.add(trip)
+        db.session.flush()
+        return trip.id, [("started", events.trip_payload(trip))], []
+    trip_id = int(ev["trip_id"])
+    res = dispatch.claim_trip(trip_id, driver, start_at=at)
+    if res == dispatch.NOT_FOUND:
+        raise EventError("chuyến không tồn tại", trip_id)
+    if res == dispatch.TAKEN:
+        raise EventError("chuyến đã có tài xế khác hoặc đã bắt đầu/hoàn tất", trip_id)
+    trip = db.session.get(Trip, trip_id)
+    db.session.expire(trip)  # UPDATE không đồng bộ identity map; finish cùng lô phải đọc lại
+    return trip_id, [("claimed", {"id": trip_id, "status": "ongoing", "driver_id": driver.id})], []
+
+
+def _finish(ctx, ev):
+    trip = _trip_for(ctx, ev)
+    if trip.status == "completed":
+        raise EventError("chuyến đã hoàn tất", trip.id)
+    if trip.status not in ("assigned", "ongoing"):
+        raise EventError(f"chuyến đang ở trạng thái {trip.status}", trip.id)
+    at = _at(ev, ctx["now"])
+    trip.started_at = trip.started_at or at
+    trip.ended_at = at
+    trip.destination = ev.get("destination") or trip.destination
+    trip.final_fare = _money(ev.get("final_fare")) or trip.fare_quote or 0
+    trip.distance_km = float(ev.get("distance_km") or trip.distance_km or 0)
+    trip.payment_method = ev.get("payment_method")
+    trip.cash_collected = _money(ev.get("cash_collected"))
+    trip.status = "completed"
+    rollups.apply_trip(trip)
+    pay = {"trip_id": trip.id, "method": trip.payment_method, "amount": trip.final_fare, "received_at": at,
+           "reference_code": ev.get("payment_ref") or None}
+    return trip.id, [("finished", events.trip_payload(trip))], [pay]
+
+
+def _payment(ctx, ev):
+    trip = _trip_for(ctx, ev)
+    amount = _money(ev.get("amount"))
+    if amount <= 0:
+        raise ValueError("amount phải > 0")
+    pay = {"trip_id": trip.id, "method": ev.get("method") or "cash", "amount": amount,
+           "received_at": _at(ev, ctx["now"]), "reference_code": ev.get("reference") or None}
+    return trip.id, [], [pay]
+
+
+HANDLERS = {"start": _start, "finish": _finish, "payment": _payment}
+
+
+def _record(ctx, eid, kind, status, trip_id=None, error=None):
+    rec = SyncEvent(driver_id=ctx["driver"].id, event_id=eid, kind=kind, status=status, trip_id=trip_id, error=error)
+    db.session.add(rec)
+    db.session.flush()
+    ctx["seen"][eid] = rec
+    return rec
+
+
+def _apply_one(ctx, ev):
+    if not isinstance(ev, dict):
+        return {"id": None, "status": INVALID, "error": "sự kiện phải là object"}
+    eid = str(ev.get("id") or "").strip()
+    kind = ev.get("type")
+    if not eid or len(eid) > 64:
+        return {"id": ev.get("id"), "status": INVALID, "error": "thiếu id (tối đa 64 ký tự)"}
+    prev = ctx["seen"].get(eid)
+    if prev is not None:
+        return {"id": eid, "status": DUPLICATE, "result": prev.status, "trip_id": prev.trip_id, "error": prev.error}
+    if kind not in HANDLERS:
+        return {"id": eid, "status": INVALID, "error": f"type phải là một trong {', '.join(HANDLERS)}"}
+    try:
+        with db.session.begin_nested():
+            trip_id, publish, payments = HANDLERS[kind](ctx, ev)
+            _record(ctx, eid, kind, APPLIED, trip_id)
+    except EventError as e:
+        try:
+            with db.session.begin_nested():
+                _record(ctx, eid, kind, REJECTED, e.trip_id, str(e)[:255])
+        except IntegrityError:
+            return {"id": eid, "status": DUPLICATE}
+        return {"id": eid, "status": REJECTED, "trip_id": e.trip_id, "error": str(e)}
+    except (ValueError, TypeError, KeyError) as e:
+        return {"id": eid, "status": INVALID, "error": str(e)}
+    except IntegrityError:
+        # cùng id đang được 1 lô khác (gửi lại song song) ghi
+        return {"id": eid, "status": DUPLICATE}
+    ctx["published"].extend(publish)
+    ctx["payments"].extend(payments)
+    return {"id": eid, "status": APPLIED, "trip_id": trip_id}
+
+
+def apply_batch(driver, batch):
+    """Áp dụng lần lượt các sự kiện; trả về (kết quả từng sự kiện, sự kiện SSE). Caller commit rồi publish."""
+    ids = [str(ev.get("id")) for ev in batch if isinstance(ev, dict) and ev.get("id")]
+    seen = {e.event_id: e for e in db.session.execute(
+        db.select(SyncEvent).where(SyncEvent.driver_id == driver.id, SyncEvent.event_id.in_(ids))
+    ).scalars()} if ids else {}
+    # nạp trước mọi chuyến được nhắc tới bằng 1 query; các handler lấy từ identity map
+    trip_ids = {int(ev["trip_id"]) for ev in batch if isinstance(ev, dict) and str(ev.get("trip_id", "")).isdigit()}
+    if trip_ids:
+        db.session.execute(db.select(Trip).where(Trip.id.in_(trip_ids))).scalars().all()
+
+    ctx = {"driver": driver, "now": datetime.now(), "seen": seen, "payments": [], "published": []}
+    results = [_apply_one(ctx, ev) for ev in batch]
+    if ctx["payments"]:
+        db.session.execute(db.insert(Payment), ctx["payments"])
+        for day in {p["received_at"].date() for p in ctx["payments"]}:
+            report_cache.mark("cashbook", day)
+    return results, ctx["published"]
+
+
+def run(driver, batch):
+    """apply_batch + commit, thử lại cả lô khi DB báo khóa. Trả về (results, published) đã commit."""
+    for attempt in range(COMMIT_RETRIES):
+        try:
+            results, published = apply_batch(driver, batch)
+            db.session.commit()
+            return results, published
+        except OperationalError:
+            db.session.rollback()
+            if attempt == COMMIT_RETRIES - 1:
+                raise
+            time.sleep(random.uniform(0.01, 0.05) * (attempt + 1))
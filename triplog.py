@@ -0,0 +1,379 @@
+# triplog.py - nhật ký thay đổi Trip chỉ ghi thêm (trip_events): ai đổi cột nào thành giá trị gì, lúc nào
+# Ghi Trip qua ORM được gom tự động (after_flush); UPDATE có điều kiện của dispatch.py gọi record().
+# Chỉ transaction đã commit mới vào buffer (after_commit; savepoint/transaction rollback thì bỏ), request không thêm
+# câu INSERT nào: thread nền ghi theo lô (1 executemany + 1 commit) khi buffer đủ FLUSH_SIZE, sau FLUSH_SECONDS,
+# hoặc khi tắt process (atexit).
+# Process chết giữa chừng: sự kiện được append vào file segment trong TRIPLOG_DIR trước khi vào buffer, segment chỉ
+# bị xóa sau khi lô của nó đã commit; lần start sau nạp lại segment còn sót (bỏ event_id đã có trong DB).
+# Segment đang dùng giữ flock -> nhiều worker dùng chung thư mục không nạp nhầm segment của nhau.
+# start() chỉ bật; thread ghi được tạo ở lần commit đầu tiên của từng process (pid) -> import app không tạo thread,
+# worker fork từ master (gunicorn --preload) có Writer riêng thay vì Writer của cha mà thread không chạy.
+# Dựng lại trạng thái: replay(trip_id, until) / replay_all(until) áp lần lượt các thay đổi theo (at, id).
+#   TRIPLOG=0 tắt; TRIPLOG_DIR (mặc định <instance_path>/triplog); TRIPLOG_FLUSH_SIZE; TRIPLOG_FLUSH_SECONDS; TRIPLOG_FSYNC=1
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import date, datetime
+
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.orm import Session
+
+from models import db, Trip, TripEvent
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: không khóa segment, chỉ nên chạy 1 process
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.getenv("TRIPLOG", "1") == "1"
+WAL_DIR = os.getenv("TRIPLOG_DIR")  # None -> thư mục instance của Flask, ngoài mã nguồn
+FLUSH_SIZE = int(os.getenv("TRIPLOG_FLUSH_SIZE", "200"))
+FLUSH_SECONDS = float(os.getenv("TRIPLOG_FLUSH_SECONDS", "2"))
+FSYNC = os.getenv("TRIPLOG_FSYNC", "0") == "1"  # 1: fsync từng lần append (chịu được mất điện, chậm hơn)
+
+# status mới -> loại sự kiện (update qua ORM)
+STATUS_KINDS = {"assigned": "assigned", "ongoing": "started", "completed": "finished", "cancelled": "cancelled"}
+COLUMNS = {c.key: c for c in Trip.__table__.columns}
+
+
+def _json_value(v):
+    return v.isoformat() if isinstance(v, (datetime, date)) else v
+
+
+def _actor():
+    from flask import has_request_context
+    from flask_login import current_user
+
+    if has_request_context() and current_user.is_authenticated:
+        return current_user.id
+    return None
+
+
+def _event(trip_id, kind, data, actor):
+    return {"event_id": uuid.uuid4().hex, "trip_id": trip_id, "kind": kind, "actor_id": actor,
+            "at": datetime.now().isoformat(), "data": {k: _json_value(v) for k, v in data.items()}}
+
+
+# ==== GOM THAY ĐỔI TRONG TRANSACTION ====
+def _current(session):
+    return session.get_nested_transaction() or session.get_transaction()
+
+
+def _pending(session):
+    return session.info.setdefault("triplog", [])
+
+
+def record(trip_id, kind, data):
+    """Thêm sự kiện cho thay đổi không đi qua ORM (UPDATE có điều kiện); vào log khi transaction commit."""
+    if _app is None:
+        return
+    session = db.session()
+    _pending(session).append((_current(session), _event(trip_id, kind, data, _actor())))
+
+
+def _collect(session, flush_context):
+    if _app is None:
+        return
+    txn, actor, out = _current(session), _actor(), []
+    for obj in session.new:
+        if isinstance(obj, Trip):
+            data = {k: getattr(obj, k) for k in COLUMNS if k != "id" and getattr(obj, k) is not None}
+            out.append(_event(obj.id, "created", data, actor))
+    for obj in session.dirty:
+        if isinstance(obj, Trip):
+            state = sa_inspect(obj)
+            data = {k: state.attrs[k].history.added[0] for k in COLUMNS if state.attrs[k].history.added}
+            if data:
+                out.append(_event(obj.id, STATUS_KINDS.get(data.get("status"), "updated"), data, actor))
+    for obj in session.deleted:
+        if isinstance(obj, Trip):
+            out.append(_event(obj.id, "deleted", {}, actor))
+    _pending(session).extend((txn, ev) for ev in out)
+
+
+def _inside(txn, outer):
+    while txn is not None:
+        if txn is outer:
+            return True
+        txn = txn.parent
+    return False
+
+
+def _after_soft_rollback(session, previous_transaction):
+    pending = session.info.get("triplog")
+    if pending:
+        pending[:] = [(t, ev) for t, ev in pending if not _inside(t, previous_transaction)]
+
+
+def _after_commit(session):
+    pending = session.info.pop("triplog", None)
+    if pending and _app is not None:
+        writer().append([ev for _, ev in pending])
+
+
+event.listen(Session, "after_flush", _collect)
+event.listen(Session, "after_soft_rollback", _after_soft_rollback)
+event.listen(Session, "after_commit", _after_commit)
+
+
+# ==== GHI THEO LÔ ====
+def _rows(events):
+    return [dict(ev, at=datetime.fromisoformat(ev["at"]), data=json.dumps(ev["data"], ensure_ascii=False))
+            for ev in events]
+
+
+class Writer(threading.Thread):
+    """Buffer trong process + segment trên đĩa; thread nền ghi DB theo lô."""
+
+    def __init__(self, app, wal_dir=WAL_DIR, flush_size=FLUSH_SIZE, flush_seconds=FLUSH_SECONDS):
+        super().__init__(name="triplog", daemon=True)
+        self.app = app
+        self.wal_dir = wal_dir or os.path.join(app.instance_path, "triplog")
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._buf = []
+        self._seg = None        # file segment đang ghi (chứa đúng các sự kiện trong _buf)
+        self._seq = 0
+        self._retry = []        # [(path, events)] lô ghi DB lỗi, thử lại ở lần flush sau
+        self._recovering = set()  # segment có thể đã commit một phần/toàn bộ -> bỏ event_id trùng khi ghi
+        self._stopping = False
+        self.written = self.errors = self.recovered = 0
+        os.makedirs(self.wal_dir, exist_ok=True)
+
+    # -- phía request --
+    def append(self, events):
+        lines = "".join(json.dumps(ev, ensure_ascii=False) + "\n" for ev in events)
+        with self._cond:
+            if self._seg is None:
+                self._seq += 1
+                path = os.path.join(self.wal_dir, f"trip-events-{os.getpid()}-{int(time.time())}-{self._seq:06d}.wal")
+                self._seg = open(path, "a", encoding="utf-8")
+                if fcntl is not None:
+                    fcntl.flock(self._seg, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self._seg.write(lines)
+            self._seg.flush()
+            if FSYNC:
+                os.fsync(self._seg.fileno())
+            self._buf.extend(events)
+            if len(self._buf) >= self.flush_size:
+                self._cond.notify()
+
+    def buffered(self):
+        with self._cond:
+            return len(self._buf) + sum(len(evs) for _, evs in self._retry)
+
+    # -- thread nền --
+    def _insert(self, events, dedupe=False):
+        with self.app.app_context():
+            try:
+                rows = _rows(events)
+                if dedupe:  # segment nạp lại: lô có thể đã commit trước khi process chết
+                    have = set()
+                    ids = [r["event_id"] for r in rows]
+                    for i in range(0, len(ids), 500):
+                        have.update(db.session.execute(
+                            db.select(TripEvent.event_id).where(TripEvent.event_id.in_(ids[i:i + 500]))).scalars())
+                    rows = [r for r in rows if r["event_id"] not in have]
+                if rows:
+                    db.session.execute(db.insert(TripEvent), rows)
+                db.session.commit()
+                return len(rows)
+            finally:
+                db.session.remove()
+
+    def flush(self):
+        """Ghi mọi sự kiện đang chờ; segment của lô (vẫn giữ flock) bị xóa sau khi commit thành công."""
+        with self._flush_lock:
+            with self._cond:
+                if self._buf:
+                    self._retry.append((self._seg, self._buf))
+                    self._buf, self._seg = [], None
+                batches, self._retry = self._retry, []
+            for i, (seg, events) in enumerate(batches):
+                t0 = time.perf_counter()
+                try:
+                    self.written += self._insert(events, dedupe=seg.name in self._recovering)
+                except Exception:
+                    self.errors += 1
+                    log.exception("triplog: ghi %d sự kiện thất bại, thử lại sau", len(events))
+                    self._recovering.add(seg.name)  # có thể đã commit trước khi lỗi
+                    with self._cond:
+                        self._retry[:0] = batches[i:]
+                    return
+                metrics.registry.observe("sc_triplog_flush_seconds", time.perf_counter() - t0,
+                                         "Trip event batch insert latency.")
+                self._recovering.discard(seg.name)
+                os.remove(seg.name)
+                seg.close()
+
+    def recover(self):
+        """Nạp các segment còn sót của process đã chết (không còn flock) vào hàng chờ ghi; trả về số sự kiện."""
+        found = 0
+        with self._flush_lock:
+            for path in sorted(glob.glob(os.path.join(self.wal_dir, "trip-events-*.wal"))):
+                if fcntl is None and os.path.basename(path).startswith(f"trip-events-{os.getpid()}-"):
+                    continue
+                try:
+                    f = open(path, "r", encoding="utf-8")
+                except FileNotFoundError:
+                    continue  # worker khác vừa ghi xong và xóa
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        f.close()
+                        continue  # segment của worker còn sống (hoặc của chính process này)
+                if not os.path.exists(path):
+                    f.close()
+                    continue
+                events = []
+                for line in f:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        break  # dòng cuối ghi dở lúc process chết
+                self._recovering.add(path)
+                with self._cond:
+                    self._retry.append((f, events))
+                found += len(events)
+        self.recovered += found
+        return found
+
+    def run(self):
+        try:
+            if self.recover():
+                self.flush()
+        except Exception:
+            log.exception("triplog: nạp lại segment thất bại")
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._buf) < self.flush_size:
+                    self._cond.wait(self.flush_seconds)
+                stopping = self._stopping
+            try:
+                self.flush()
+            except Exception:
+                log.exception("triplog: flush thất bại")
+            if stopping:
+                return
+
+    def stop(self, timeout=10.0):
+        """Ghi nốt buffer rồi dừng thread (atexit)."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self.is_alive():
+            self.join(timeout)
+        else:
+            self.flush()
+
+
+_app = None      # start() đã gọi trong process này (hoặc process cha trước khi fork)
+_writer = None   # Writer của process _pid
+_pid = None
+_start_lock = threading.Lock()
+
+
+def _own_writer():
+    # Writer thừa hưởng từ process cha không thuộc process này (thread của nó không chạy ở đây)
+    return _writer if _pid == os.getpid() else None
+
+
+def writer():
+    """Writer của process hiện tại, tạo + chạy thread ở lần gọi đầu tiên sau start() hoặc sau fork."""
+    global _writer, _pid
+    w = _own_writer()
+    if w is None:
+        with _start_lock:
+            w = _own_writer()
+            if w is None:
+                w = Writer(_app)
+                w.start()
+                _writer, _pid = w, os.getpid()
+    return w
+
+
+def _stop():
+    # atexit được kế thừa qua fork: chỉ dừng Writer của chính process này
+    w = _own_writer()
+    if w is not None:
+        w.stop()
+
+
+atexit.register(_stop)
+
+
+def _collect_metrics():
+    w = _own_writer()
+    if w is None:
+        return []
+    return [
+        ("sc_triplog_buffered", "gauge", "Trip events waiting to be written.", [({}, w.buffered())]),
+        ("sc_triplog_written_total", "counter", "Trip events written to trip_events.", [({}, w.written)]),
+        ("sc_triplog_flush_errors_total", "counter", "Trip event batches that failed to insert.", [({}, w.errors)]),
+        ("sc_triplog_recovered_total", "counter", "Trip events reloaded from leftover segments.", [({}, w.recovered)]),
+    ]
+
+
+metrics.registry.add_collector(_collect_metrics)
+
+
+def start(app):
+    """Bật ghi nhật ký; không tạo thread (xem writer())."""
+    global _app
+    _app = app
+
+
+# ==== ĐỌC / DỰNG LẠI ====
+def _apply(state, ev):
+    if ev.kind == "deleted":
+        return None
+    state = dict(state or {}, id=ev.trip_id)
+    for k, v in json.loads(ev.data).items():
+        col = COLUMNS.get(k)
+        if v is not None and col is not None and isinstance(col.type, db.DateTime):
+            v = datetime.fromisoformat(v)
+        state[k] = v
+    return state
+
+
+def history(trip_id, until=None):
+    """Các TripEvent của 1 chuyến theo thứ tự (at, id); `until`: chỉ lấy sự kiện trước mốc này."""
+    stmt = db.select(TripEvent).where(TripEvent.trip_id == trip_id)
+    if until is not None:
+        stmt = stmt.where(TripEvent.at < until)
+    return db.session.execute(stmt.order_by(TripEvent.at, TripEvent.id)).scalars().all()
+
+
+def replay(trip_id, until=None):
+    """Trạng thái (dict cột -> giá trị) của chuyến dựng lại từ log; None nếu chưa có sự kiện hoặc đã bị xóa."""
+    state = None
+    for ev in history(trip_id, until):
+        state = _apply(state, ev)
+    return state
+
+
+def replay_all(until=None):
+    """(trip_id, trạng thái) của mọi chuyến có trong log tại mốc `until`; đọc theo lô, không nạp hết vào bộ nhớ."""
+    stmt = db.select(TripEvent).order_by(TripEvent.trip_id, TripEvent.at, TripEvent.id)
+    if until is not None:
+        stmt = stmt.where(TripEvent.at < until)
+    cur, state = None, None
+    for ev in db.session.execute(stmt.execution_options(yield_per=1000)).scalars():
+        if ev.trip_id != cur:
+            if cur is not None and state is not None:
+                yield cur, state
+            cur, state = ev.trip_id, None
+        state = _apply(state, ev)
+    if cur is not None and state is not None:
+        yield cur, state